@@ -25,6 +25,7 @@ from project.apps.core.commander import Commander
 from project.apps.core.constants import BotCommands
 from project.apps.core.modules import TelegramMenu
 from project.apps.core.utils.messages import process_telegram_message
+from project.apps.signals.migrations import migrate
 
 
 logging_level = logging.DEBUG if config.DEBUG else logging.INFO
@@ -88,6 +89,7 @@ def main() -> None:
 
     logging.info('Creating database...')
     db.Base.metadata.create_all(db.db_engine, checkfirst=True)
+    migrate()
 
     logging.info('Setting up commander...')
 
@@ -0,0 +1,14 @@
+from ..utils import split_code_block
+
+
+def test_split_code_block():
+    text = '\n'.join(f'`{i}`' * 10 for i in range(100))
+    messages = split_code_block(text, title='*Title*', max_length=300)
+
+    assert len(messages) > 1
+    assert all(len(message) <= 300 for message in messages)
+    assert all(message.startswith('*Title*\n```\n') and message.endswith('\n```') for message in messages)
+    prefix_length = len('*Title*\n```\n')
+    suffix_length = len('\n```')
+    assert '\n'.join(message[prefix_length:-suffix_length] for message in messages) == text.replace('`', '\\`')
+    assert split_code_block('text') == ['```\ntext\n```']
@@ -5,6 +5,10 @@ from telegram.helpers import escape_markdown as telegram_escape_markdown
 from .base import BaseMessenger
 
 
+# Telegram doesn't send longer messages.
+MAX_MESSAGE_LENGTH = 4096
+
+
 class ProgressBar:
     messenger: BaseMessenger
     title: str
@@ -57,3 +61,34 @@ class ProgressBar:
 
 def escape_markdown(text: str, entity_type: typing.Optional[str] = None) -> str:
     return telegram_escape_markdown(text, version=2, entity_type=entity_type)
+
+
+def split_code_block(text: str, *, title: str = '', max_length: int = MAX_MESSAGE_LENGTH) -> list[str]:
+    """
+    Returns Markdown messages with the escaped text in code blocks that are split by lines to fit `max_length`.
+    `title` is put at the beginning of every message as it is.
+    """
+
+    prefix = f'{title}\n```\n' if title else '```\n'
+    suffix = '\n```'
+    max_block_length = max_length - len(prefix) - len(suffix)
+    half_length = max_block_length // 2
+    lines = []
+
+    for line in text.splitlines():
+        # Escaping doubles the length at most.
+        while len(escaped_line := escape_markdown(line, entity_type='pre')) > max_block_length:
+            lines.append(escape_markdown(line[:half_length], entity_type='pre'))
+            line = line[half_length:]
+
+        lines.append(escaped_line)
+
+    blocks: list[str] = []
+
+    for line in lines:
+        if blocks and len(blocks[-1]) + 1 + len(line) <= max_block_length:
+            blocks[-1] += '\n' + line
+        else:
+            blocks.append(line)
+
+    return [prefix + block + suffix for block in blocks or ('',)]
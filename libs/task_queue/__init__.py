@@ -1,4 +1,7 @@
 from .base import *
+from .batching import *
 from .constants import *
 from .dto import *
 from .implementation import *
+from .metrics import *
+from .serializers import *
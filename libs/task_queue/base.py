@@ -1,58 +1,566 @@
 import abc
 import bisect
 import datetime
+import logging
 import typing
-from heapq import heappop, heappush
+from collections import Counter, deque
+from heapq import heapify, heappop, heappush
+from itertools import count
 from queue import Empty, Queue
+from time import monotonic
 
-from .constants import TaskPriorities
-from .dto import Task
+from .batching import BatchTask, get_batching
+from .constants import MergePolicies, OverflowPolicies, TaskOptions, TaskPriorities, TaskStatuses
+from .dto import Capacity, Task
+from .metrics import TaskMetrics
 
 
 __all__ = (
     'BaseTaskQueue',
     'BaseWorker',
+    'FairQueue',
+    'OwnedTaskQueue',
     'TaskPriorityQueue',
 )
 
 
+class FairQueue:
+    """
+    Entries of one priority by owners of tasks (`TaskOptions.OWNER`).
+    Owners are served by stride scheduling: every served task advances the pass of its owner by `1 / weight`,
+    and the owner with the smallest pass goes next. An owner that becomes active starts from the pass
+    of the last served owner, so idle owners don't save up turns.
+    """
+
+    queues: typing.Dict[typing.Hashable, typing.Deque[list]]
+    passes: typing.Dict[typing.Hashable, float]
+    weights: typing.Dict[typing.Hashable, float]
+    virtual_time: float
+
+    def __init__(self, weights: typing.Optional[typing.Dict[typing.Hashable, float]] = None) -> None:
+        self.queues = {}
+        self.passes = {}
+        self.weights = {} if weights is None else weights
+        self.virtual_time = 0.0
+
+    def __bool__(self) -> bool:
+        return bool(self.queues)
+
+    def append(self, entry: list) -> None:
+        owner = entry[0].options.get(TaskOptions.OWNER)
+        entries = self.queues.get(owner)
+
+        if entries is None:
+            entries = self.queues[owner] = deque()
+            self.passes[owner] = max(self.passes.get(owner, 0.0), self.virtual_time)
+
+        entries.append(entry)
+
+    def peek(self) -> list:
+        return self.queues[self._get_next_owner()][0]
+
+    def popleft(self) -> list:
+        owner = self._get_next_owner()
+        entries = self.queues[owner]
+        entry = entries.popleft()
+
+        if not entries:
+            del self.queues[owner]
+
+        # Removed entries don't take turns.
+        if entry[0] is not None:
+            self.virtual_time = self.passes[owner]
+            self.passes[owner] += 1 / self.weights.get(owner, 1)
+
+        return entry
+
+    def get_heads(self) -> typing.Iterator[list]:
+        for entries in self.queues.values():
+            for entry in entries:
+                if entry[0] is not None:
+                    yield entry
+                    break
+
+    def compact(self) -> None:
+        for owner, entries in tuple(self.queues.items()):
+            entries = deque(entry for entry in entries if entry[0] is not None)
+
+            if entries:
+                self.queues[owner] = entries
+            else:
+                del self.queues[owner]
+
+    def _get_next_owner(self) -> typing.Hashable:
+        return min(self.queues, key=self.passes.__getitem__)
+
+
 class TaskPriorityQueue(Queue):
-    queue_map: typing.Dict[int, typing.List[tuple[typing.Any, Task]]]
+    """
+    Tasks that are not due yet wait in `delayed_tasks` and are moved
+    to the `FairQueue` of their priority in `ready_map` when they come due,
+    so a delayed task never hides ready tasks with the same priority.
+    Within a priority, owners of tasks share the queue according to `owner_weights` (1 by default).
+    `delayed_tasks` is a heap by the monotonic time that `run_after` corresponds to when the task is put,
+    so changes of the wall clock don't affect pending tasks.
+
+    Both structures keep entries (`[task]`) instead of tasks. A canceled task is removed from `entry_map`
+    and its entry is emptied, so the queue releases it at once and skips the entry later.
+    Empty entries are compacted when they outnumber the live ones.
+
+    `capacities` limits bytes of arrays held by pending tasks per priority.
+    A task that doesn't fit is degraded by its `TaskOptions.DEGRADE` callable (if it's passed)
+    and then the overflow policy of the capacity drops the oldest pending tasks or the new one.
+    Dropped tasks are canceled.
+
+    A task of a batchable target (see `batchable`) is returned as a `BatchTask`
+    with other pending tasks of the target that are due within `Batching.max_wait`.
+
+    `aging` raises the effective priority of a ready task by one level for every period of waiting
+    configured for its priority, so tasks with low priorities aren't starved.
+    Tasks with the same effective priority are served from the oldest one.
+    Tasks served ahead of their priority are counted in `task_metrics`.
+    """
+
+    ready_map: typing.Dict[int, FairQueue]
+    delayed_tasks: typing.List[tuple[float, int, list]]
+    entry_map: typing.Dict[Task, list]
+    pending_map: typing.Dict[typing.Hashable, Task]
+    batch_map: typing.Dict[typing.Callable, typing.Dict[Task, None]]
     priorities: typing.List[int]
+    capacities: typing.Dict[int, Capacity]
+    aging: typing.Dict[int, datetime.timedelta]
+    owner_weights: typing.Dict[typing.Hashable, float]
+    task_metrics: typing.Optional[TaskMetrics]
+    weighted_tasks: typing.Dict[int, typing.Dict[Task, int]]
+    weights: typing.Dict[int, int]
+    compaction_threshold: int = 100
+    _counter: typing.Iterator[int]
+    _removed: int
+    _wake_ups: int
+
+    def __init__(
+        self,
+        capacities: typing.Optional[typing.Dict[int, Capacity]] = None,
+        aging: typing.Optional[typing.Dict[int, datetime.timedelta]] = None,
+        task_metrics: typing.Optional[TaskMetrics] = None,
+        owner_weights: typing.Optional[typing.Dict[typing.Hashable, float]] = None,
+    ) -> None:
+        super().__init__()
+        self.capacities = {} if capacities is None else capacities
+        self.aging = {} if aging is None else aging
+        self.owner_weights = {} if owner_weights is None else owner_weights
+        self.task_metrics = task_metrics
+
+        if self.task_metrics is not None and self.aging:
+            self.task_metrics.set_aging(self.aging)
 
     def _init(self, maxsize) -> None:
-        self.queue_map = {}
+        self.ready_map = {}
+        self.delayed_tasks = []
+        self.entry_map = {}
+        self.pending_map = {}
+        self.batch_map = {}
         self.priorities = []
+        self.weighted_tasks = {}
+        self.weights = {}
+        self._counter = count()
+        self._removed = 0
+        self._wake_ups = 0
+
+    def put(self, task: Task) -> Task:  # type: ignore
+        """
+        It never blocks, because the capacity is kept by dropping tasks (see `Capacity`).
+        Returns the task that is in the queue after putting.
+        It's a pending task with the same `TaskOptions.DEDUP_KEY` if the new task is merged into it.
+        The new task is returned canceled if it's dropped because of its capacity.
+        """
+
+        dropped_tasks = []
+
+        with self.not_full:
+            queued_task, replaced_task = self._merge(task)
+
+            if replaced_task is not None:
+                dropped_tasks.append(replaced_task)
+
+            if queued_task is None:
+                queued_task = task
+
+                if self._make_room(task, dropped_tasks):
+                    self._put(task)
+                    self.unfinished_tasks += 1
+                else:
+                    self._forget(task)
+                    dropped_tasks.append(task)
+
+        # They are canceled after releasing the mutex, because canceling calls `discard`.
+        for dropped_task in dropped_tasks:
+            dropped_task.cancel()
+
+        return queued_task
+
+    def get(
+        self,
+        block: bool = True,
+        timeout: typing.Optional[float] = None,
+        priorities: typing.Optional[typing.Sequence[int]] = None,
+    ) -> Task:
+        """
+        Blocks until a task is ready, i.e. until `put` is called or the earliest `run_after` comes due.
+        `wake_up` interrupts all waiting callers with `Empty`.
+        If `priorities` is passed, only tasks with these priorities are returned in the given order.
+        """
+
+        with self.not_empty:
+            wake_ups = self._wake_ups
+            deadline = None if timeout is None else monotonic() + timeout
+
+            while True:
+                try:
+                    task = self._get(priorities)
+                except Empty:
+                    pass
+                else:
+                    self.not_full.notify()
+                    return task
+
+                if not block or wake_ups != self._wake_ups:
+                    raise Empty
+
+                delay = self._get_delay()
+
+                if deadline is not None:
+                    remaining = deadline - monotonic()
+
+                    if remaining <= 0:
+                        raise Empty
+
+                    delay = remaining if delay is None else min(delay, remaining)
+
+                self.not_empty.wait(delay)
+
+    def wake_up(self) -> None:
+        with self.not_empty:
+            self._wake_ups += 1
+            self.not_empty.notify_all()
+
+    def discard(self, task: Task) -> None:
+        with self.mutex:
+            self._remove(task)
+
+    def get_waiting_time(self, priorities: typing.Optional[typing.Sequence[int]] = None) -> float:
+        """
+        Returns seconds that the oldest ready task with `priorities` has been waiting for.
+        """
+
+        with self.mutex:
+            self._promote_due_tasks()
+            now = datetime.datetime.now()
+            waiting_time = 0.0
+
+            for priority in self.priorities if priorities is None else priorities:
+                if priority in self.ready_map:
+                    for entry in self.ready_map[priority].get_heads():
+                        waiting_time = max(waiting_time, (now - entry[0].run_after).total_seconds())
+
+            return waiting_time
+
+    def get_ready_count(self, priorities: typing.Optional[typing.Sequence[int]] = None) -> int:
+        """
+        Returns the number of ready tasks with `priorities`.
+        """
+
+        with self.mutex:
+            self._promote_due_tasks()
+
+            return sum(
+                1
+                for priority in (self.priorities if priorities is None else priorities)
+                if priority in self.ready_map
+                for entries in self.ready_map[priority].queues.values()
+                for entry in entries
+                if entry[0] is not None
+            )
+
+    def get_owner_depths(self) -> typing.Dict[typing.Hashable, int]:
+        """
+        Returns numbers of pending tasks by owners.
+        """
+
+        with self.mutex:
+            return Counter(task.options.get(TaskOptions.OWNER) for task in self.entry_map)
 
     def _qsize(self) -> int:
-        return sum(len(x) for x in self.queue_map.values())
+        return len(self.entry_map)
 
     def _put(self, task: Task) -> None:
-        if task.priority not in self.queue_map:
-            self.queue_map[task.priority] = []
-            bisect.insort(self.priorities, task.priority)
-
-        heappush(
-            self.queue_map[task.priority],
-            (
-                task.run_after,
-                task,
-            ),
-        )
+        self._remove(task)
+
+        entry = [task]
+        self.entry_map[task] = entry
+        self._hold(task)
+        task.set_cancel_callback(self.discard)
+
+        if self._is_batched(task):
+            self.batch_map.setdefault(task.target, {})[task] = None
+
+        delay = (task.run_after - datetime.datetime.now()).total_seconds()
+
+        if delay <= 0:
+            self._put_ready(entry)
+        else:
+            heappush(self.delayed_tasks, (monotonic() + delay, next(self._counter), entry))
+
+        # Callers can wait for different priorities, so all of them have to check the new task.
+        self.not_empty.notify_all()
+
+    def _put_ready(self, entry: list) -> None:
+        priority = entry[0].priority
+
+        if priority not in self.ready_map:
+            self.ready_map[priority] = FairQueue(self.owner_weights)
+            bisect.insort(self.priorities, priority)
+
+        self.ready_map[priority].append(entry)
+
+    def _get(self, priorities: typing.Optional[typing.Sequence[int]] = None) -> Task:
+        self._promote_due_tasks()
+
+        if priorities is None:
+            priorities = self.priorities
+
+        if self.aging:
+            priorities = self._age(priorities)
+
+        for priority in priorities:
+            ready_entries = self.ready_map.get(priority)
+
+            while ready_entries:
+                task = ready_entries.popleft()[0]
+
+                if task is None:
+                    self._removed -= 1
+                    continue
+
+                del self.entry_map[task]
+                self._forget(task)
+                self._release(task)
+
+                if self._is_batched(task):
+                    return self._collect_batch(task)
+
+                return task
+
+        raise Empty
+
+    def _remove(self, task: Task) -> None:
+        entry = self.entry_map.pop(task, None)
+
+        if entry is None:
+            return
+
+        entry[0] = None
+        self._removed += 1
+        self._forget(task)
+        self._release(task)
+
+        if self._removed > max(len(self.entry_map), self.compaction_threshold):
+            self._compact()
+
+    def _compact(self) -> None:
+        for ready_entries in self.ready_map.values():
+            ready_entries.compact()
+
+        self.delayed_tasks = [item for item in self.delayed_tasks if item[2][0] is not None]
+        heapify(self.delayed_tasks)
+        self._removed = 0
+
+    def _merge(self, task: Task) -> tuple[typing.Optional[Task], typing.Optional[Task]]:
+        """
+        Returns the pending task that the new task is merged into and the pending task that is replaced.
+        """
+
+        key = task.options.get(TaskOptions.DEDUP_KEY)
+
+        if key is None:
+            return None, None
+
+        pending_task = self.pending_map.get(key)
+
+        if pending_task is None or pending_task.status == TaskStatuses.CANCELED:
+            self.pending_map[key] = task
+            return None, None
+
+        merge_policy = task.options.get(TaskOptions.MERGE_POLICY, MergePolicies.DROP_NEW)
+
+        if merge_policy == MergePolicies.DROP_NEW:
+            return pending_task, None
+
+        if merge_policy == MergePolicies.KEEP_LATEST_ARGS:
+            if pending_task.replace_params(args=task.args, kwargs=task.kwargs):
+                return pending_task, None
+
+            # It's started by a worker, so the new task is queued.
+            self.pending_map[key] = task
+            return None, None
+
+        if merge_policy == MergePolicies.REPLACE_OLD:
+            self._remove(pending_task)
+            self.pending_map[key] = task
+            return None, pending_task
+
+        raise ValueError(f'Unknown merge policy "{merge_policy}".')
+
+    def _forget(self, task: Task) -> None:
+        key = task.options.get(TaskOptions.DEDUP_KEY)
+
+        if key is not None and self.pending_map.get(key) is task:
+            del self.pending_map[key]
+
+        if not self._is_batched(task):
+            return
+
+        batched_tasks = self.batch_map.get(task.target)
+
+        if batched_tasks is not None and task in batched_tasks:
+            del batched_tasks[task]
+
+            if not batched_tasks:
+                del self.batch_map[task.target]
+
+    @staticmethod
+    def _is_batched(task: Task) -> bool:
+        return get_batching(task.target) is not None and not isinstance(task, BatchTask)
+
+    def _collect_batch(self, task: Task) -> BatchTask:
+        batching = get_batching(task.target)
+        assert batching is not None
+
+        tasks = [task]
+        max_run_after = datetime.datetime.now() + batching.max_wait
+
+        for batched_task in tuple(self.batch_map.get(task.target, ())):
+            if len(tasks) >= batching.max_size:
+                break
+
+            if batched_task.run_after <= max_run_after:
+                self._remove(batched_task)
+                tasks.append(batched_task)
+
+        return BatchTask.create_from_tasks(tasks)
+
+    def _make_room(self, task: Task, dropped_tasks: typing.List[Task]) -> bool:
+        """
+        Returns `False` if the task doesn't fit into its capacity. Evicted tasks are added to `dropped_tasks`.
+        """
+
+        capacity = self.capacities.get(task.priority)
+
+        if capacity is None:
+            return True
+
+        weight = task.weight
+        free_bytes = capacity.max_bytes - self.weights.get(task.priority, 0)
+
+        if weight <= free_bytes:
+            return True
+
+        degrade = task.options.get(TaskOptions.DEGRADE)
+
+        if degrade is not None:
+            degrade(task)
+            weight = task.weight
+
+            if weight <= free_bytes:
+                logging.debug('%s is degraded to fit into the queue', task)
+                return True
+
+        if capacity.overflow_policy == OverflowPolicies.DROP_NEW or weight > capacity.max_bytes:
+            logging.warning('%s is dropped, because the queue is full', task)
+            return False
+
+        if capacity.overflow_policy != OverflowPolicies.DROP_OLDEST:
+            raise ValueError(f'Unknown overflow policy "{capacity.overflow_policy}".')
+
+        weighted_tasks = self.weighted_tasks[task.priority]
+
+        while weight > capacity.max_bytes - self.weights[task.priority]:
+            oldest_task = next(iter(weighted_tasks))
+            logging.warning('%s is dropped, because the queue is full', oldest_task)
+            self._remove(oldest_task)
+            dropped_tasks.append(oldest_task)
+
+        return True
+
+    def _hold(self, task: Task) -> None:
+        if task.priority not in self.capacities:
+            return
+
+        weight = task.weight
+
+        if weight:
+            self.weighted_tasks.setdefault(task.priority, {})[task] = weight
+            self.weights[task.priority] = self.weights.get(task.priority, 0) + weight
+
+    def _release(self, task: Task) -> None:
+        weighted_tasks = self.weighted_tasks.get(task.priority)
+
+        if weighted_tasks and task in weighted_tasks:
+            self.weights[task.priority] -= weighted_tasks.pop(task)
+
+    def _promote_due_tasks(self) -> None:
+        now = monotonic()
+
+        while self.delayed_tasks and self.delayed_tasks[0][0] <= now:
+            entry = heappop(self.delayed_tasks)[2]
+
+            if entry[0] is None:
+                self._removed -= 1
+            else:
+                self._put_ready(entry)
+
+    def _age(self, priorities: typing.Sequence[int]) -> typing.Sequence[int]:
+        """
+        Returns `priorities` or only the priority of an aged task that goes ahead of them.
+        """
 
-    def _get(self) -> typing.Optional[Task]:
         now = datetime.datetime.now()
+        candidates = []
 
-        for priority in self.priorities:
-            queue = self.queue_map[priority]
+        for index, priority in enumerate(priorities):
+            ready_entries = self.ready_map.get(priority)
 
-            if not queue:
+            while ready_entries and ready_entries.peek()[0] is None:
+                ready_entries.popleft()
+                self._removed -= 1
+
+            if not ready_entries:
                 continue
 
-            if queue[0][1].run_after <= now:
-                return heappop(queue)[1]
+            task = ready_entries.peek()[0]
+            waiting_time = now - task.run_after
+            period = self.aging.get(priority)
+            levels = int(waiting_time / period) if period and waiting_time > datetime.timedelta() else 0
+            candidates.append((index - levels, -waiting_time.total_seconds(), index, task))
 
-        raise Empty
+        if not candidates:
+            return priorities
+
+        *_, index, task = min(candidates)
+
+        if index == candidates[0][2]:
+            return priorities
+
+        if self.task_metrics is not None:
+            self.task_metrics.add_aged_task(target_name=task.target_name, priority=task.priority)
+
+        return (priorities[index],)
+
+    def _get_delay(self) -> typing.Optional[float]:
+        if not self.delayed_tasks:
+            return None
+
+        return max(self.delayed_tasks[0][0] - monotonic(), 0)
 
 
 class BaseTaskQueue(abc.ABC):
@@ -68,30 +576,116 @@ class BaseTaskQueue(abc.ABC):
         *,
         priority: int = TaskPriorities.MEDIUM,
         run_after: typing.Optional[datetime.datetime] = None,
-    ) -> typing.Optional[Task]:
+        options: typing.Optional[typing.Dict[str, typing.Any]] = None,
+        dedup_key: typing.Optional[typing.Hashable] = None,
+        merge_policy: str = MergePolicies.DROP_NEW,
+    ) -> Task:
+        """
+        Pending tasks with the same `dedup_key` are collapsed according to `merge_policy`.
+        In this case the returned task is the one that stays in the queue.
+        """
+
         if run_after is None:
             run_after = datetime.datetime.now()
 
+        batching = get_batching(target)
+
+        if batching is not None:
+            run_after += batching.max_wait
+
+        # The caller's options are not changed.
+        options = dict(options or {})
+
+        if dedup_key is not None:
+            options[TaskOptions.DEDUP_KEY] = dedup_key
+            options[TaskOptions.MERGE_POLICY] = merge_policy
+
         task = Task.create(
             priority=priority,
             target=target,
             args=args,
             kwargs=kwargs,
             run_after=run_after,
+            options=options,
         )
 
-        self.put_task(task)
-
-        return task
+        return self.put_task(task)
 
     @abc.abstractmethod
-    def put_task(self, task: Task) -> None:
+    def put_task(self, task: Task) -> Task:
         pass
 
     @abc.abstractmethod
-    def get(self) -> typing.Optional[Task]:
+    def get(
+        self,
+        *,
+        block: bool = False,
+        timeout: typing.Optional[float] = None,
+        priorities: typing.Optional[typing.Sequence[int]] = None,
+    ) -> typing.Optional[Task]:
         pass
 
+    def wake_up(self) -> None:
+        pass
+
+    def get_waiting_time(self, priorities: typing.Optional[typing.Sequence[int]] = None) -> float:
+        return 0.0
+
+    def get_ready_count(self, priorities: typing.Optional[typing.Sequence[int]] = None) -> int:
+        return 0
+
+    def get_owner_depths(self) -> typing.Dict[typing.Hashable, int]:
+        return {}
+
+    def register_instance(self, name: str, instance: typing.Any) -> None:
+        """
+        Queues that persist tasks find bound methods of `instance` by `name`.
+        """
+
+    def close(self) -> None:
+        pass
+
+
+class OwnedTaskQueue(BaseTaskQueue):
+    """
+    A view of `task_queue` that tags all put tasks with `owner` unless they have an owner already.
+    """
+
+    task_queue: BaseTaskQueue
+    owner: typing.Hashable
+
+    def __init__(self, task_queue: BaseTaskQueue, *, owner: typing.Hashable) -> None:
+        self.task_queue = task_queue
+        self.owner = owner
+
+    def __len__(self) -> int:
+        return len(self.task_queue)
+
+    def put_task(self, task: Task) -> Task:
+        task.options.setdefault(TaskOptions.OWNER, self.owner)
+        return self.task_queue.put_task(task)
+
+    def get(
+        self,
+        *,
+        block: bool = False,
+        timeout: typing.Optional[float] = None,
+        priorities: typing.Optional[typing.Sequence[int]] = None,
+    ) -> typing.Optional[Task]:
+        return self.task_queue.get(block=block, timeout=timeout, priorities=priorities)
+
+    def wake_up(self) -> None:
+        self.task_queue.wake_up()
+
+    def get_waiting_time(self, priorities: typing.Optional[typing.Sequence[int]] = None) -> float:
+        return self.task_queue.get_waiting_time(priorities)
+
+    def get_ready_count(self, priorities: typing.Optional[typing.Sequence[int]] = None) -> int:
+        return self.task_queue.get_ready_count(priorities)
+
+    def get_owner_depths(self) -> typing.Dict[typing.Hashable, int]:
+        return self.task_queue.get_owner_depths()
+
 
 class BaseWorker(abc.ABC):
     @property
@@ -0,0 +1,98 @@
+import datetime
+import typing
+from dataclasses import dataclass, field
+
+from . import constants
+from .dto import Task
+
+
+__all__ = (
+    'Batching',
+    'BatchTask',
+    'batchable',
+    'get_batching',
+)
+
+
+@dataclass(frozen=True, kw_only=True)
+class Batching:
+    """
+    Tasks of a batchable target wait up to `max_wait` for other tasks of the target,
+    and up to `max_size` of them run as one `BatchTask`.
+    """
+
+    max_size: int
+    max_wait: datetime.timedelta
+
+
+def batchable(*, max_size: int, max_wait: datetime.timedelta) -> typing.Callable:
+    """
+    Marks a target that takes a list of items as the first argument.
+    A task of the target is put with one item in `args` and the target is called with items of the batch.
+    Keyword arguments are taken from the first task of the batch.
+    """
+
+    def _decorator(target: typing.Callable) -> typing.Callable:
+        setattr(target, 'batching', Batching(max_size=max_size, max_wait=max_wait))
+        return target
+
+    return _decorator
+
+
+def get_batching(target: typing.Callable) -> typing.Optional[Batching]:
+    batching = getattr(target, 'batching', None)
+
+    return batching if isinstance(batching, Batching) else None
+
+
+@dataclass(kw_only=True, eq=False, slots=True)
+class BatchTask(Task):
+    """
+    Statuses, results and errors of `tasks` follow the batch. Canceled tasks are excluded when the batch starts.
+    Tasks are finished by `resolve_future`, because the status of the batch is final only after its retries.
+    """
+
+    tasks: typing.List[Task] = field(
+        default_factory=list,
+    )
+
+    @classmethod
+    def create_from_tasks(cls, tasks: typing.List[Task]) -> 'BatchTask':
+        first_task = tasks[0]
+        options = dict(first_task.options)
+        options.pop(constants.TaskOptions.DEDUP_KEY, None)
+        options.pop(constants.TaskOptions.MERGE_POLICY, None)
+
+        return cls(
+            priority=first_task.priority,
+            target=first_task.target,
+            kwargs=first_task.kwargs,
+            run_after=first_task.run_after,
+            options=options,
+            tasks=tasks,
+        )
+
+    def _start(self) -> bool:
+        self.tasks = [task for task in self.tasks if task._start()]
+
+        if not self.tasks:
+            return False
+
+        self.args = ([task.args[0] for task in self.tasks],)
+
+        return Task._start(self)
+
+    def resolve_future(self) -> None:
+        Task.resolve_future(self)
+
+        with self._lock:
+            status = self._status
+            result = self.result
+            error = self.error
+
+        if status not in (constants.TaskStatuses.FINISHED, constants.TaskStatuses.FAILED):
+            return
+
+        for task in self.tasks:
+            task._finish(result=result, error=error)
+            task.resolve_future()
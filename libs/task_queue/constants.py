@@ -1,4 +1,7 @@
 __all__ = (
+    'MergePolicies',
+    'OverflowPolicies',
+    'TaskOptions',
     'TaskPriorities',
     'TaskStatuses',
 )
@@ -17,3 +20,26 @@ class TaskStatuses:
     FINISHED = 'finished'
     FAILED = 'failed'
     CANCELED = 'canceled'
+
+
+class TaskOptions:
+    USE_PROCESS_POOL = 'use_process_pool'
+    DEDUP_KEY = 'dedup_key'
+    MERGE_POLICY = 'merge_policy'
+    DEGRADE = 'degrade'
+    DEADLINE = 'deadline'
+    RATE_LIMIT_KEY = 'rate_limit_key'
+    RATE_LIMIT_IS_BOOKED = 'rate_limit_is_booked'
+    OWNER = 'owner'
+    DURABLE = 'durable'
+
+
+class MergePolicies:
+    DROP_NEW = 'drop_new'
+    REPLACE_OLD = 'replace_old'
+    KEEP_LATEST_ARGS = 'keep_latest_args'
+
+
+class OverflowPolicies:
+    DROP_NEW = 'drop_new'
+    DROP_OLDEST = 'drop_oldest'
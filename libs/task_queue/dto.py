@@ -1,17 +1,23 @@
 import abc
 import datetime
 import logging
+import random
 import threading
 import typing
+from concurrent.futures import Executor, Future, InvalidStateError
 from dataclasses import dataclass, field
+from functools import partial
+from time import monotonic
 
 from crontab import CronTab
 
 from . import constants, exceptions
-from ..casual_utils.parallel_computing import synchronized_method
 
 
 __all__ = (
+    'Capacity',
+    'Lane',
+    'Rate',
     'Task',
     'IntervalTask',
     'RepeatableTask',
@@ -20,8 +26,21 @@ __all__ = (
 )
 
 
-@dataclass(kw_only=True, eq=False)
+_FINAL_STATUSES = (
+    constants.TaskStatuses.FINISHED,
+    constants.TaskStatuses.FAILED,
+    constants.TaskStatuses.CANCELED,
+)
+
+
+@dataclass(kw_only=True, eq=False, slots=True)
 class Task:
+    """
+    Tasks don't own locks, because tasks are created much more often than they are locked.
+    Status transitions are compare-and-set under striped locks shared by all tasks.
+    The locks are private: they are held for a few operations and never while calling other code.
+    """
+
     priority: int
     target: typing.Callable
     args: tuple = field(
@@ -45,20 +64,68 @@ class Task:
     _status: str = field(
         default=constants.TaskStatuses.CREATED,
     )
-    _lock: threading.RLock = field(
-        default_factory=threading.RLock,
+    _cancel_callback: typing.Optional[typing.Callable[['Task'], None]] = field(
+        default=None,
+        repr=False,
+    )
+    _future: typing.Optional[Future] = field(
+        default=None,
+        repr=False,
     )
 
+    _locks: typing.ClassVar[tuple[threading.Lock, ...]] = tuple(threading.Lock() for _ in range(64))
+
     @property
-    @synchronized_method
     def status(self) -> str:
         return self._status
 
     @status.setter
-    @synchronized_method
     def status(self, value: str) -> None:
         self._status = value
 
+    @property
+    def future(self) -> Future:
+        """
+        It's resolved with `result` or `error` when a worker is done with the task including retries,
+        and it's canceled with the task. Canceling the future cancels the task.
+        Use `asyncio.wrap_future` to await it.
+        """
+
+        with self._lock:
+            if self._future is not None:
+                return self._future
+
+            future: Future = Future()
+            self._future = future
+
+        # Callbacks are added without the lock, because they are called at once if the future is done.
+        future.add_done_callback(self._cancel_by_future)
+
+        # The task can be done before the future is requested.
+        if self._status in _FINAL_STATUSES:
+            self.resolve_future()
+
+        return future
+
+    @property
+    def target_name(self) -> str:
+        target = self.target
+
+        while isinstance(target, partial):
+            target = target.func
+
+        qualname = getattr(target, '__qualname__', target.__class__.__qualname__)
+
+        return f'{target.__module__}.{qualname}'
+
+    @property
+    def weight(self) -> int:
+        """
+        Bytes of arrays (values with `nbytes`) in args and kwargs.
+        """
+
+        return _get_nbytes(self.args) + _get_nbytes(self.kwargs)
+
     @classmethod
     def create(
         cls,
@@ -77,76 +144,225 @@ class Task:
 
         return task
 
-    def run(self) -> None:
-        with self._lock:
-            if self._status == constants.TaskStatuses.CANCELED:
-                return
-
-            self._status = constants.TaskStatuses.STARTED
-            self.result = None
-            self.error = None
+    def run(self, *, executor: typing.Optional[Executor] = None) -> None:
+        if not self._start():
+            return
 
         try:
-            self.result = self.call()
-        except exceptions.BaseTaskQueueException:
-            self.status = constants.TaskStatuses.FINISHED
-            raise
+            result = self.call(executor=executor)
         except Exception as e:
-            with self._lock:
-                self.error = e
-                self._status = constants.TaskStatuses.FAILED
+            self._finish(error=e)
+            raise
+        else:
+            self._finish(result=result)
+
+    async def arun(self) -> None:
+        if not self._start():
+            return
 
+        try:
+            result = await self.acall()
+        except Exception as e:
+            self._finish(error=e)
             raise
         else:
-            self.status = constants.TaskStatuses.FINISHED
+            self._finish(result=result)
 
-    def call(self) -> typing.Any:
-        return self.target(*self.args, **self.kwargs)
+    def call(self, *, executor: typing.Optional[Executor] = None) -> typing.Any:
+        if executor is None:
+            return self.target(*self.args, **self.kwargs)
+
+        return executor.submit(self.target, *self.args, **self.kwargs).result()
+
+    async def acall(self) -> typing.Any:
+        return await self.target(*self.args, **self.kwargs)
 
-    @synchronized_method
     def cancel(self) -> bool:
-        is_success = self._status in (
-            constants.TaskStatuses.CREATED,
-            constants.TaskStatuses.PENDING,
+        """
+        Only created and pending tasks are canceled. Started and done tasks keep their statuses.
+        """
+
+        is_success = self._compare_and_set_status(
+            (constants.TaskStatuses.CREATED, constants.TaskStatuses.PENDING),
+            constants.TaskStatuses.CANCELED,
         )
-        self._status = constants.TaskStatuses.CANCELED
+        cancel_callback = self._cancel_callback
+
+        # It's called without the lock, because the callback can lock a task queue.
+        if is_success and cancel_callback is not None:
+            cancel_callback(self)
+
+        if is_success and self._future is not None:
+            self._future.cancel()
+
         return is_success
 
+    def resolve_future(self) -> None:
+        """
+        Workers call it after processing the task. A task that is put back for a retry isn't resolved.
+        """
+
+        with self._lock:
+            future = self._future
+            status = self._status
+
+        if future is None or future.done():
+            return
+
+        try:
+            if status == constants.TaskStatuses.FINISHED:
+                future.set_result(self.result)
+            elif status == constants.TaskStatuses.FAILED:
+                future.set_exception(self.error)
+            elif status == constants.TaskStatuses.CANCELED:
+                future.cancel()
+        except InvalidStateError:
+            # It's resolved by another thread.
+            pass
+
+    def replace_params(self, *, args: tuple, kwargs: typing.Dict[str, typing.Any]) -> bool:
+        """
+        Replaces args and kwargs of a task that isn't started. Returns whether they are replaced.
+        """
+
+        with self._lock:
+            if self._status not in (constants.TaskStatuses.CREATED, constants.TaskStatuses.PENDING):
+                return False
+
+            self.args = args
+            self.kwargs = kwargs
+
+        return True
+
+    def set_cancel_callback(self, callback: typing.Optional[typing.Callable[['Task'], None]]) -> None:
+        self._cancel_callback = callback
+
     def __lt__(self, other: 'Task') -> bool:
         # For ordering.
         return self.run_after < other.run_after
 
+    def _cancel_by_future(self, future: Future) -> None:
+        if future.cancelled():
+            self.cancel()
+
+    @property
+    def _lock(self) -> threading.Lock:
+        return self._locks[hash(self) % len(self._locks)]
+
+    def _compare_and_set_status(self, expected_statuses: tuple[str, ...], value: str) -> bool:
+        with self._lock:
+            if self._status not in expected_statuses:
+                return False
+
+            self._status = value
+
+        return True
+
+    def _start(self) -> bool:
+        with self._lock:
+            if self._status == constants.TaskStatuses.CANCELED:
+                return False
+
+            self._status = constants.TaskStatuses.STARTED
+
+        self.result = None
+        self.error = None
+
+        return True
+
+    def _finish(self, *, result: typing.Any = None, error: typing.Optional[Exception] = None) -> None:
+        with self._lock:
+            if error is None:
+                self.result = result
+                self._status = constants.TaskStatuses.FINISHED
+            elif isinstance(error, exceptions.BaseTaskQueueException):
+                self._status = constants.TaskStatuses.FINISHED
+            else:
+                self.error = error
+                self._status = constants.TaskStatuses.FAILED
+
 
 class RepeatableTask(Task, abc.ABC):
-    pass
+    __slots__ = ()
+
+    def _repeat(self, **params) -> None:
+        with self._lock:
+            if self._status != constants.TaskStatuses.CANCELED:
+                logging.debug('Repeat %s after %s', self, self.run_after)
+                raise exceptions.RepeatTask(**params)
 
 
-@dataclass(kw_only=True, eq=False)
+@dataclass(kw_only=True, eq=False, slots=True)
 class IntervalTask(RepeatableTask):
+    """
+    By default the next run is `interval` after the end of the previous one.
+    With `fixed_rate` runs are `interval` apart by the monotonic clock from the first run, and missed runs are skipped.
+    The first run is delayed by a random part of `jitter`, so tasks created together don't run together.
+    """
+
     interval: datetime.timedelta
     run_immediately: bool = field(
         default=True,
     )
+    fixed_rate: bool = field(
+        default=False,
+    )
+    jitter: datetime.timedelta = field(
+        default=datetime.timedelta(),
+    )
+    _scheduled_at: typing.Optional[float] = field(
+        default=None,
+        repr=False,
+    )
 
     def __post_init__(self) -> None:
         if not self.run_immediately:
             self.run_after = datetime.datetime.now() + self.interval
 
-    def run(self) -> None:
+        if self.jitter:
+            self.run_after += random.random() * self.jitter
+
+    def run(self, *, executor: typing.Optional[Executor] = None) -> None:
         logging.debug('Run interval %s', self)
+        self._schedule()
 
         try:
-            super().run()
+            RepeatableTask.run(self, executor=executor)
         except Exception as e:
             logging.exception(e)
 
-        with self._lock:
-            if self._status != constants.TaskStatuses.CANCELED:
-                logging.debug('Repeat %s after %s', self, self.run_after)
-                raise exceptions.RepeatTask(delay=self.interval)
+        self._repeat(delay=self._get_next_delay())
+
+    async def arun(self) -> None:
+        logging.debug('Run interval %s', self)
+        self._schedule()
+
+        try:
+            await RepeatableTask.arun(self)
+        except Exception as e:
+            logging.exception(e)
+
+        self._repeat(delay=self._get_next_delay())
+
+    def _schedule(self) -> None:
+        if self._scheduled_at is None:
+            self._scheduled_at = monotonic()
+
+    def _get_next_delay(self) -> datetime.timedelta:
+        if not self.fixed_rate:
+            return self.interval
+
+        assert self._scheduled_at is not None
 
+        now = monotonic()
+        interval = self.interval.total_seconds()
+        missed_runs = max(int((now - self._scheduled_at) // interval), 0)
+        self._scheduled_at += (missed_runs + 1) * interval
 
-@dataclass(kw_only=True, eq=False)
+        return datetime.timedelta(seconds=self._scheduled_at - now)
+
+
+@dataclass(kw_only=True, eq=False, slots=True)
 class DelayedTask(RepeatableTask):
     delay: datetime.timedelta
 
@@ -154,22 +370,87 @@ class DelayedTask(RepeatableTask):
         self.run_after = self.run_after + self.delay
 
 
-@dataclass(kw_only=True, eq=False)
+@dataclass(kw_only=True, eq=False, slots=True)
 class ScheduledTask(RepeatableTask):
     crontab: CronTab
 
     def __post_init__(self) -> None:
         self.run_after = self.crontab.next(self.run_after, default_utc=False, return_datetime=True)
 
-    def run(self) -> None:
+    def run(self, *, executor: typing.Optional[Executor] = None) -> None:
         logging.debug('Run scheduled %s', self)
 
         try:
-            super().run()
+            RepeatableTask.run(self, executor=executor)
         except Exception as e:
             logging.exception(e)
 
-        with self._lock:
-            if self._status != constants.TaskStatuses.CANCELED:
-                logging.debug('Repeat %s after %s', self, self.run_after)
-                raise exceptions.RepeatTask(after=self.crontab.next(default_utc=False, return_datetime=True))
+        self._repeat_by_crontab()
+
+    async def arun(self) -> None:
+        logging.debug('Run scheduled %s', self)
+
+        try:
+            await RepeatableTask.arun(self)
+        except Exception as e:
+            logging.exception(e)
+
+        self._repeat_by_crontab()
+
+    def _repeat_by_crontab(self) -> None:
+        self._repeat(after=self.crontab.next(default_utc=False, return_datetime=True))
+
+
+@dataclass(frozen=True, kw_only=True)
+class Lane:
+    """
+    `count` worker threads reserved for tasks with `priorities`.
+    When there are no ready tasks with these priorities, the threads can take tasks with `borrowed_priorities`.
+    If `max_count` is greater than `count`, the number of threads follows the waiting time
+    and the number of ready tasks.
+    """
+
+    priorities: tuple[int, ...]
+    count: int = 1
+    max_count: typing.Optional[int] = None
+    borrowed_priorities: tuple[int, ...] = ()
+
+    @property
+    def served_priorities(self) -> tuple[int, ...]:
+        return self.priorities + self.borrowed_priorities
+
+
+@dataclass(frozen=True, kw_only=True)
+class Capacity:
+    """
+    Limits bytes of arrays that pending tasks with a priority can hold in a queue (see `Task.weight`).
+    Tasks without arrays are not limited.
+    """
+
+    max_bytes: int
+    overflow_policy: str = constants.OverflowPolicies.DROP_OLDEST
+
+
+@dataclass(frozen=True, kw_only=True)
+class Rate:
+    """
+    A token bucket of `burst` tokens that is refilled by `per_second` tokens per second.
+    """
+
+    per_second: float
+    burst: int = 1
+
+
+def _get_nbytes(value: typing.Any) -> int:
+    nbytes = getattr(value, 'nbytes', None)
+
+    if isinstance(nbytes, int):
+        return nbytes
+
+    if isinstance(value, (list, tuple)):
+        return sum(_get_nbytes(item) for item in value)
+
+    if isinstance(value, dict):
+        return sum(_get_nbytes(item) for item in value.values())
+
+    return 0
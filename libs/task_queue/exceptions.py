@@ -1,10 +1,12 @@
 import datetime
 import typing
+from functools import partial
 
 
 __all__ = (
     'BaseTaskQueueException',
     'RepeatTask',
+    'SerializationError',
 )
 
 
@@ -31,3 +33,11 @@ class RepeatTask(BaseTaskQueueException):
 
         self.after = after
         self.source = source
+
+    def __reduce__(self) -> tuple:
+        # Keeps the state when the exception is sent back from a child process.
+        return partial(self.__class__, after=self.after, source=self.source), ()
+
+
+class SerializationError(BaseTaskQueueException):
+    pass
@@ -1 +1,4 @@
 from .thread import *
+from .process import *
+from .aio import *
+from .sql import *
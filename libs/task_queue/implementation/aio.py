@@ -0,0 +1,142 @@
+import asyncio
+import inspect
+import logging
+import threading
+import typing
+from functools import partial
+
+from ..base import BaseTaskQueue, BaseWorker
+from ..dto import Task
+from ..middlewares import BaseMiddleware
+
+
+__all__ = ('AsyncioWorker',)
+
+
+class AsyncioWorker(BaseWorker):
+    """
+    Runs up to `max_concurrency` tasks at once on one event loop.
+    Coroutine functions are awaited natively, other targets are run in the default executor of the loop.
+    Middlewares are applied with `BaseMiddleware.aprocess`.
+    """
+
+    task_queue: BaseTaskQueue
+    middlewares: typing.Tuple[BaseMiddleware, ...]
+    max_concurrency: int
+    _middleware_chain: typing.Callable
+    _is_run: threading.Event
+    _loop: typing.Optional[asyncio.AbstractEventLoop] = None
+    _loop_thread: typing.Optional[threading.Thread] = None
+    _dispatcher: typing.Optional[threading.Thread] = None
+    _semaphore: threading.BoundedSemaphore
+    _running_tasks: typing.Set[asyncio.Task]
+    _joining_timeout: float = 0.1
+
+    def __init__(
+        self,
+        *,
+        task_queue: BaseTaskQueue,
+        middlewares: typing.Tuple[BaseMiddleware, ...],
+        max_concurrency: int = 100,
+    ) -> None:
+        self.task_queue = task_queue
+        self.middlewares = middlewares
+        self.max_concurrency = max_concurrency
+        self._is_run = threading.Event()
+        self._semaphore = threading.BoundedSemaphore(max_concurrency)
+        self._running_tasks = set()
+
+        self._middleware_chain = self._run_task
+
+        for middleware in reversed(self.middlewares):
+            self._middleware_chain = partial(
+                middleware.aprocess,
+                handler=self._middleware_chain,
+                task_queue=self.task_queue,
+            )
+
+    @property
+    def is_run(self) -> bool:
+        return self._is_run.is_set()
+
+    def run(self) -> None:
+        if self.is_run:
+            return
+
+        logging.debug(f'Run {self.__class__.__name__}...')
+        self._is_run.set()
+
+        self._loop = asyncio.new_event_loop()
+        self._loop_thread = threading.Thread(target=self._loop.run_forever)
+        self._loop_thread.start()
+
+        self._dispatcher = threading.Thread(target=self._dispatch_tasks)
+        self._dispatcher.start()
+
+        logging.debug(f'{self.__class__.__name__} is ready.')
+
+    def stop(self) -> None:
+        if not self.is_run:
+            return
+
+        self._is_run.clear()
+
+        if len(self.task_queue):
+            logging.warning(f'TaskQueue is stopped, but there are {len(self.task_queue)} tasks in queue.')
+
+        assert self._dispatcher is not None
+        assert self._loop is not None
+        assert self._loop_thread is not None
+
+        while self._dispatcher.is_alive():
+            self.task_queue.wake_up()
+            self._dispatcher.join(self._joining_timeout)
+
+        asyncio.run_coroutine_threadsafe(self._wait_running_tasks(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._loop_thread.join()
+        self._loop.close()
+
+    def _dispatch_tasks(self) -> None:
+        assert self._loop is not None
+
+        while self.is_run:
+            if not self._semaphore.acquire(timeout=self._joining_timeout):
+                continue
+
+            task = self.task_queue.get(block=True)
+
+            if task is None:
+                self._semaphore.release()
+                continue
+
+            logging.debug('Get %s from %s', task, self.task_queue.__class__.__name__)
+            asyncio.run_coroutine_threadsafe(self._process_task(task), self._loop)
+
+    async def _process_task(self, task: Task) -> None:
+        current_task = asyncio.current_task()
+        assert current_task is not None
+        self._running_tasks.add(current_task)
+
+        try:
+            await self._middleware_chain(task=task)
+        except Exception as e:
+            logging.exception(e)
+        finally:
+            self._running_tasks.discard(current_task)
+            self._semaphore.release()
+
+        task.resolve_future()
+
+    async def _wait_running_tasks(self) -> None:
+        if self._running_tasks:
+            await asyncio.wait(tuple(self._running_tasks))
+
+        await asyncio.get_running_loop().shutdown_default_executor()
+
+    @staticmethod
+    async def _run_task(*, task: Task) -> typing.Any:
+        if inspect.iscoroutinefunction(task.target):
+            return await task.arun()
+
+        return await asyncio.get_running_loop().run_in_executor(None, task.run)
@@ -0,0 +1,83 @@
+import logging
+import multiprocessing
+import threading
+import typing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from .thread import ThreadWorker
+from .. import constants
+from ..dto import Task
+
+
+__all__ = ('ProcessPoolWorker',)
+
+
+class ProcessPoolWorker(ThreadWorker):
+    """
+    Threads of the worker take tasks from the queue and pass them through the middlewares as `ThreadWorker` does,
+    but targets of tasks with `TaskOptions.USE_PROCESS_POOL` are executed in a process pool.
+    The target and its arguments of these tasks have to be picklable.
+    """
+
+    processes: typing.Optional[int]
+    _mp_context: multiprocessing.context.BaseContext
+    _executor: typing.Optional[ProcessPoolExecutor] = None
+    _executor_lock: threading.Lock
+
+    def __init__(
+        self,
+        *,
+        processes: typing.Optional[int] = None,
+        mp_context: typing.Optional[multiprocessing.context.BaseContext] = None,
+        **kwargs,
+    ) -> None:
+        super().__init__(**kwargs)
+
+        self.processes = processes
+        self._mp_context = multiprocessing.get_context('spawn') if mp_context is None else mp_context
+        self._executor_lock = threading.Lock()
+
+    def run(self) -> None:
+        if self.is_run:
+            return
+
+        with self._executor_lock:
+            self._executor = self._create_executor()
+
+        super().run()
+
+    def stop(self) -> None:
+        if not self.is_run:
+            return
+
+        super().stop()
+
+        with self._executor_lock:
+            if self._executor is not None:
+                self._executor.shutdown(cancel_futures=True)
+                self._executor = None
+
+    def _run_task(self, *, task: Task) -> typing.Any:
+        if not task.options.get(constants.TaskOptions.USE_PROCESS_POOL):
+            return task.run()
+
+        with self._executor_lock:
+            executor = self._executor
+
+        assert executor is not None
+
+        try:
+            return task.run(executor=executor)
+        except BrokenProcessPool:
+            logging.warning('Process pool is broken, recreating it.')
+
+            with self._executor_lock:
+                if self._executor is executor:
+                    executor.shutdown(wait=False, cancel_futures=True)
+                    self._executor = self._create_executor()
+
+            raise
+
+    def _create_executor(self) -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(max_workers=self.processes, mp_context=self._mp_context)
@@ -0,0 +1,352 @@
+import datetime
+import hashlib
+import logging
+import threading
+import typing
+import uuid
+from itertools import count
+from time import monotonic
+
+import sqlalchemy
+from sqlalchemy.engine import Engine
+
+from .. import constants
+from ..dto import Capacity, DelayedTask, IntervalTask, RepeatableTask, ScheduledTask, Task
+from ..exceptions import SerializationError
+from ..metrics import TaskMetrics
+from ..serializers import TaskSerializer
+from .thread import MemTaskQueue
+
+
+__all__ = (
+    'SQLTaskQueue',
+    'task_table',
+)
+
+
+metadata = sqlalchemy.MetaData()
+task_table = sqlalchemy.Table(
+    'task_queue',
+    metadata,
+    sqlalchemy.Column('id', sqlalchemy.String(255), primary_key=True),
+    sqlalchemy.Column('target', sqlalchemy.Text, nullable=False),
+    sqlalchemy.Column('data', sqlalchemy.LargeBinary, nullable=True),
+    sqlalchemy.Column('priority', sqlalchemy.Integer, nullable=False),
+    sqlalchemy.Column('run_after', sqlalchemy.DateTime, nullable=False),
+    sqlalchemy.Column('is_repeatable', sqlalchemy.Boolean, nullable=False),
+)
+
+
+class SQLTaskQueue(MemTaskQueue):
+    """
+    `MemTaskQueue` that keeps tasks in a database (Postgres or SQLite) to survive restarts.
+    Tasks are still scheduled in memory, the database only holds:
+    - tasks with `TaskOptions.DURABLE`, which are restored by `restore`;
+    - next runs of repeatable tasks that are at least `min_schedule_delay` ahead,
+      which are resumed when the same tasks are put after a restart. Runs of frequent tasks are not written,
+      because losing them costs little. A repeatable task is found by its target, params and schedule.
+    Targets are stored by `serializer`, so bound methods need `register_instance`.
+    Writes are buffered and flushed by the flusher thread by `batch_size` or every `flush_interval`.
+    The database is written without `_lock`, so putting and canceling tasks don't wait for it.
+    Flushes and claims are ordered by `_flush_lock` instead.
+    A durable task is claimed with `SKIP LOCKED` before it's returned,
+    so a task that is restored by several processes runs once.
+    """
+
+    engine: Engine
+    serializer: TaskSerializer
+    batch_size: int
+    flush_interval: datetime.timedelta
+    min_schedule_delay: datetime.timedelta
+    _row_ids: typing.Dict[Task, typing.Optional[str]]
+    _writes: typing.Dict[str, typing.Optional[dict]]
+    _schedule: typing.Dict[str, datetime.datetime]
+    _repeatable_counter: typing.Dict[str, typing.Iterator[int]]
+    _lock: threading.RLock
+    _flush_lock: threading.Lock
+    _is_closed: threading.Event
+    _is_flush_requested: threading.Event
+    _flusher: threading.Thread
+
+    def __init__(
+        self,
+        *,
+        engine: Engine,
+        serializer: typing.Optional[TaskSerializer] = None,
+        batch_size: int = 100,
+        flush_interval: datetime.timedelta = datetime.timedelta(seconds=1),
+        min_schedule_delay: datetime.timedelta = datetime.timedelta(minutes=5),
+        capacities: typing.Optional[typing.Dict[int, Capacity]] = None,
+        aging: typing.Optional[typing.Dict[int, datetime.timedelta]] = None,
+        task_metrics: typing.Optional[TaskMetrics] = None,
+        owner_weights: typing.Optional[typing.Dict[typing.Hashable, float]] = None,
+    ) -> None:
+        super().__init__(capacities, aging, task_metrics, owner_weights)
+
+        self.engine = engine
+        self.serializer = TaskSerializer() if serializer is None else serializer
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.min_schedule_delay = min_schedule_delay
+        self._row_ids = {}
+        self._writes = {}
+        self._repeatable_counter = {}
+        self._lock = threading.RLock()
+        self._flush_lock = threading.Lock()
+        self._is_closed = threading.Event()
+        self._is_flush_requested = threading.Event()
+        self._flusher = threading.Thread(target=self._flush_periodically, daemon=True)
+
+        task_table.create(self.engine, checkfirst=True)
+
+        with self.engine.connect() as connection:
+            self._schedule = dict(
+                connection.execute(
+                    sqlalchemy.select(task_table.c.id, task_table.c.run_after).where(
+                        task_table.c.is_repeatable.is_(True),
+                    )
+                ).all()
+            )
+
+        self._flusher.start()
+
+    def put_task(self, task: Task) -> Task:
+        is_durable = isinstance(task, RepeatableTask) or task.options.get(constants.TaskOptions.DURABLE, False)
+
+        if is_durable and isinstance(task, RepeatableTask):
+            self._resume(task)
+
+        queued_task = super().put_task(task)
+
+        if is_durable and queued_task is task:
+            self._save(task)
+
+        return queued_task
+
+    def get(
+        self,
+        *,
+        block: bool = False,
+        timeout: typing.Optional[float] = None,
+        priorities: typing.Optional[typing.Sequence[int]] = None,
+    ) -> typing.Optional[Task]:
+        deadline = None if timeout is None else monotonic() + timeout
+
+        while True:
+            task = super().get(block=block, timeout=timeout, priorities=priorities)
+
+            if task is None or self._claim(task):
+                return task
+
+            logging.debug('%s is claimed by another process', task)
+            task.set_cancel_callback(None)
+            task.cancel()
+
+            if deadline is not None:
+                timeout = max(deadline - monotonic(), 0)
+
+    def register_instance(self, name: str, instance: typing.Any) -> None:
+        self.serializer.register_instance(name, instance)
+
+    def restore(self) -> int:
+        """
+        Puts durable tasks that were left by previous runs and removes schedules of repeatable tasks that are gone.
+        Call it when all instances are registered and all repeatable tasks are put.
+        Returns the number of restored tasks.
+        """
+
+        self.flush()
+
+        with self._flush_lock:
+            with self.engine.connect() as connection:
+                rows = connection.execute(sqlalchemy.select(task_table)).all()
+
+        restored_tasks = []
+
+        with self._lock:
+            row_ids = set(self._row_ids.values())
+
+            for row in rows:
+                if row.is_repeatable:
+                    if row.id not in row_ids:
+                        self._writes[row.id] = None
+
+                    continue
+
+                # It belongs to a task of this queue.
+                if row.id in row_ids:
+                    continue
+
+                try:
+                    task = self.serializer.loads(row.target, row.data, priority=row.priority, run_after=row.run_after)
+                except SerializationError as e:
+                    logging.warning('Task %s is not restored: %s', row.id, e)
+                    self._writes[row.id] = None
+                    continue
+
+                self._row_ids[task] = row.id
+                restored_tasks.append(task)
+
+        self.flush()
+
+        for task in restored_tasks:
+            if MemTaskQueue.put_task(self, task) is task:
+                self._watch(task)
+            else:
+                self._forget(task)
+
+        logging.info('%s tasks are restored', len(restored_tasks))
+
+        return len(restored_tasks)
+
+    def flush(self) -> None:
+        with self._flush_lock:
+            with self._lock:
+                if not self._writes:
+                    return
+
+                writes = self._writes
+                self._writes = {}
+
+            with self.engine.begin() as connection:
+                connection.execute(sqlalchemy.delete(task_table).where(task_table.c.id.in_(tuple(writes))))
+                rows = [row for row in writes.values() if row is not None]
+
+                if rows:
+                    connection.execute(sqlalchemy.insert(task_table), rows)
+
+    def close(self) -> None:
+        self._is_closed.set()
+        self._is_flush_requested.set()
+        self._flusher.join()
+        self.flush()
+
+    def _resume(self, task: RepeatableTask) -> None:
+        with self._lock:
+            if task in self._row_ids:
+                return
+
+            try:
+                target_path, data = self.serializer.dumps(task)
+            except SerializationError as e:
+                logging.debug('Schedule of %s is not saved: %s', task, e)
+                self._row_ids[task] = None
+                return
+
+            digest = hashlib.sha1(
+                f'{task.__class__.__name__}:{_get_schedule(task)}:'.encode() + data,
+            ).hexdigest()[:16]
+            key = f'{target_path}#{digest}'
+            # Only the same repeatable tasks are told apart by the order of putting, so it doesn't matter.
+            counter = self._repeatable_counter.setdefault(key, count())
+            row_id = f'{key}#{next(counter)}'
+            self._row_ids[task] = row_id
+
+            # Jitter of missed runs is kept, so missed runs don't fire together.
+            if row_id in self._schedule:
+                task.run_after = max(task.run_after, self._schedule[row_id])
+
+    def _save(self, task: Task) -> None:
+        with self._lock:
+            if isinstance(task, RepeatableTask):
+                row_id = self._row_ids.get(task)
+
+                if row_id is None or task.run_after - datetime.datetime.now() < self.min_schedule_delay:
+                    return
+
+                target_path, data = row_id.split('#', 1)[0], None
+            else:
+                try:
+                    target_path, data = self.serializer.dumps(task)
+                except SerializationError as e:
+                    logging.warning('%s is not durable: %s', task, e)
+                    return
+
+                row_id = self._row_ids[task] = uuid.uuid4().hex
+
+            self._writes[row_id] = {
+                'id': row_id,
+                'target': target_path,
+                'data': data,
+                'priority': task.priority,
+                'run_after': task.run_after,
+                'is_repeatable': data is None,
+            }
+
+            if data is not None:
+                self._watch(task)
+
+            if len(self._writes) >= self.batch_size:
+                self._is_flush_requested.set()
+
+    def _watch(self, task: Task) -> None:
+        task.set_cancel_callback(self._discard)
+
+        # The task can be canceled before the callback is set.
+        if task.status == constants.TaskStatuses.CANCELED:
+            self._forget(task)
+
+    def _discard(self, task: Task) -> None:
+        self._tasks.discard(task)
+        self._forget(task)
+
+    def _forget(self, task: Task) -> None:
+        with self._lock:
+            row_id = self._row_ids.pop(task, None)
+
+            if row_id is not None:
+                self._writes[row_id] = None
+
+    def _claim(self, task: Task) -> bool:
+        if isinstance(task, RepeatableTask):
+            return True
+
+        with self._lock:
+            row_id = self._row_ids.pop(task, None)
+
+            if row_id is None:
+                return True
+
+            # It isn't written yet.
+            if self._writes.pop(row_id, None) is not None:
+                return True
+
+        # A flush that has taken the row is waited for.
+        with self._flush_lock:
+            with self.engine.begin() as connection:
+                claimed_rows = connection.execute(
+                    sqlalchemy.delete(task_table)
+                    .where(
+                        task_table.c.id.in_(
+                            sqlalchemy.select(task_table.c.id)
+                            .where(task_table.c.id == row_id)
+                            .with_for_update(skip_locked=True)
+                        ),
+                    )
+                    .returning(task_table.c.id)
+                ).all()
+
+        return bool(claimed_rows)
+
+    def _flush_periodically(self) -> None:
+        while not self._is_closed.is_set():
+            self._is_flush_requested.wait(self.flush_interval.total_seconds())
+            self._is_flush_requested.clear()
+
+            try:
+                self.flush()
+            except Exception as e:
+                logging.exception(e)
+
+
+def _get_schedule(task: RepeatableTask) -> str:
+    if isinstance(task, ScheduledTask):
+        return ' '.join(str(matcher.input) for matcher in task.crontab.matchers)
+
+    if isinstance(task, IntervalTask):
+        return f'{task.interval}:{task.fixed_rate}'
+
+    if isinstance(task, DelayedTask):
+        return str(task.delay)
+
+    return ''
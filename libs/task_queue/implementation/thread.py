@@ -1,13 +1,17 @@
+import datetime
 import logging
 import queue
+import sys
 import threading
+import traceback
 import typing
 from functools import partial
-from time import sleep
+from time import monotonic
 
 from .. import constants
 from ..base import BaseTaskQueue, BaseWorker, TaskPriorityQueue
-from ..dto import Task
+from ..dto import Capacity, Lane, Task
+from ..metrics import TaskMetrics
 from ..middlewares import BaseMiddleware
 
 
@@ -20,32 +24,96 @@ __all__ = (
 class MemTaskQueue(BaseTaskQueue):
     _tasks: TaskPriorityQueue
 
-    def __init__(self) -> None:
-        self._tasks = TaskPriorityQueue()
+    def __init__(
+        self,
+        capacities: typing.Optional[typing.Dict[int, Capacity]] = None,
+        aging: typing.Optional[typing.Dict[int, datetime.timedelta]] = None,
+        task_metrics: typing.Optional[TaskMetrics] = None,
+        owner_weights: typing.Optional[typing.Dict[typing.Hashable, float]] = None,
+    ) -> None:
+        self._tasks = TaskPriorityQueue(capacities, aging, task_metrics, owner_weights)
 
     def __len__(self) -> int:
         return self._tasks.qsize()
 
-    def put_task(self, task: Task) -> None:
+    def put_task(self, task: Task) -> Task:
         task.status = constants.TaskStatuses.PENDING
         logging.debug('Put %s to MemTaskQueue', task)
-        self._tasks.put(task)
+        queued_task = self._tasks.put(task)
+
+        if queued_task is not task:
+            logging.debug('%s is merged into %s', task, queued_task)
+            task.cancel()
 
-    def get(self) -> typing.Optional[Task]:
+        return queued_task
+
+    def get(
+        self,
+        *,
+        block: bool = False,
+        timeout: typing.Optional[float] = None,
+        priorities: typing.Optional[typing.Sequence[int]] = None,
+    ) -> typing.Optional[Task]:
         try:
-            return self._tasks.get(block=False)
+            return self._tasks.get(block=block, timeout=timeout, priorities=priorities)
         except queue.Empty:
             return None
 
+    def wake_up(self) -> None:
+        self._tasks.wake_up()
+
+    def get_waiting_time(self, priorities: typing.Optional[typing.Sequence[int]] = None) -> float:
+        return self._tasks.get_waiting_time(priorities)
+
+    def get_ready_count(self, priorities: typing.Optional[typing.Sequence[int]] = None) -> int:
+        return self._tasks.get_ready_count(priorities)
+
+    def get_owner_depths(self) -> typing.Dict[typing.Hashable, int]:
+        return self._tasks.get_owner_depths()
+
 
 class ThreadWorker(BaseWorker):
+    """
+    A watchdog thread looks for tasks that run longer than their `TaskOptions.DEADLINE` (or `default_deadline`).
+    It logs stacks of these tasks and counts them in `task_metrics`.
+    If `replaces_stuck_threads` is set, a new thread takes the place of the stuck one,
+    and the stuck thread exits when its task is done. A lane has at most `max_replacements`
+    (its `max_count` by default) replaced threads at once, so hung calls can't add threads without a limit.
+
+    The watchdog also adds a thread to a lane (up to `max_count`) when the oldest ready task of the lane
+    has been waiting longer than `scaling_waiting_time` or there are more than `scaling_depth` ready tasks
+    per thread of the lane. A thread above `count` is removed when the waiting time and the depth
+    have stayed under the lower `scaling_down_waiting_time` and `scaling_down_depth` for `idle_timeout`,
+    so a lane doesn't flap between the thresholds.
+    """
+
     task_queue: BaseTaskQueue
     middlewares: typing.Tuple[BaseMiddleware, ...]
+    default_deadline: typing.Optional[datetime.timedelta]
+    replaces_stuck_threads: bool
+    max_replacements: typing.Optional[int]
+    task_metrics: typing.Optional[TaskMetrics]
+    idle_timeout: datetime.timedelta
+    scaling_waiting_time: datetime.timedelta
+    scaling_depth: float
+    scaling_down_waiting_time: datetime.timedelta
+    scaling_down_depth: float
     _middleware_chain: typing.Callable
     _is_run: threading.Event
-    _threads: tuple[threading.Thread, ...]
+    _is_stopping: threading.Event
+    _lanes: tuple[Lane, ...]
+    _lane_sizes: list[int]
+    _lane_retirements: list[int]
+    _lanes_calm_since: list[typing.Optional[float]]
+    _threads: list[threading.Thread]
+    _watchdog: threading.Thread
+    _running_tasks: dict[int, tuple[Task, float, int]]
+    _retired_threads: set[int]
+    _replaced_threads: dict[int, int]
+    _threads_lock: threading.Lock
     _on_close: typing.Optional[typing.Callable]
-    _getting_delay: float = 0.1
+    _joining_timeout: float = 0.1
+    _watchdog_interval: float = 1
 
     def __init__(
         self,
@@ -54,11 +122,39 @@ class ThreadWorker(BaseWorker):
         on_close: typing.Optional[typing.Callable] = None,
         middlewares: typing.Tuple[BaseMiddleware, ...],
         count: int = 1,
+        max_count: typing.Optional[int] = None,
+        lanes: typing.Optional[typing.Tuple[Lane, ...]] = None,
+        default_deadline: typing.Optional[datetime.timedelta] = None,
+        replaces_stuck_threads: bool = False,
+        max_replacements: typing.Optional[int] = None,
+        task_metrics: typing.Optional[TaskMetrics] = None,
+        idle_timeout: datetime.timedelta = datetime.timedelta(minutes=1),
+        scaling_waiting_time: datetime.timedelta = datetime.timedelta(seconds=1),
+        scaling_depth: float = 2,
+        scaling_down_waiting_time: datetime.timedelta = datetime.timedelta(milliseconds=100),
+        scaling_down_depth: float = 0.5,
     ) -> None:
+        if scaling_down_waiting_time >= scaling_waiting_time or scaling_down_depth >= scaling_depth:
+            raise ValueError('Thresholds of scaling down have to be lower than thresholds of scaling up.')
+
         self.task_queue = task_queue
         self.middlewares = middlewares
+        self.default_deadline = default_deadline
+        self.replaces_stuck_threads = replaces_stuck_threads
+        self.max_replacements = max_replacements
+        self.task_metrics = task_metrics
+        self.idle_timeout = idle_timeout
+        self.scaling_waiting_time = scaling_waiting_time
+        self.scaling_depth = scaling_depth
+        self.scaling_down_waiting_time = scaling_down_waiting_time
+        self.scaling_down_depth = scaling_down_depth
         self._on_close = on_close
         self._is_run = threading.Event()
+        self._is_stopping = threading.Event()
+        self._running_tasks = {}
+        self._retired_threads = set()
+        self._replaced_threads = {}
+        self._threads_lock = threading.Lock()
 
         self._middleware_chain = self._run_task
 
@@ -69,7 +165,16 @@ class ThreadWorker(BaseWorker):
                 task_queue=self.task_queue,
             )
 
-        self._threads = tuple(threading.Thread(target=self._process_tasks) for _ in range(count))
+        # A lane without priorities serves all of them.
+        self._lanes = (Lane(priorities=(), count=count, max_count=max_count),) if lanes is None else lanes
+        self._lane_sizes = [lane.count for lane in self._lanes]
+        self._lane_retirements = [0] * len(self._lanes)
+        self._lanes_calm_since = [None] * len(self._lanes)
+        self._threads = [
+            self._create_thread(lane_index) for lane_index, lane in enumerate(self._lanes) for _ in range(lane.count)
+        ]
+
+        self._watchdog = threading.Thread(target=self._watch, daemon=True)
 
     @property
     def is_run(self) -> bool:
@@ -85,6 +190,8 @@ class ThreadWorker(BaseWorker):
         for thread in self._threads:
             thread.start()
 
+        self._watchdog.start()
+
         logging.debug(f'{self.__class__.__name__} is ready.')
 
     def stop(self) -> None:
@@ -92,34 +199,192 @@ class ThreadWorker(BaseWorker):
             return
 
         self._is_run.clear()
+        self._is_stopping.set()
 
         if len(self.task_queue):
             logging.warning(f'TaskQueue is stopped, but there are {len(self.task_queue)} tasks in queue.')
 
-        for thread in self._threads:
-            thread.join()
+        # The watchdog is stopped first, so it doesn't add threads while they are joined.
+        self._watchdog.join()
+
+        with self._threads_lock:
+            threads = tuple(self._threads)
+
+        for thread in threads:
+            while thread.is_alive():
+                self.task_queue.wake_up()
+                thread.join(self._joining_timeout)
+
+    def _create_thread(self, lane_index: int) -> threading.Thread:
+        return threading.Thread(target=self._process_tasks, kwargs={'lane_index': lane_index})
+
+    def _start_thread(self, lane_index: int) -> None:
+        thread = self._create_thread(lane_index)
+        self._threads.append(thread)
+        thread.start()
 
-    def _process_tasks(self) -> None:
+    def _process_tasks(self, lane_index: int) -> None:
         logging.debug('Running worker #%s...', threading.get_native_id())
+        thread_id = threading.get_ident()
+        priorities = self._lanes[lane_index].served_priorities or None
 
-        while self.is_run:
-            task = self.task_queue.get()
+        while self.is_run and thread_id not in self._retired_threads and not self._retire(lane_index):
+            task = self.task_queue.get(block=True, priorities=priorities)
 
             if task is None:
-                logging.debug('Wait tasks')
-                sleep(self._getting_delay)
                 continue
 
             logging.debug('Get %s from MemTaskQueue', task)
 
+            with self._threads_lock:
+                self._running_tasks[thread_id] = (task, monotonic(), lane_index)
+
             try:
                 self._middleware_chain(task=task)
             except Exception as e:
                 logging.exception(e)
+            finally:
+                with self._threads_lock:
+                    self._running_tasks.pop(thread_id, None)
+
+            task.resolve_future()
+
+        with self._threads_lock:
+            if thread_id in self._retired_threads:
+                self._retired_threads.remove(thread_id)
+                self._replaced_threads.pop(thread_id, None)
+                self._threads.remove(threading.current_thread())
 
         if self._on_close is not None:
             self._on_close()
 
+    def _retire(self, lane_index: int) -> bool:
+        """
+        Takes a removal of a thread that the watchdog has requested for the lane.
+        """
+
+        if not self._lane_retirements[lane_index]:
+            return False
+
+        with self._threads_lock:
+            if not self._lane_retirements[lane_index]:
+                return False
+
+            logging.debug('Remove worker #%s from lane #%s', threading.get_native_id(), lane_index)
+            self._lane_retirements[lane_index] -= 1
+            self._retired_threads.add(threading.get_ident())
+
+        return True
+
+    def _scale(self) -> None:
+        for lane_index, lane in enumerate(self._lanes):
+            max_count = self._get_max_count(lane)
+
+            if max_count == lane.count:
+                continue
+
+            waiting_time = self.task_queue.get_waiting_time(lane.priorities or None)
+            depth = self.task_queue.get_ready_count(lane.priorities or None) / self._lane_sizes[lane_index]
+
+            if waiting_time > self.scaling_waiting_time.total_seconds() or depth > self.scaling_depth:
+                self._lanes_calm_since[lane_index] = None
+                self._scale_up(lane_index, waiting_time=waiting_time, depth=depth)
+            elif waiting_time <= self.scaling_down_waiting_time.total_seconds() and depth <= self.scaling_down_depth:
+                now = monotonic()
+                calm_since = self._lanes_calm_since[lane_index]
+
+                if calm_since is None:
+                    self._lanes_calm_since[lane_index] = now
+                elif now - calm_since >= self.idle_timeout.total_seconds():
+                    # The next thread is removed after another `idle_timeout`.
+                    self._lanes_calm_since[lane_index] = now
+                    self._scale_down(lane_index)
+            else:
+                # Between the thresholds the lane keeps its size.
+                self._lanes_calm_since[lane_index] = None
+
+    def _scale_up(self, lane_index: int, *, waiting_time: float, depth: float) -> None:
+        with self._threads_lock:
+            if self._is_stopping.is_set() or self._lane_sizes[lane_index] >= self._get_max_count(
+                self._lanes[lane_index],
+            ):
+                return
+
+            logging.debug(
+                'Add a worker to lane #%s, tasks are waiting for %.1fs, %.1f tasks per worker',
+                lane_index,
+                waiting_time,
+                depth,
+            )
+            self._lane_sizes[lane_index] += 1
+            self._start_thread(lane_index)
+
+    def _scale_down(self, lane_index: int) -> None:
+        with self._threads_lock:
+            if self._lane_sizes[lane_index] <= self._lanes[lane_index].count:
+                return
+
+            self._lane_sizes[lane_index] -= 1
+            self._lane_retirements[lane_index] += 1
+
+        # Idle threads are waiting for tasks.
+        self.task_queue.wake_up()
+
     @staticmethod
-    def _run_task(*, task: Task) -> typing.Any:
+    def _get_max_count(lane: Lane) -> int:
+        return lane.count if lane.max_count is None else max(lane.max_count, lane.count)
+
+    def _watch(self) -> None:
+        while not self._is_stopping.wait(self._watchdog_interval):
+            try:
+                self._check_running_tasks()
+                self._scale()
+            except Exception as e:
+                logging.exception(e)
+
+    def _check_running_tasks(self) -> None:
+        now = monotonic()
+        frames = sys._current_frames()
+
+        with self._threads_lock:
+            for thread_id, (task, started_at, lane_index) in tuple(self._running_tasks.items()):
+                deadline = task.options.get(constants.TaskOptions.DEADLINE, self.default_deadline)
+
+                if deadline is None or now - started_at <= deadline.total_seconds():
+                    continue
+
+                # Every run of a task is reported once.
+                del self._running_tasks[thread_id]
+
+                frame = frames.get(thread_id)
+                stack = ''.join(traceback.format_stack(frame)) if frame is not None else ''
+                logging.warning('%s is running longer than %s:\n%s', task, deadline, stack)
+
+                if self.task_metrics is not None:
+                    self.task_metrics.add_stuck_task(target_name=task.target_name, priority=task.priority)
+
+                if not self.replaces_stuck_threads:
+                    continue
+
+                max_replacements = (
+                    self._get_max_count(self._lanes[lane_index])
+                    if self.max_replacements is None
+                    else self.max_replacements
+                )
+                replacements = sum(1 for index in self._replaced_threads.values() if index == lane_index)
+
+                if replacements >= max_replacements:
+                    logging.warning(
+                        'Thread of %s is not replaced, lane #%s has %s replaced threads already',
+                        task,
+                        lane_index,
+                        replacements,
+                    )
+                    continue
+
+                self._retired_threads.add(thread_id)
+                self._replaced_threads[thread_id] = lane_index
+                self._start_thread(lane_index)
+
+    def _run_task(self, *, task: Task) -> typing.Any:
         return task.run()
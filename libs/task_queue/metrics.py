@@ -0,0 +1,323 @@
+import bisect
+import datetime
+import heapq
+import threading
+import typing
+from itertools import count
+
+
+__all__ = (
+    'Histogram',
+    'TaskMetrics',
+    'TaskProfiles',
+)
+
+
+_Key = typing.TypeVar('_Key', bound=typing.Hashable)
+
+
+class Histogram:
+    """
+    Counts values in fixed buckets, so the memory doesn't depend on the number of values.
+    Percentiles are approximated by upper bounds of the buckets.
+    """
+
+    DEFAULT_BUCKETS = (
+        0.001,
+        0.0025,
+        0.005,
+        0.01,
+        0.025,
+        0.05,
+        0.1,
+        0.25,
+        0.5,
+        1,
+        2.5,
+        5,
+        10,
+        25,
+        50,
+        100,
+        250,
+        600,
+    )
+
+    buckets: tuple[float, ...]
+    counts: list[int]
+    count: int
+    total: float
+    max: float
+
+    def __init__(self, buckets: tuple[float, ...] = DEFAULT_BUCKETS) -> None:
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def add(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def get_percentile(self, percentile: float) -> float:
+        if not self.count:
+            return 0
+
+        rank = percentile / 100 * self.count
+        accumulated = 0
+
+        for i, bucket_count in enumerate(self.counts):
+            accumulated += bucket_count
+
+            if accumulated >= rank:
+                return min(self.buckets[i], self.max) if i < len(self.buckets) else self.max
+
+        return self.max
+
+    def snapshot(self) -> dict[str, float]:
+        return {
+            'count': self.count,
+            'total': self.total,
+            'avg': self.total / self.count if self.count else 0,
+            'p50': self.get_percentile(50),
+            'p95': self.get_percentile(95),
+            'p99': self.get_percentile(99),
+            'max': self.max,
+        }
+
+
+class TaskMetrics:
+    """
+    Histograms of waiting time (from `run_after` to the start) and execution time
+    of tasks in seconds by target and priority and by owner, and counters of tasks that ran past their deadlines
+    and tasks that were served ahead of their priority because of aging.
+    """
+
+    aging: dict[int, datetime.timedelta]
+    _histograms: dict[tuple[str, int], dict[str, Histogram]]
+    _owner_histograms: dict[typing.Hashable, dict[str, Histogram]]
+    _stuck_tasks: dict[tuple[str, int], int]
+    _aged_tasks: dict[tuple[str, int], int]
+    _lock: threading.Lock
+
+    def __init__(self) -> None:
+        self.aging = {}
+        self._histograms = {}
+        self._owner_histograms = {}
+        self._stuck_tasks = {}
+        self._aged_tasks = {}
+        self._lock = threading.Lock()
+
+    def add(
+        self,
+        *,
+        target_name: str,
+        priority: int,
+        waiting_time: float,
+        execution_time: float,
+        owner: typing.Optional[typing.Hashable] = None,
+    ) -> None:
+        with self._lock:
+            self._add(self._histograms, (target_name, priority), waiting_time, execution_time)
+
+            if owner is not None:
+                self._add(self._owner_histograms, owner, waiting_time, execution_time)
+
+    def add_stuck_task(self, *, target_name: str, priority: int) -> None:
+        with self._lock:
+            self._stuck_tasks[(target_name, priority)] = self._stuck_tasks.get((target_name, priority), 0) + 1
+
+    def get_stuck_tasks(self) -> dict[tuple[str, int], int]:
+        with self._lock:
+            return dict(self._stuck_tasks)
+
+    def set_aging(self, aging: dict[int, datetime.timedelta]) -> None:
+        self.aging = dict(aging)
+
+    def add_aged_task(self, *, target_name: str, priority: int) -> None:
+        with self._lock:
+            self._aged_tasks[(target_name, priority)] = self._aged_tasks.get((target_name, priority), 0) + 1
+
+    def get_aged_tasks(self) -> dict[tuple[str, int], int]:
+        with self._lock:
+            return dict(self._aged_tasks)
+
+    def snapshot(self) -> dict[tuple[str, int], dict[str, dict[str, float]]]:
+        with self._lock:
+            return {
+                key: {name: histogram.snapshot() for name, histogram in histograms.items()}
+                for key, histograms in self._histograms.items()
+            }
+
+    def snapshot_owners(self) -> dict[typing.Hashable, dict[str, dict[str, float]]]:
+        with self._lock:
+            return {
+                owner: {name: histogram.snapshot() for name, histogram in histograms.items()}
+                for owner, histograms in self._owner_histograms.items()
+            }
+
+    def reset(self) -> None:
+        with self._lock:
+            self._histograms = {}
+            self._owner_histograms = {}
+            self._stuck_tasks = {}
+            self._aged_tasks = {}
+
+    def to_str(
+        self,
+        *,
+        limit: typing.Optional[int] = None,
+        owner_depths: typing.Optional[dict[typing.Hashable, int]] = None,
+    ) -> str:
+        """
+        Returns a text summary sorted by the total execution time.
+        `owner_depths` are numbers of pending tasks by owners to add to the breakdown by owners.
+        """
+
+        snapshot = sorted(
+            self.snapshot().items(),
+            key=lambda item: item[1]['execution_time']['total'],
+            reverse=True,
+        )[:limit]
+
+        stuck_tasks = self.get_stuck_tasks()
+        aged_tasks = self.get_aged_tasks()
+        lines = []
+
+        if self.aging:
+            lines.append(
+                'Aging: '
+                + ', '.join(f'priority {priority} every {period}' for priority, period in sorted(self.aging.items()))
+            )
+
+        for (target_name, priority), stats in snapshot:
+            waiting_time = stats['waiting_time']
+            execution_time = stats['execution_time']
+            header = f'{target_name} (priority {priority}): {execution_time["count"]} runs'
+
+            if (target_name, priority) in stuck_tasks:
+                header += f', {stuck_tasks[(target_name, priority)]} stuck'
+
+            if (target_name, priority) in aged_tasks:
+                header += f', {aged_tasks[(target_name, priority)]} aged'
+
+            lines.append(
+                f'{header}\n'
+                f'  wait p50/p95/max: {self._format_stats(waiting_time)}\n'
+                f'  run p50/p95/max: {self._format_stats(execution_time)}'
+            )
+
+        owner_snapshot = self.snapshot_owners()
+        owner_depths = {} if owner_depths is None else owner_depths
+        owners = sorted(
+            {*owner_snapshot, *(owner for owner in owner_depths if owner is not None)},
+            key=lambda owner: owner_snapshot[owner]['execution_time']['total'] if owner in owner_snapshot else 0,
+            reverse=True,
+        )
+
+        if owners:
+            lines.append('By module:')
+
+        for owner in owners:
+            header = f'{owner}: {owner_depths.get(owner, 0)} pending'
+
+            if owner in owner_snapshot:
+                stats = owner_snapshot[owner]
+                header += (
+                    f', {stats["execution_time"]["count"]} runs\n'
+                    f'  wait p50/p95/max: {self._format_stats(stats["waiting_time"])}\n'
+                    f'  run p50/p95/max: {self._format_stats(stats["execution_time"])}'
+                )
+
+            lines.append(header)
+
+        return '\n'.join(lines)
+
+    @staticmethod
+    def _add(
+        histogram_map: dict[_Key, dict[str, Histogram]],
+        key: _Key,
+        waiting_time: float,
+        execution_time: float,
+    ) -> None:
+        histograms = histogram_map.get(key)
+
+        if histograms is None:
+            histograms = histogram_map[key] = {
+                'waiting_time': Histogram(),
+                'execution_time': Histogram(),
+            }
+
+        histograms['waiting_time'].add(max(waiting_time, 0))
+        histograms['execution_time'].add(execution_time)
+
+    @staticmethod
+    def _format_stats(stats: dict[str, float]) -> str:
+        return f'{stats["p50"]:.3f}/{stats["p95"]:.3f}/{stats["max"]:.3f}s'
+
+
+class TaskProfiles:
+    """
+    Keeps `size` slowest profiles (texts of `pstats`) by target.
+    When there are more than `max_targets` targets, profiles of the target with the fastest slowest run are dropped.
+    """
+
+    size: int
+    max_targets: int
+    _profiles: dict[str, list[tuple[float, int, str]]]
+    _counter: typing.Iterator[int]
+    _lock: threading.Lock
+
+    def __init__(self, *, size: int = 3, max_targets: int = 50) -> None:
+        self.size = size
+        self.max_targets = max_targets
+        self._profiles = {}
+        self._counter = count()
+        self._lock = threading.Lock()
+
+    def add(self, *, target_name: str, execution_time: float, profile: str) -> None:
+        with self._lock:
+            profiles = self._profiles.setdefault(target_name, [])
+            item = (execution_time, next(self._counter), profile)
+
+            # It's a min-heap, so the fastest profile is replaced.
+            if len(profiles) < self.size:
+                heapq.heappush(profiles, item)
+            else:
+                heapq.heappushpop(profiles, item)
+
+            if len(self._profiles) > self.max_targets:
+                del self._profiles[min(self._profiles, key=lambda key: max(self._profiles[key])[0])]
+
+    def get(self, target_name: str) -> list[tuple[float, str]]:
+        """
+        Returns pairs of execution time and profile from the slowest one.
+        """
+
+        with self._lock:
+            profiles = sorted(self._profiles.get(target_name, ()), reverse=True)
+
+        return [(execution_time, profile) for execution_time, _, profile in profiles]
+
+    def reset(self) -> None:
+        with self._lock:
+            self._profiles = {}
+
+    def to_str(self, *, limit: typing.Optional[int] = None) -> str:
+        """
+        Returns the slowest profile of every target sorted by the execution time.
+        """
+
+        with self._lock:
+            slowest_profiles = sorted(
+                ((max(profiles), len(profiles), target_name) for target_name, profiles in self._profiles.items()),
+                reverse=True,
+            )[:limit]
+
+        return '\n\n'.join(
+            f'{target_name}: {execution_time:.3f}s, {profile_count} kept\n{profile}'
+            for (execution_time, _, profile), profile_count, target_name in slowest_profiles
+        )
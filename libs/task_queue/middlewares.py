@@ -1,9 +1,16 @@
 import abc
+import cProfile
 import datetime
+import io
 import logging
+import pstats
+import random
+import threading
 import typing
+from time import monotonic
 
-from . import BaseTaskQueue, Task, constants, exceptions as task_exceptions
+from . import BaseTaskQueue, Rate, Task, constants, exceptions as task_exceptions
+from .metrics import TaskMetrics, TaskProfiles
 from ..casual_utils.logging import log_performance
 
 
@@ -15,15 +22,33 @@ class BaseMiddleware(abc.ABC):
     def process(self, *, task: Task, task_queue: BaseTaskQueue, handler: typing.Callable) -> typing.Any:
         pass
 
+    async def aprocess(self, *, task: Task, task_queue: BaseTaskQueue, handler: typing.Callable) -> typing.Any:
+        """
+        The same as `process`, but `handler` is a coroutine function. It's used by `AsyncioWorker`,
+        so middlewares that are used only by other workers don't need it.
+        """
+
+        raise NotImplementedError(f'{self.__class__.__name__} does not support AsyncioWorker')
+
 
 class SupportOfRetries(BaseMiddleware):
     def process(self, *, task: Task, task_queue: BaseTaskQueue, handler: typing.Callable) -> typing.Any:
         try:
             return handler(task=task)
         except task_exceptions.RepeatTask as e:
-            task.run_after = e.after
-            logging.debug('Retrying %s', task)
-            task_queue.put_task(task)
+            self._retry(task=task, task_queue=task_queue, exception=e)
+
+    async def aprocess(self, *, task: Task, task_queue: BaseTaskQueue, handler: typing.Callable) -> typing.Any:
+        try:
+            return await handler(task=task)
+        except task_exceptions.RepeatTask as e:
+            self._retry(task=task, task_queue=task_queue, exception=e)
+
+    @staticmethod
+    def _retry(*, task: Task, task_queue: BaseTaskQueue, exception: task_exceptions.RepeatTask) -> None:
+        task.run_after = exception.after
+        logging.debug('Retrying %s', task)
+        task_queue.put_task(task)
 
 
 class ConcreteRetries(BaseMiddleware):
@@ -48,25 +73,42 @@ class ConcreteRetries(BaseMiddleware):
         try:
             result = handler(task=task)
         except self.exceptions as e:
-            with task._lock:
-                retries = task.options.setdefault('retries', 0)
-                retries += 1
+            self._process_exception(task=task, exception=e)
+        else:
+            self._reset_retries(task=task)
 
-                task.options['retries'] = retries
-                task.options['exception'] = e
+        return result
 
-                if retries <= self.max_retries:
-                    logging.debug('Retry policy for %s', task)
-                    raise task_exceptions.RepeatTask(delay=self._get_retry_delay(retries))
+    async def aprocess(self, *, task: Task, task_queue: BaseTaskQueue, handler: typing.Callable) -> typing.Any:
+        result = None
 
-                task.error = e
-                task.status = constants.TaskStatuses.FAILED
+        try:
+            result = await handler(task=task)
+        except self.exceptions as e:
+            self._process_exception(task=task, exception=e)
         else:
-            with task._lock:
-                task.options['retries'] = 0
+            self._reset_retries(task=task)
 
         return result
 
+    def _process_exception(self, *, task: Task, exception: Exception) -> None:
+        # A task is run by one worker at a time, so its options aren't shared.
+        retries = task.options.get('retries', 0) + 1
+
+        task.options['retries'] = retries
+        task.options['exception'] = exception
+
+        if retries <= self.max_retries:
+            logging.debug('Retry policy for %s', task)
+            raise task_exceptions.RepeatTask(delay=self._get_retry_delay(retries))
+
+        task.error = exception
+        task.status = constants.TaskStatuses.FAILED
+
+    @staticmethod
+    def _reset_retries(*, task: Task) -> None:
+        task.options['retries'] = 0
+
     @staticmethod
     def _get_retry_delay(retries: int) -> datetime.timedelta:
         delay = datetime.timedelta(seconds=retries**4 + 10)
@@ -77,12 +119,190 @@ class ConcreteRetries(BaseMiddleware):
         return delay
 
 
+class RateLimit(BaseMiddleware):
+    """
+    Limits runs of tasks by `TaskOptions.RATE_LIMIT_KEY` or by the target name with token buckets.
+    A task over the limit books the next token and is repeated when the token is available,
+    so it doesn't block a worker.
+    Need to be after `SupportOfRetries`.
+    """
+
+    rates: dict[typing.Hashable, Rate]
+    _buckets: dict[typing.Hashable, tuple[float, float]]
+    _lock: threading.Lock
+
+    def __init__(self, *, rates: dict[typing.Hashable, Rate]) -> None:
+        super().__init__()
+
+        self.rates = rates
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def process(self, *, task: Task, task_queue: BaseTaskQueue, handler: typing.Callable) -> typing.Any:
+        self._take_token(task=task)
+        return handler(task=task)
+
+    async def aprocess(self, *, task: Task, task_queue: BaseTaskQueue, handler: typing.Callable) -> typing.Any:
+        self._take_token(task=task)
+        return await handler(task=task)
+
+    def _take_token(self, *, task: Task) -> None:
+        key = task.options.get(constants.TaskOptions.RATE_LIMIT_KEY, task.target_name)
+        rate = self.rates.get(key)
+
+        if rate is None or task.options.pop(constants.TaskOptions.RATE_LIMIT_IS_BOOKED, False):
+            return
+
+        with self._lock:
+            now = monotonic()
+            tokens, updated_at = self._buckets.get(key, (rate.burst, now))
+            tokens = min(tokens + (now - updated_at) * rate.per_second, rate.burst) - 1
+            self._buckets[key] = (tokens, now)
+
+        if tokens < 0:
+            logging.debug('Rate limit for %s', task)
+            task.options[constants.TaskOptions.RATE_LIMIT_IS_BOOKED] = True
+            raise task_exceptions.RepeatTask(delay=datetime.timedelta(seconds=-tokens / rate.per_second))
+
+
 class PerformanceLogging(BaseMiddleware):
     def process(self, *, task: Task, task_queue: BaseTaskQueue, handler: typing.Callable) -> typing.Any:
-        func_name = f'{task.target.__module__}.{task.target.__qualname__}'
+        with log_performance(task.__class__.__name__.lower(), task.target_name):
+            return handler(task=task)
+
+    async def aprocess(self, *, task: Task, task_queue: BaseTaskQueue, handler: typing.Callable) -> typing.Any:
+        with log_performance(task.__class__.__name__.lower(), task.target_name):
+            return await handler(task=task)
+
+
+class CollectingMetrics(BaseMiddleware):
+    """
+    Records waiting and execution time of tasks to `metrics`.
+    Runs that are only postponed by `RateLimit` are not recorded.
+    """
+
+    metrics: TaskMetrics
+
+    def __init__(self, *, metrics: TaskMetrics) -> None:
+        super().__init__()
+
+        self.metrics = metrics
+
+    def process(self, *, task: Task, task_queue: BaseTaskQueue, handler: typing.Callable) -> typing.Any:
+        waiting_time = (datetime.datetime.now() - task.run_after).total_seconds()
+        started_at = monotonic()
+
+        try:
+            return handler(task=task)
+        finally:
+            self._add(task=task, waiting_time=waiting_time, execution_time=monotonic() - started_at)
+
+    async def aprocess(self, *, task: Task, task_queue: BaseTaskQueue, handler: typing.Callable) -> typing.Any:
+        waiting_time = (datetime.datetime.now() - task.run_after).total_seconds()
+        started_at = monotonic()
+
+        try:
+            return await handler(task=task)
+        finally:
+            self._add(task=task, waiting_time=waiting_time, execution_time=monotonic() - started_at)
+
+    def _add(self, *, task: Task, waiting_time: float, execution_time: float) -> None:
+        if task.options.get(constants.TaskOptions.RATE_LIMIT_IS_BOOKED):
+            return
+
+        self.metrics.add(
+            target_name=task.target_name,
+            priority=task.priority,
+            waiting_time=waiting_time,
+            execution_time=execution_time,
+            owner=task.options.get(constants.TaskOptions.OWNER),
+        )
+
+
+class Profiling(BaseMiddleware):
+    """
+    Times every task and profiles a `sample_rate` part of runs with `cProfile`.
+    The next run of a target that has run longer than `threshold` is always profiled.
+    Profiles of runs longer than `threshold` are kept in `profiles`.
+    Coroutines are only timed, because a profile of a coroutine includes other coroutines.
+    """
+
+    profiles: TaskProfiles
+    sample_rate: float
+    threshold: datetime.timedelta
+    line_limit: int
+    _slow_targets: typing.Set[str]
+    _lock: threading.Lock
+
+    def __init__(
+        self,
+        *,
+        profiles: TaskProfiles,
+        sample_rate: float = 0.01,
+        threshold: datetime.timedelta = datetime.timedelta(seconds=1),
+        line_limit: int = 15,
+    ) -> None:
+        super().__init__()
+
+        self.profiles = profiles
+        self.sample_rate = sample_rate
+        self.threshold = threshold
+        self.line_limit = line_limit
+        self._slow_targets = set()
+        self._lock = threading.Lock()
+
+    def process(self, *, task: Task, task_queue: BaseTaskQueue, handler: typing.Callable) -> typing.Any:
+        target_name = task.target_name
+        profiler = None
+
+        with self._lock:
+            is_slow = target_name in self._slow_targets
+
+        if is_slow or random.random() < self.sample_rate:
+            profiler = cProfile.Profile()
+
+            try:
+                profiler.enable()
+            except ValueError:
+                # Another profiler is active.
+                profiler = None
+
+        started_at = monotonic()
 
-        with log_performance(task.__class__.__name__.lower(), func_name):
+        try:
             return handler(task=task)
+        finally:
+            execution_time = monotonic() - started_at
+
+            if profiler is not None:
+                profiler.disable()
+
+            self._check(target_name=target_name, execution_time=execution_time, profiler=profiler)
+
+    async def aprocess(self, *, task: Task, task_queue: BaseTaskQueue, handler: typing.Callable) -> typing.Any:
+        started_at = monotonic()
+
+        try:
+            return await handler(task=task)
+        finally:
+            self._check(target_name=task.target_name, execution_time=monotonic() - started_at, profiler=None)
+
+    def _check(self, *, target_name: str, execution_time: float, profiler: typing.Optional[cProfile.Profile]) -> None:
+        with self._lock:
+            if execution_time <= self.threshold.total_seconds() or profiler is not None:
+                self._slow_targets.discard(target_name)
+            else:
+                # The next run is profiled.
+                self._slow_targets.add(target_name)
+
+        if execution_time <= self.threshold.total_seconds() or profiler is None:
+            return
+
+        stream = io.StringIO()
+        pstats.Stats(profiler, stream=stream).strip_dirs().sort_stats(pstats.SortKey.CUMULATIVE).print_stats(
+            self.line_limit,
+        )
+        self.profiles.add(target_name=target_name, execution_time=execution_time, profile=stream.getvalue().strip())
 
 
 class ExceptionLogging(BaseMiddleware):
@@ -90,7 +310,18 @@ class ExceptionLogging(BaseMiddleware):
         try:
             return handler(task=task)
         except Exception as e:
-            logging.exception(e)
-            task.error = e
-            task.status = constants.TaskStatuses.FAILED
+            self._log_exception(task=task, exception=e)
+            return None
+
+    async def aprocess(self, *, task: Task, task_queue: BaseTaskQueue, handler: typing.Callable) -> typing.Any:
+        try:
+            return await handler(task=task)
+        except Exception as e:
+            self._log_exception(task=task, exception=e)
             return None
+
+    @staticmethod
+    def _log_exception(*, task: Task, exception: Exception) -> None:
+        logging.exception(exception)
+        task.error = exception
+        task.status = constants.TaskStatuses.FAILED
@@ -0,0 +1,105 @@
+import importlib
+import inspect
+import pickle
+import typing
+from functools import partial
+
+from .dto import Task
+from .exceptions import SerializationError
+
+
+__all__ = ('TaskSerializer',)
+
+
+class TaskSerializer:
+    """
+    Targets are referenced by import paths (`module:qualname`),
+    and bound methods of registered instances by names of the instances (`@name.method`).
+    Partial targets are unwrapped into args and kwargs. Args, kwargs and options are pickled.
+    """
+
+    instances: typing.Dict[str, typing.Any]
+    _instance_names: typing.Dict[int, str]
+
+    def __init__(self) -> None:
+        self.instances = {}
+        self._instance_names = {}
+
+    def register_instance(self, name: str, instance: typing.Any) -> None:
+        self.instances[name] = instance
+        self._instance_names[id(instance)] = name
+
+    def dumps(self, task: Task) -> tuple[str, bytes]:
+        """
+        Returns the path of the target and pickled params of the task.
+        """
+
+        target = task.target
+        args = task.args
+        kwargs = task.kwargs
+
+        while isinstance(target, partial):
+            args = target.args + tuple(args)
+            kwargs = {**target.keywords, **kwargs}
+            target = target.func
+
+        target_path = self.dump_target(target)
+
+        try:
+            data = pickle.dumps({'args': tuple(args), 'kwargs': kwargs, 'options': task.options})
+        except Exception as e:
+            raise SerializationError(f'Params of {task} are not picklable') from e
+
+        return target_path, data
+
+    def loads(self, target_path: str, data: bytes, **params) -> Task:
+        try:
+            task_params = pickle.loads(data)
+        except Exception as e:
+            raise SerializationError(f'Params of {target_path} are broken') from e
+
+        return Task.create(target=self.load_target(target_path), **task_params, **params)
+
+    def dump_target(self, target: typing.Callable) -> str:
+        if inspect.ismethod(target) and id(target.__self__) in self._instance_names:
+            target_path = f'@{self._instance_names[id(target.__self__)]}.{target.__name__}'
+        else:
+            # Built-in methods of classes have no modules.
+            module_name = getattr(target, '__module__', None) or getattr(
+                getattr(target, '__self__', None),
+                '__module__',
+                None,
+            )
+            qualname = getattr(target, '__qualname__', '')
+
+            if module_name is None or '<' in qualname:
+                raise SerializationError(f'{target} is not importable')
+
+            target_path = f'{module_name}:{qualname}'
+
+        # Decorated or reassigned targets can't be found by their names.
+        if self.load_target(target_path) != target:
+            raise SerializationError(f'{target} is not found by {target_path}')
+
+        return target_path
+
+    def load_target(self, target_path: str) -> typing.Callable:
+        target: typing.Any
+
+        try:
+            if target_path.startswith('@'):
+                instance_name, method_name = target_path[1:].rsplit('.', 1)
+                target = getattr(self.instances[instance_name], method_name)
+            else:
+                module_name, qualname = target_path.split(':', 1)
+                target = importlib.import_module(module_name)
+
+                for name in qualname.split('.'):
+                    target = getattr(target, name)
+        except (AttributeError, ImportError, KeyError, ValueError) as e:
+            raise SerializationError(f'{target_path} is not found') from e
+
+        if not callable(target):
+            raise SerializationError(f'{target_path} is not callable')
+
+        return target
@@ -0,0 +1,75 @@
+import asyncio
+import threading
+import time
+import typing
+
+from ..constants import TaskStatuses
+from ..exceptions import RepeatTask
+from ..implementation import AsyncioWorker, MemTaskQueue
+from ..middlewares import ExceptionLogging, SupportOfRetries
+
+
+def _wait_for(condition: typing.Callable[[], bool], timeout: float = 10) -> None:
+    deadline = time.monotonic() + timeout
+
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+
+def _create_worker(task_queue: MemTaskQueue) -> AsyncioWorker:
+    return AsyncioWorker(
+        task_queue=task_queue,
+        middlewares=(
+            ExceptionLogging(),
+            SupportOfRetries(),
+        ),
+    )
+
+
+def test_running_coroutines_concurrently():
+    async def _sleep(value: int) -> int:
+        await asyncio.sleep(0.2)
+        return value
+
+    task_queue = MemTaskQueue()
+    worker = _create_worker(task_queue)
+    worker.run()
+
+    started_at = time.monotonic()
+
+    try:
+        tasks = tuple(task_queue.put(_sleep, args=(i,)) for i in range(20))
+        _wait_for(lambda: all(task.status == TaskStatuses.FINISHED for task in tasks))
+    finally:
+        worker.stop()
+
+    assert time.monotonic() - started_at < 2
+    assert [task.result for task in tasks] == list(range(20))
+
+
+def test_retries_and_sync_targets():
+    attempts = []
+
+    async def _fail_once() -> str:
+        attempts.append(1)
+
+        if len(attempts) == 1:
+            raise RepeatTask()
+
+        return 'done'
+
+    task_queue = MemTaskQueue()
+    worker = _create_worker(task_queue)
+    worker.run()
+
+    try:
+        retried_task = task_queue.put(_fail_once)
+        sync_task = task_queue.put(threading.get_ident)
+        _wait_for(lambda: retried_task.result == 'done' and sync_task.status == TaskStatuses.FINISHED)
+    finally:
+        worker.stop()
+
+    assert len(attempts) == 2
+    assert retried_task.result == 'done'
+    assert sync_task.status == TaskStatuses.FINISHED
+    assert sync_task.result != threading.get_ident()
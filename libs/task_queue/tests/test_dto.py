@@ -0,0 +1,59 @@
+import datetime
+from unittest import mock
+
+from .. import dto
+from ..constants import TaskStatuses
+from ..dto import IntervalTask, Task
+
+
+def test_tasks_are_slotted():
+    task = IntervalTask.create(print, priority=1, interval=datetime.timedelta(seconds=1))
+
+    assert not hasattr(task, '__dict__')
+
+
+def test_canceled_task_is_not_started():
+    canceled_tasks = []
+    task = Task.create(print, priority=1)
+    task.set_cancel_callback(canceled_tasks.append)
+
+    assert task.cancel()
+    assert not task.cancel()
+    assert canceled_tasks == [task]
+
+    task.run()
+
+    assert task.status == TaskStatuses.CANCELED
+
+
+def test_started_task_is_not_canceled():
+    task = Task.create(lambda: task.cancel(), priority=1)
+    task.run()
+
+    assert task.result is False
+    assert task.status == TaskStatuses.FINISHED
+    assert not task.cancel()
+    assert task.status == TaskStatuses.FINISHED
+
+
+def test_interval_task_with_fixed_rate():
+    task = IntervalTask.create(print, priority=1, interval=datetime.timedelta(seconds=10), fixed_rate=True)
+
+    with mock.patch.object(dto, 'monotonic', side_effect=(100, 103, 125)):
+        task._schedule()
+
+        assert task._get_next_delay() == datetime.timedelta(seconds=7)
+        assert task._get_next_delay() == datetime.timedelta(seconds=5)
+
+
+def test_interval_task_with_jitter():
+    now = datetime.datetime.now()
+    task = IntervalTask.create(
+        print,
+        priority=1,
+        interval=datetime.timedelta(seconds=10),
+        jitter=datetime.timedelta(seconds=5),
+        run_after=now,
+    )
+
+    assert now <= task.run_after <= now + datetime.timedelta(seconds=5)
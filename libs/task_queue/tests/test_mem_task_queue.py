@@ -0,0 +1,381 @@
+import datetime
+import gc
+import threading
+import weakref
+from time import monotonic
+from unittest import mock
+
+import numpy as np
+
+from .. import base
+from ..batching import BatchTask, batchable
+from ..constants import MergePolicies, OverflowPolicies, TaskOptions, TaskPriorities, TaskStatuses
+from ..dto import Capacity
+from ..exceptions import RepeatTask
+from ..implementation import MemTaskQueue
+from ..metrics import TaskMetrics
+from ..middlewares import SupportOfRetries
+
+
+class Frame:
+    pass
+
+
+def test_get_without_blocking():
+    task_queue = MemTaskQueue()
+
+    assert task_queue.get() is None
+
+    task = task_queue.put(lambda: None)
+
+    assert len(task_queue) == 1
+    assert task_queue.get() is task
+    assert len(task_queue) == 0
+
+
+def test_get_respects_priorities():
+    task_queue = MemTaskQueue()
+
+    low_task = task_queue.put(lambda: None, priority=TaskPriorities.LOW)
+    high_task = task_queue.put(lambda: None, priority=TaskPriorities.HIGH)
+
+    assert task_queue.get() is high_task
+    assert task_queue.get() is low_task
+
+
+def test_get_waits_for_run_after():
+    task_queue = MemTaskQueue()
+    task = task_queue.put(lambda: None, run_after=datetime.datetime.now() + datetime.timedelta(seconds=0.2))
+
+    assert task_queue.get() is None
+
+    started_at = monotonic()
+
+    assert task_queue.get(block=True, timeout=5) is task
+    assert 0.1 < monotonic() - started_at < 2
+
+
+def test_get_is_woken_up_by_put():
+    task_queue = MemTaskQueue()
+    timer = threading.Timer(0.1, task_queue.put, args=(lambda: None,))
+    timer.start()
+
+    started_at = monotonic()
+
+    assert task_queue.get(block=True, timeout=5) is not None
+    assert monotonic() - started_at < 2
+
+    timer.join()
+
+
+def test_get_with_timeout():
+    task_queue = MemTaskQueue()
+
+    assert task_queue.get(block=True, timeout=0.05) is None
+
+
+def test_wake_up():
+    task_queue = MemTaskQueue()
+    timer = threading.Timer(0.1, task_queue.wake_up)
+    timer.start()
+
+    started_at = monotonic()
+
+    assert task_queue.get(block=True) is None
+    assert monotonic() - started_at < 2
+
+    timer.join()
+
+
+def test_delayed_task_does_not_block_ready_tasks():
+    task_queue = MemTaskQueue()
+
+    task_queue.put(
+        lambda: None,
+        priority=TaskPriorities.HIGH,
+        run_after=datetime.datetime.now() + datetime.timedelta(hours=1),
+    )
+    ready_task = task_queue.put(lambda: None, priority=TaskPriorities.HIGH)
+
+    assert len(task_queue) == 2
+    assert task_queue.get() is ready_task
+    assert task_queue.get() is None
+    assert len(task_queue) == 1
+
+
+def test_due_tasks_keep_priority_order():
+    task_queue = MemTaskQueue()
+    run_after = datetime.datetime.now() + datetime.timedelta(seconds=0.1)
+
+    low_task = task_queue.put(lambda: None, priority=TaskPriorities.LOW, run_after=run_after)
+    high_task = task_queue.put(lambda: None, priority=TaskPriorities.HIGH, run_after=run_after)
+
+    assert task_queue.get(block=True, timeout=5) is high_task
+    assert task_queue.get() is low_task
+
+
+def test_get_by_priorities():
+    task_queue = MemTaskQueue()
+
+    low_task = task_queue.put(lambda: None, priority=TaskPriorities.LOW)
+    medium_task = task_queue.put(lambda: None, priority=TaskPriorities.MEDIUM)
+
+    assert task_queue.get(priorities=(TaskPriorities.HIGH,)) is None
+    assert task_queue.get(priorities=(TaskPriorities.LOW, TaskPriorities.MEDIUM)) is low_task
+    assert task_queue.get(priorities=(TaskPriorities.LOW, TaskPriorities.MEDIUM)) is medium_task
+
+
+def test_dedup_key_with_dropping_new_tasks():
+    task_queue = MemTaskQueue()
+
+    task = task_queue.put(print, args=(1,), dedup_key='key')
+    new_task = task_queue.put(print, args=(2,), dedup_key='key')
+
+    assert task_queue.put(print, args=(3,), dedup_key='key') is task
+    assert new_task is task
+    assert len(task_queue) == 1
+    assert task_queue.get() is task
+    assert task.args == (1,)
+
+    assert task_queue.put(print, dedup_key='key') is not task
+
+    options = {}
+    task_queue.put(print, options=options, dedup_key='other_key')
+
+    assert options == {}
+
+
+def test_dedup_key_with_replacing_old_tasks():
+    task_queue = MemTaskQueue()
+
+    old_task = task_queue.put(print, args=(1,), dedup_key='key', merge_policy=MergePolicies.REPLACE_OLD)
+    new_task = task_queue.put(print, args=(2,), dedup_key='key', merge_policy=MergePolicies.REPLACE_OLD)
+
+    assert new_task is not old_task
+    assert old_task.status == TaskStatuses.CANCELED
+    assert new_task.status == TaskStatuses.PENDING
+
+
+def test_dedup_key_with_keeping_latest_args():
+    task_queue = MemTaskQueue()
+
+    task = task_queue.put(print, args=(1,), dedup_key='key', merge_policy=MergePolicies.KEEP_LATEST_ARGS)
+
+    assert task_queue.put(print, args=(2,), dedup_key='key', merge_policy=MergePolicies.KEEP_LATEST_ARGS) is task
+    assert len(task_queue) == 1
+    assert task_queue.get().args == (2,)
+
+    task = task_queue.put(print, args=(3,), dedup_key='key', merge_policy=MergePolicies.KEEP_LATEST_ARGS)
+    task.status = TaskStatuses.STARTED
+    new_task = task_queue.put(print, args=(4,), dedup_key='key', merge_policy=MergePolicies.KEEP_LATEST_ARGS)
+
+    assert new_task is not task
+    assert task.args == (3,)
+
+
+def test_canceling_releases_tasks():
+    task_queue = MemTaskQueue()
+    frame = Frame()
+    tasks = [
+        task_queue.put(print, args=(frame,), run_after=datetime.datetime.now() + datetime.timedelta(hours=1))
+        for _ in range(300)
+    ]
+    ready_task = task_queue.put(print)
+
+    for task in tasks:
+        assert task.cancel()
+
+    assert len(task_queue) == 1
+    assert task_queue._tasks._removed <= task_queue._tasks.compaction_threshold
+    assert len(task_queue._tasks.delayed_tasks) <= task_queue._tasks.compaction_threshold
+
+    frame_reference = weakref.ref(frame)
+    del tasks, task, frame
+    gc.collect()
+
+    assert frame_reference() is None
+    assert task_queue.get() is ready_task
+    assert task_queue.get() is None
+
+
+def test_capacity_drops_oldest_tasks():
+    task_queue = MemTaskQueue(capacities={TaskPriorities.LOW: Capacity(max_bytes=250)})
+    frame = np.zeros(100, dtype=np.uint8)
+
+    old_task = task_queue.put(print, kwargs={'frames': [frame]}, priority=TaskPriorities.LOW)
+    light_task = task_queue.put(print, priority=TaskPriorities.LOW)
+    tasks = [task_queue.put(print, args=(frame,), priority=TaskPriorities.LOW) for _ in range(2)]
+
+    assert old_task.status == TaskStatuses.CANCELED
+    assert len(task_queue) == 3
+    assert task_queue.get() is light_task
+    assert task_queue.get() is tasks[0]
+    assert task_queue._tasks.weights[TaskPriorities.LOW] == 100
+
+    task_queue.put(print, args=(np.zeros(300, dtype=np.uint8),), priority=TaskPriorities.LOW)
+
+    assert task_queue.get() is tasks[1]
+    assert task_queue.get() is None
+
+
+def test_capacity_drops_new_tasks():
+    task_queue = MemTaskQueue(
+        capacities={TaskPriorities.LOW: Capacity(max_bytes=150, overflow_policy=OverflowPolicies.DROP_NEW)},
+    )
+    frame = np.zeros(100, dtype=np.uint8)
+
+    old_task = task_queue.put(print, args=(frame,), priority=TaskPriorities.LOW)
+    new_task = task_queue.put(print, args=(frame,), priority=TaskPriorities.LOW)
+    high_task = task_queue.put(print, args=(frame,), priority=TaskPriorities.HIGH)
+
+    assert new_task.status == TaskStatuses.CANCELED
+    assert task_queue.get() is high_task
+    assert task_queue.get() is old_task
+    assert task_queue.get() is None
+
+
+def test_capacity_degrades_tasks():
+    def degrade(task):
+        task.kwargs['frames'] = task.kwargs['frames'][::2]
+
+    task_queue = MemTaskQueue(capacities={TaskPriorities.LOW: Capacity(max_bytes=250)})
+    frames = [np.zeros(100, dtype=np.uint8)] * 4
+
+    old_task = task_queue.put(print, kwargs={'frames': frames[:1]}, priority=TaskPriorities.LOW)
+    new_task = task_queue.put(
+        print,
+        kwargs={'frames': frames},
+        priority=TaskPriorities.LOW,
+        options={TaskOptions.DEGRADE: degrade},
+    )
+
+    assert old_task.status == TaskStatuses.CANCELED
+    assert new_task.status == TaskStatuses.PENDING
+    assert len(new_task.kwargs['frames']) == 2
+
+
+def test_batching():
+    @batchable(max_size=2, max_wait=datetime.timedelta(seconds=0.1))
+    def _sum(items: list[int], *, start: int = 0) -> int:
+        return sum(items, start)
+
+    task_queue = MemTaskQueue()
+    tasks = [task_queue.put(_sum, args=(i,), kwargs={'start': 10}) for i in range(3)]
+    canceled_task = task_queue.put(_sum, args=(100,))
+    later_task = task_queue.put(_sum, args=(1000,), run_after=datetime.datetime.now() + datetime.timedelta(hours=1))
+
+    assert task_queue.get() is None
+
+    batch_task = task_queue.get(block=True, timeout=5)
+
+    assert isinstance(batch_task, BatchTask)
+    assert batch_task.tasks == tasks[:2]
+
+    batch_task.run()
+    batch_task.resolve_future()
+
+    assert batch_task.result == 11
+    assert all(task.status == TaskStatuses.FINISHED and task.result == 11 for task in tasks[:2])
+
+    batch_task = task_queue.get()
+
+    assert batch_task.tasks == [tasks[2], canceled_task]
+
+    canceled_task.cancel()
+    batch_task.run()
+    batch_task.resolve_future()
+
+    assert batch_task.tasks == [tasks[2]]
+    assert tasks[2].result == 12
+    assert task_queue.get() is None
+    assert len(task_queue) == 1
+    assert later_task.status == TaskStatuses.PENDING
+
+
+def test_tasks_of_retried_batches_are_not_finished():
+    attempts = []
+
+    @batchable(max_size=2, max_wait=datetime.timedelta())
+    def _sum(items: list[int]) -> int:
+        attempts.append(items)
+
+        if len(attempts) == 1:
+            raise RepeatTask()
+
+        return sum(items)
+
+    task_queue = MemTaskQueue()
+    tasks = [task_queue.put(_sum, args=(i,)) for i in range(1, 3)]
+    futures = [task.future for task in tasks]
+    middleware = SupportOfRetries()
+
+    for _ in range(2):
+        batch_task = task_queue.get(block=True, timeout=5)
+        middleware.process(task=batch_task, task_queue=task_queue, handler=lambda task: task.run())
+        batch_task.resolve_future()
+
+        if len(attempts) == 1:
+            assert not any(future.done() for future in futures)
+
+    assert [future.result(timeout=0) for future in futures] == [3, 3]
+    assert all(task.status == TaskStatuses.FINISHED for task in tasks)
+
+
+def test_delayed_tasks_use_monotonic_clock():
+    task_queue = MemTaskQueue()
+    task = task_queue.put(print, run_after=datetime.datetime.now() + datetime.timedelta(hours=1))
+
+    assert task_queue.get() is None
+
+    with mock.patch.object(base, 'monotonic', return_value=monotonic() + 2 * 60 * 60):
+        assert task_queue.get() is task
+
+
+def test_aging():
+    task_metrics = TaskMetrics()
+    task_queue = MemTaskQueue(
+        aging={
+            TaskPriorities.MEDIUM: datetime.timedelta(seconds=10),
+            TaskPriorities.LOW: datetime.timedelta(seconds=10),
+        },
+        task_metrics=task_metrics,
+    )
+    now = datetime.datetime.now()
+
+    high_task = task_queue.put(print, priority=TaskPriorities.HIGH)
+    old_low_task = task_queue.put(print, priority=TaskPriorities.LOW, run_after=now - datetime.timedelta(seconds=25))
+    low_task = task_queue.put(print, priority=TaskPriorities.LOW, run_after=now - datetime.timedelta(seconds=15))
+    medium_task = task_queue.put(print, priority=TaskPriorities.MEDIUM, run_after=now - datetime.timedelta(seconds=5))
+
+    assert task_queue.get() is old_low_task
+    assert task_queue.get() is high_task
+    assert task_queue.get() is low_task
+    assert task_queue.get() is medium_task
+    assert task_metrics.get_aged_tasks() == {(old_low_task.target_name, TaskPriorities.LOW): 2}
+    assert task_metrics.to_str().startswith('Aging: priority 2 every 0:00:10, priority 3 every 0:00:10')
+
+
+def test_fair_queuing_by_owners():
+    task_queue = MemTaskQueue(owner_weights={'camera': 2})
+    camera_queue = base.OwnedTaskQueue(task_queue, owner='camera')
+    signals_queue = base.OwnedTaskQueue(task_queue, owner='signals')
+
+    camera_tasks = [camera_queue.put(print) for _ in range(4)]
+    signals_tasks = [signals_queue.put(print) for _ in range(2)]
+    own_task = signals_queue.put(print, options={TaskOptions.OWNER: 'camera'})
+
+    assert camera_tasks[0].options[TaskOptions.OWNER] == 'camera'
+    assert signals_tasks[0].options[TaskOptions.OWNER] == 'signals'
+    assert task_queue.get_owner_depths() == {'camera': 5, 'signals': 2}
+    assert signals_queue.get_owner_depths() == task_queue.get_owner_depths()
+
+    assert [task_queue.get() for _ in range(7)] == [
+        camera_tasks[0],
+        signals_tasks[0],
+        camera_tasks[1],
+        camera_tasks[2],
+        signals_tasks[1],
+        camera_tasks[3],
+        own_task,
+    ]
+    assert task_queue.get_owner_depths() == {}
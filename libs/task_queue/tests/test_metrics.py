@@ -0,0 +1,58 @@
+import datetime
+from functools import partial
+
+from ..constants import TaskOptions, TaskPriorities
+from ..dto import Task
+from ..implementation import MemTaskQueue
+from ..metrics import Histogram, TaskMetrics
+from ..middlewares import CollectingMetrics
+
+
+def test_histogram():
+    histogram = Histogram(buckets=(1, 2, 5))
+
+    for value in (0.5, 0.7, 1.5, 3, 10):
+        histogram.add(value)
+
+    assert histogram.count == 5
+    assert histogram.max == 10
+    assert histogram.get_percentile(40) == 1
+    assert histogram.get_percentile(60) == 2
+    assert histogram.get_percentile(80) == 5
+    assert histogram.get_percentile(100) == 10
+
+
+def test_collecting_metrics():
+    metrics = TaskMetrics()
+    middleware = CollectingMetrics(metrics=metrics)
+    task = Task.create(
+        target=partial(max, 1),
+        args=(2,),
+        priority=TaskPriorities.LOW,
+        run_after=datetime.datetime.now() - datetime.timedelta(seconds=3),
+    )
+
+    middleware.process(task=task, task_queue=MemTaskQueue(), handler=lambda task: task.run())
+
+    snapshot = metrics.snapshot()
+
+    assert tuple(snapshot.keys()) == (('builtins.max', TaskPriorities.LOW),)
+    assert snapshot[('builtins.max', TaskPriorities.LOW)]['waiting_time']['max'] >= 3
+    assert snapshot[('builtins.max', TaskPriorities.LOW)]['execution_time']['count'] == 1
+    assert 'builtins.max' in metrics.to_str()
+
+
+def test_metrics_by_owners():
+    metrics = TaskMetrics()
+    middleware = CollectingMetrics(metrics=metrics)
+    task = Task.create(target=print, priority=TaskPriorities.LOW, options={TaskOptions.OWNER: 'Camera'})
+
+    middleware.process(task=task, task_queue=MemTaskQueue(), handler=lambda task: None)
+
+    assert tuple(metrics.snapshot_owners().keys()) == ('Camera',)
+    assert metrics.snapshot_owners()['Camera']['execution_time']['count'] == 1
+
+    summary = metrics.to_str(owner_depths={'Camera': 3, 'Signals': 1})
+
+    assert 'By module:\nCamera: 3 pending, 1 runs\n' in summary
+    assert summary.endswith('\nSignals: 1 pending')
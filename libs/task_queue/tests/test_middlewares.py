@@ -0,0 +1,113 @@
+import asyncio
+import datetime
+import time
+import typing
+from functools import partial
+
+import pytest
+
+from ..constants import TaskOptions
+from ..dto import Rate, Task
+from ..exceptions import RepeatTask
+from ..implementation import MemTaskQueue
+from ..metrics import TaskMetrics, TaskProfiles
+from ..middlewares import BaseMiddleware, CollectingMetrics, Profiling, RateLimit, SupportOfRetries
+
+
+def _done(*, task: Task) -> str:
+    return 'done'
+
+
+def test_middlewares_without_aprocess():
+    class Middleware(BaseMiddleware):
+        def process(self, *, task: Task, task_queue: MemTaskQueue, handler: typing.Callable) -> typing.Any:
+            return handler(task=task)
+
+    middleware = Middleware()
+    task = Task.create(print, priority=1)
+
+    assert middleware.process(task=task, task_queue=MemTaskQueue(), handler=_done) == 'done'
+
+    with pytest.raises(NotImplementedError):
+        asyncio.run(middleware.aprocess(task=task, task_queue=MemTaskQueue(), handler=_done))
+
+
+def test_rate_limit():
+    task_queue = MemTaskQueue()
+    middleware = RateLimit(rates={'key': Rate(per_second=10, burst=2)})
+    tasks = [Task.create(print, priority=1, options={TaskOptions.RATE_LIMIT_KEY: 'key'}) for _ in range(4)]
+
+    def _process(task: Task) -> str:
+        return middleware.process(task=task, task_queue=task_queue, handler=lambda task: 'done')
+
+    assert _process(tasks[0]) == 'done'
+    assert _process(tasks[1]) == 'done'
+
+    now = datetime.datetime.now()
+    repeat_afters = []
+
+    for task in tasks[2:]:
+        with pytest.raises(RepeatTask) as exc_info:
+            _process(task)
+
+        repeat_afters.append(exc_info.value.after)
+
+    assert now < repeat_afters[0] < now + datetime.timedelta(seconds=0.2)
+    assert repeat_afters[0] + datetime.timedelta(seconds=0.05) < repeat_afters[1]
+    assert _process(tasks[2]) == 'done'
+    assert _process(Task.create(print, priority=1)) == 'done'
+
+
+def test_postponed_runs_are_not_collected():
+    task_queue = MemTaskQueue()
+    metrics = TaskMetrics()
+    middlewares = (
+        CollectingMetrics(metrics=metrics),
+        SupportOfRetries(),
+        RateLimit(rates={'key': Rate(per_second=1, burst=1)}),
+    )
+    handler = _done
+
+    for middleware in reversed(middlewares):
+        handler = partial(middleware.process, task_queue=task_queue, handler=handler)
+
+    tasks = [Task.create(print, priority=1, options={TaskOptions.RATE_LIMIT_KEY: 'key'}) for _ in range(2)]
+
+    for task in tasks:
+        handler(task=task)
+
+    assert metrics.snapshot()[(tasks[0].target_name, 1)]['execution_time']['count'] == 1
+    assert tasks[1].options[TaskOptions.RATE_LIMIT_IS_BOOKED]
+
+
+def test_profiling():
+    task_queue = MemTaskQueue()
+    profiles = TaskProfiles(size=2)
+    middleware = Profiling(profiles=profiles, sample_rate=0, threshold=datetime.timedelta(milliseconds=50))
+
+    def _sleep(seconds: float) -> None:
+        time.sleep(seconds)
+
+    def _process(seconds: float) -> None:
+        task = Task.create(_sleep, priority=1, args=(seconds,))
+        middleware.process(task=task, task_queue=task_queue, handler=lambda task: task.run())
+
+    target_name = Task.create(_sleep, priority=1).target_name
+
+    # The first slow run isn't sampled, but the next one is profiled.
+    _process(0.06)
+    assert profiles.get(target_name) == []
+
+    _process(0.06)
+    _process(0)
+    _process(0.08)
+    _process(0.1)
+    _process(0.07)
+
+    execution_times = [execution_time for execution_time, _ in profiles.get(target_name)]
+
+    # Runs for 0.06s and 0.1s are profiled.
+    assert len(execution_times) == 2
+    assert execution_times[0] >= 0.1 > execution_times[1] >= 0.06
+    assert 'time.sleep' in profiles.get(target_name)[0][1]
+    assert profiles.to_str().startswith(f'{target_name}: 0.1')
@@ -0,0 +1,43 @@
+import math
+import os
+import time
+
+from ..constants import TaskOptions, TaskStatuses
+from ..implementation import MemTaskQueue, ProcessPoolWorker
+from ..middlewares import ExceptionLogging, SupportOfRetries
+
+
+def _wait_for(task, timeout: float = 30) -> None:
+    deadline = time.monotonic() + timeout
+
+    while task.status not in (TaskStatuses.FINISHED, TaskStatuses.FAILED) and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+
+def test_running_in_process_pool():
+    task_queue = MemTaskQueue()
+    worker = ProcessPoolWorker(
+        task_queue=task_queue,
+        middlewares=(
+            ExceptionLogging(),
+            SupportOfRetries(),
+        ),
+        processes=1,
+    )
+    worker.run()
+
+    try:
+        task_in_process = task_queue.put(os.getpid, options={TaskOptions.USE_PROCESS_POOL: True})
+        task_in_thread = task_queue.put(os.getpid)
+        failed_task = task_queue.put(math.sqrt, args=(-1,), options={TaskOptions.USE_PROCESS_POOL: True})
+
+        for task in (task_in_process, task_in_thread, failed_task):
+            _wait_for(task)
+    finally:
+        worker.stop()
+
+    assert task_in_process.status == TaskStatuses.FINISHED
+    assert task_in_process.result != os.getpid()
+    assert task_in_thread.result == os.getpid()
+    assert failed_task.status == TaskStatuses.FAILED
+    assert isinstance(failed_task.error, ValueError)
@@ -0,0 +1,170 @@
+import datetime
+from functools import partial
+
+import pytest
+import sqlalchemy
+from sqlalchemy import create_engine
+from sqlalchemy.pool import StaticPool
+
+from ..constants import TaskOptions, TaskPriorities
+from ..dto import IntervalTask
+from ..exceptions import SerializationError
+from ..implementation import SQLTaskQueue
+from ..implementation.sql import task_table
+from ..serializers import TaskSerializer
+
+
+class Lamp:
+    def turn_on(self, *, brightness: int) -> int:
+        return brightness
+
+
+@pytest.fixture
+def engine():
+    return create_engine('sqlite://', poolclass=StaticPool, connect_args={'check_same_thread': False})
+
+
+def test_durable_tasks_are_restored(engine):
+    task_queue = SQLTaskQueue(engine=engine)
+    run_after = datetime.datetime.now() - datetime.timedelta(seconds=1)
+    task_queue.put(max, args=(1, 2), run_after=run_after, options={TaskOptions.DURABLE: True})
+    task_queue.put(min, args=(1, 2))
+    task_queue.close()
+
+    first_task_queue = SQLTaskQueue(engine=engine)
+    second_task_queue = SQLTaskQueue(engine=engine)
+
+    assert first_task_queue.restore() == 1
+    assert second_task_queue.restore() == 1
+
+    task = first_task_queue.get()
+
+    assert task.target is max
+    assert task.args == (1, 2)
+    assert task.run_after == run_after
+    assert task.priority == TaskPriorities.MEDIUM
+
+    # The task is claimed by the first queue.
+    assert second_task_queue.get() is None
+    assert SQLTaskQueue(engine=engine).restore() == 0
+
+
+def test_canceled_durable_tasks_are_forgotten(engine):
+    task_queue = SQLTaskQueue(engine=engine)
+    task = task_queue.put(max, args=(1, 2), options={TaskOptions.DURABLE: True})
+    task_queue.flush()
+    task.cancel()
+    task_queue.close()
+
+    assert SQLTaskQueue(engine=engine).restore() == 0
+
+
+def test_putting_and_canceling_dont_wait_for_flushes(engine):
+    task_queue = SQLTaskQueue(engine=engine)
+
+    with task_queue._flush_lock:
+        task = task_queue.put(max, args=(1, 2), options={TaskOptions.DURABLE: True})
+        task.cancel()
+
+    task_queue.close()
+
+    assert SQLTaskQueue(engine=engine).restore() == 0
+
+
+def test_schedules_of_repeatable_tasks_are_resumed(engine):
+    lamp = Lamp()
+    task_queue = SQLTaskQueue(engine=engine)
+    task_queue.register_instance('lamp', lamp)
+    task = IntervalTask.create(lamp.turn_on, priority=TaskPriorities.LOW, interval=datetime.timedelta(hours=1))
+    task_queue.put_task(task)
+
+    assert task_queue.get() is task
+
+    task.run_after = datetime.datetime.now() + task.interval
+    task_queue.put_task(task)
+    task_queue.close()
+
+    task_queue = SQLTaskQueue(engine=engine)
+    task_queue.register_instance('lamp', lamp)
+    new_task = IntervalTask.create(lamp.turn_on, priority=TaskPriorities.LOW, interval=datetime.timedelta(hours=1))
+    task_queue.put_task(new_task)
+
+    assert new_task.run_after == task.run_after
+    assert task_queue.get() is None
+
+
+def test_schedules_are_resumed_by_params(engine):
+    lamp = Lamp()
+    task_queue = SQLTaskQueue(engine=engine)
+    task_queue.register_instance('lamp', lamp)
+    tasks = [
+        IntervalTask.create(
+            lamp.turn_on,
+            kwargs={'brightness': brightness},
+            priority=TaskPriorities.LOW,
+            interval=datetime.timedelta(hours=brightness),
+            run_immediately=False,
+        )
+        for brightness in (1, 2)
+    ]
+    frequent_task = IntervalTask.create(
+        lamp.turn_on,
+        kwargs={'brightness': 3},
+        priority=TaskPriorities.LOW,
+        interval=datetime.timedelta(seconds=10),
+        run_immediately=False,
+    )
+
+    for task in (*tasks, frequent_task):
+        task_queue.put_task(task)
+
+    task_queue.close()
+
+    with engine.connect() as connection:
+        assert connection.execute(sqlalchemy.select(sqlalchemy.func.count()).select_from(task_table)).scalar() == 2
+
+    # Tasks are put in another order.
+    task_queue = SQLTaskQueue(engine=engine)
+    task_queue.register_instance('lamp', lamp)
+    new_tasks = [
+        IntervalTask.create(
+            lamp.turn_on,
+            kwargs={'brightness': brightness},
+            priority=TaskPriorities.LOW,
+            interval=datetime.timedelta(hours=brightness),
+        )
+        for brightness in (2, 1)
+    ]
+
+    for new_task in new_tasks:
+        task_queue.put_task(new_task)
+
+    task_queue.close()
+
+    assert [new_task.run_after for new_task in new_tasks] == [tasks[1].run_after, tasks[0].run_after]
+
+
+def test_task_serializer():
+    lamp = Lamp()
+    serializer = TaskSerializer()
+    serializer.register_instance('lamp', lamp)
+    task_queue = SQLTaskQueue(engine=create_engine('sqlite://'))
+    task = task_queue.put(partial(lamp.turn_on, brightness=10), priority=TaskPriorities.HIGH)
+    task_queue.close()
+
+    target_path, data = serializer.dumps(task)
+    loaded_task = serializer.loads(target_path, data, priority=task.priority)
+
+    assert target_path == '@lamp.turn_on'
+    assert loaded_task.target == lamp.turn_on
+    assert loaded_task.kwargs == {'brightness': 10}
+    assert serializer.dump_target(datetime.datetime.now) == 'datetime:datetime.now'
+
+    with pytest.raises(SerializationError):
+        serializer.dump_target(lambda: None)
+
+    with pytest.raises(SerializationError):
+        serializer.dump_target(Lamp().turn_on)
+
+    with pytest.raises(SerializationError):
+        serializer.load_target('datetime:timezone.utc')
@@ -0,0 +1,244 @@
+import asyncio
+import datetime
+import threading
+import time
+
+from ..constants import TaskOptions, TaskPriorities, TaskStatuses
+from ..dto import Lane
+from ..implementation import MemTaskQueue, ThreadWorker
+from ..metrics import TaskMetrics
+from ..exceptions import RepeatTask
+from ..middlewares import ExceptionLogging, SupportOfRetries
+
+
+def test_lanes():
+    task_queue = MemTaskQueue()
+    worker = ThreadWorker(
+        task_queue=task_queue,
+        middlewares=(
+            ExceptionLogging(),
+            SupportOfRetries(),
+        ),
+        lanes=(
+            Lane(priorities=(TaskPriorities.HIGH,)),
+            Lane(priorities=(TaskPriorities.LOW,), borrowed_priorities=(TaskPriorities.HIGH,)),
+        ),
+    )
+    low_task_is_started = threading.Event()
+    low_task_is_released = threading.Event()
+    high_task_is_done = threading.Event()
+
+    def _low_task() -> None:
+        low_task_is_started.set()
+        low_task_is_released.wait(10)
+
+    worker.run()
+
+    try:
+        task_queue.put(_low_task, priority=TaskPriorities.LOW)
+        assert low_task_is_started.wait(5)
+
+        task_queue.put(low_task_is_released.wait, args=(10,), priority=TaskPriorities.LOW)
+        task_queue.put(high_task_is_done.set, priority=TaskPriorities.HIGH)
+
+        assert high_task_is_done.wait(5)
+        assert len(task_queue) == 1
+    finally:
+        low_task_is_released.set()
+        worker.stop()
+
+
+def test_stuck_threads_are_replaced():
+    task_queue = MemTaskQueue()
+    task_metrics = TaskMetrics()
+    worker = ThreadWorker(
+        task_queue=task_queue,
+        middlewares=(ExceptionLogging(),),
+        replaces_stuck_threads=True,
+        task_metrics=task_metrics,
+    )
+    worker._watchdog_interval = 0.05
+    stuck_task_is_released = threading.Event()
+    next_task_is_done = threading.Event()
+
+    worker.run()
+
+    try:
+        stuck_task = task_queue.put(
+            stuck_task_is_released.wait,
+            args=(10,),
+            options={TaskOptions.DEADLINE: datetime.timedelta(seconds=0.1)},
+        )
+        task_queue.put(next_task_is_done.set)
+
+        assert next_task_is_done.wait(5)
+        assert task_metrics.get_stuck_tasks() == {(stuck_task.target_name, stuck_task.priority): 1}
+        assert len(worker._threads) == 2
+    finally:
+        stuck_task_is_released.set()
+        worker.stop()
+
+    assert len(worker._threads) == 1
+
+
+def test_replacements_of_stuck_threads_are_limited():
+    task_queue = MemTaskQueue()
+    worker = ThreadWorker(
+        task_queue=task_queue,
+        middlewares=(ExceptionLogging(),),
+        replaces_stuck_threads=True,
+        max_replacements=1,
+    )
+    worker._watchdog_interval = 0.05
+    stuck_tasks_are_released = threading.Event()
+    started_tasks = threading.Semaphore(0)
+
+    def _stuck_task() -> None:
+        started_tasks.release()
+        stuck_tasks_are_released.wait(10)
+
+    worker.run()
+
+    try:
+        for _ in range(3):
+            task_queue.put(_stuck_task, options={TaskOptions.DEADLINE: datetime.timedelta(seconds=0.1)})
+
+        assert started_tasks.acquire(timeout=5)
+        assert started_tasks.acquire(timeout=5)
+        assert not started_tasks.acquire(timeout=0.5)
+        assert len(worker._threads) == 2
+    finally:
+        stuck_tasks_are_released.set()
+        worker.stop()
+
+
+def test_autoscaling():
+    task_queue = MemTaskQueue()
+    closed_threads = []
+    worker = ThreadWorker(
+        task_queue=task_queue,
+        middlewares=(ExceptionLogging(),),
+        on_close=lambda: closed_threads.append(threading.get_ident()),
+        count=1,
+        max_count=3,
+        idle_timeout=datetime.timedelta(seconds=0.2),
+        scaling_waiting_time=datetime.timedelta(seconds=0.05),
+        scaling_down_waiting_time=datetime.timedelta(seconds=0.01),
+    )
+    worker._watchdog_interval = 0.05
+    tasks_are_released = threading.Event()
+    started_tasks = threading.Semaphore(0)
+
+    def _task() -> None:
+        started_tasks.release()
+        tasks_are_released.wait(10)
+
+    worker.run()
+
+    try:
+        for _ in range(4):
+            task_queue.put(_task)
+
+        for _ in range(3):
+            assert started_tasks.acquire(timeout=5)
+
+        assert len(worker._threads) == 3
+
+        tasks_are_released.set()
+        deadline = time.monotonic() + 5
+
+        while (len(worker._threads) > 1 or len(task_queue)) and time.monotonic() < deadline:
+            time.sleep(0.05)
+
+        assert len(worker._threads) == 1
+        assert len(closed_threads) == 2
+    finally:
+        tasks_are_released.set()
+        worker.stop()
+
+
+def test_autoscaling_by_depth():
+    task_queue = MemTaskQueue()
+    closed_threads = []
+    worker = ThreadWorker(
+        task_queue=task_queue,
+        middlewares=(ExceptionLogging(),),
+        on_close=lambda: closed_threads.append(threading.get_ident()),
+        count=1,
+        max_count=3,
+        idle_timeout=datetime.timedelta(seconds=0.2),
+        scaling_waiting_time=datetime.timedelta(seconds=10),
+        scaling_depth=0.5,
+        scaling_down_depth=0,
+    )
+    worker._watchdog_interval = 0.05
+    tasks_are_released = threading.Event()
+    started_tasks = threading.Semaphore(0)
+
+    def _task() -> None:
+        started_tasks.release()
+        tasks_are_released.wait(10)
+
+    worker.run()
+
+    try:
+        for _ in range(4):
+            task_queue.put(_task)
+
+        for _ in range(3):
+            assert started_tasks.acquire(timeout=5)
+
+        assert len(worker._threads) == 3
+
+        tasks_are_released.set()
+        deadline = time.monotonic() + 5
+
+        while (len(worker._threads) > 1 or len(task_queue)) and time.monotonic() < deadline:
+            time.sleep(0.05)
+
+        assert len(worker._threads) == 1
+        assert len(closed_threads) == 2
+    finally:
+        tasks_are_released.set()
+        worker.stop()
+
+
+def test_futures():
+    task_queue = MemTaskQueue()
+    worker = ThreadWorker(
+        task_queue=task_queue,
+        middlewares=(
+            ExceptionLogging(),
+            SupportOfRetries(),
+        ),
+    )
+    attempts = []
+
+    def _repeated_task() -> int:
+        attempts.append(None)
+
+        if len(attempts) < 2:
+            raise RepeatTask()
+
+        return len(attempts)
+
+    async def _wait(task) -> int:
+        return await asyncio.wrap_future(task.future)
+
+    repeated_task = task_queue.put(_repeated_task)
+    failed_task = task_queue.put(int, args=('x',))
+    canceled_task = task_queue.put(print, run_after=datetime.datetime.now() + datetime.timedelta(hours=1))
+
+    canceled_task.future.cancel()
+
+    assert canceled_task.status == TaskStatuses.CANCELED
+    assert len(task_queue) == 2
+
+    worker.run()
+
+    try:
+        assert failed_task.future.exception(timeout=5).__class__ is ValueError
+        assert asyncio.run(asyncio.wait_for(_wait(repeated_task), timeout=5)) == 2
+        assert task_queue.put(max, args=(1, 2)).future.result(timeout=5) == 2
+    finally:
+        worker.stop()
@@ -7,3 +7,8 @@ INITED_AT = 'inited_at'
 
 class NOTHING:
     pass
+
+
+class RateLimitKeys:
+    MESSENGER = 'messenger'
+    FILE_STORAGE = 'file_storage'
@@ -1,3 +1,4 @@
+import datetime
 import io
 import os
 import tempfile
@@ -5,10 +6,12 @@ import tempfile
 import cv2
 import dropbox
 import numpy as np
+from dropbox.files import CommitInfo, UploadSessionCursor, UploadSessionFinishArg
 from pandas import DataFrame
 
 from libs.casual_utils.parallel_computing import single_synchronized
 from libs.casual_utils.time import get_current_time
+from libs.task_queue import batchable
 from ... import config
 
 
@@ -18,10 +21,12 @@ class FileStorage:
     def __init__(self) -> None:
         self._dbx = dropbox.Dropbox(config.DROPBOX_TOKEN, timeout=10)
 
+    def __reduce__(self) -> str:
+        # Methods of `file_storage` are pickled by reference for tasks running in a process pool.
+        return 'file_storage'
+
     def upload(self, file_name: str, content: bytes) -> None:
-        now = get_current_time()
-        file_name = os.path.join('/', now.strftime('%Y-%m-%d'), file_name)
-        self._dbx.files_upload(content, file_name)
+        self._dbx.files_upload(content, self._get_path(file_name))
 
     def upload_df_as_csv(self, file_name: str, data_frame: DataFrame) -> None:
         io_buffer = io.StringIO()
@@ -30,37 +35,43 @@ class FileStorage:
         self.upload(file_name=file_name, content=io_buffer.read().encode())
 
     def upload_frame(self, file_name: str, frame: np.ndarray) -> None:
-        is_success, buffer = cv2.imencode('.jpg', frame)
-        io_buf = io.BytesIO(buffer)
-        self.upload(file_name=file_name, content=io_buf.read())
+        self.upload(file_name=file_name, content=self._encode_frame(frame))
+
+    @batchable(max_size=20, max_wait=datetime.timedelta(seconds=2))
+    def upload_frames(self, frames: list[tuple[str, np.ndarray]]) -> None:
+        """
+        Uploads `(file_name, frame)` pairs with one commit of upload sessions.
+        """
+
+        entries = []
+
+        for file_name, frame in frames:
+            content = self._encode_frame(frame)
+            session = self._dbx.files_upload_session_start(content, close=True)
+            entries.append(
+                UploadSessionFinishArg(
+                    cursor=UploadSessionCursor(session_id=session.session_id, offset=len(content)),
+                    commit=CommitInfo(path=self._get_path(file_name)),
+                )
+            )
+
+        self._dbx.files_upload_session_finish_batch_v2(entries)
 
-    def upload_frames_as_video(self, file_name: str, frames: np.ndarray, fps: int) -> None:
+    def upload_frames_as_video(self, file_name: str, frames: list[np.ndarray], fps: int) -> None:
         if not frames:
             return
 
-        height, width, layers = frames[0].shape
-        size = (
-            width,
-            height,
-        )
-
-        with tempfile.TemporaryDirectory() as temp_dir:
-            filename = os.path.join(temp_dir, 'video.avi')
-
-            video_writer = cv2.VideoWriter(
-                filename=filename,
-                fourcc=cv2.VideoWriter_fourcc(*'DIVX'),
-                fps=fps,
-                frameSize=size,
-            )
-
-            for frame in frames:
-                video_writer.write(frame)
+        self.upload(file_name=file_name, content=encode_frames_as_video(frames, fps=fps))
 
-            video_writer.release()
+    @staticmethod
+    def _get_path(file_name: str) -> str:
+        now = get_current_time()
+        return os.path.join('/', now.strftime('%Y-%m-%d'), file_name)
 
-            with open(filename, 'rb') as file:
-                self.upload(file_name=file_name, content=file.read())
+    @staticmethod
+    def _encode_frame(frame: np.ndarray) -> bytes:
+        is_success, buffer = cv2.imencode('.jpg', frame)
+        return io.BytesIO(buffer).read()
 
     @single_synchronized
     def remove_old_folders(self):
@@ -88,4 +99,30 @@ class FileStorage:
             self._dbx.files_delete_v2(entry.path_display)
 
 
+def encode_frames_as_video(frames: list[np.ndarray], *, fps: int) -> bytes:
+    height, width, layers = frames[0].shape
+    size = (
+        width,
+        height,
+    )
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        filename = os.path.join(temp_dir, 'video.avi')
+
+        video_writer = cv2.VideoWriter(
+            filename=filename,
+            fourcc=cv2.VideoWriter_fourcc(*'DIVX'),
+            fps=fps,
+            frameSize=size,
+        )
+
+        for frame in frames:
+            video_writer.write(frame)
+
+        video_writer.release()
+
+        with open(filename, 'rb') as file:
+            return file.read()
+
+
 file_storage = FileStorage()
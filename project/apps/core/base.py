@@ -7,7 +7,7 @@ from dataclasses import dataclass, field
 from libs.casual_utils.caching import memoized_method
 from libs.smart_devices.base import BaseSmartDevice
 from libs.messengers.base import BaseMessenger
-from libs.task_queue import BaseTaskQueue
+from libs.task_queue import BaseTaskQueue, OwnedTaskQueue, TaskMetrics, TaskProfiles
 from libs.task_queue.dto import RepeatableTask, ScheduledTask
 from libs.zigbee.base import ZigBee
 from . import constants, events
@@ -22,6 +22,8 @@ class ModuleContext:
     messenger: BaseMessenger
     state: State
     task_queue: BaseTaskQueue
+    task_metrics: TaskMetrics
+    task_profiles: TaskProfiles
     zig_bee: ZigBee
     smart_devices_map: dict[str, BaseSmartDevice]
 
@@ -41,7 +43,8 @@ class BaseModule(abc.ABC):
         self.context = context
         self.messenger = self.context.messenger
         self.state = self.context.state
-        self.task_queue = self.context.task_queue
+        self.task_queue = OwnedTaskQueue(self.context.task_queue, owner=self.__class__.__name__)
+        self.context.task_queue.register_instance(self.__class__.__name__, self)
 
         self.state.create_many(**self.initial_state)
         self._subscribers_to_events = self.subscribe_to_events()
@@ -1,3 +1,4 @@
+import datetime
 import logging
 import queue
 import typing
@@ -7,16 +8,39 @@ from telegram.error import NetworkError
 from libs.casual_utils.logging import log_performance
 from libs.smart_devices.base import BaseSmartDevice
 from libs.messengers.base import BaseMessenger
-from libs.task_queue import BaseTaskQueue, BaseWorker, MemTaskQueue, ThreadWorker
-from libs.task_queue.middlewares import ConcreteRetries, ExceptionLogging, SupportOfRetries
+from libs.task_queue import (
+    BaseWorker,
+    Capacity,
+    Lane,
+    ProcessPoolWorker,
+    Rate,
+    SQLTaskQueue,
+    TaskMetrics,
+    TaskPriorities,
+    TaskProfiles,
+)
+from libs.task_queue.middlewares import (
+    CollectingMetrics,
+    ConcreteRetries,
+    ExceptionLogging,
+    Profiling,
+    RateLimit,
+    SupportOfRetries,
+)
 from libs.zigbee.base import ZigBee
 from . import events, events as core_events
 from .base import BaseModule, ModuleContext
 from .events import new_message
 from ..common.base import BaseReceiver
+from ..common.constants import RateLimitKeys
 from ..common.exceptions import Shutdown
 from ..common.state import State
-from ..db import close_db_session
+from ..db import close_db_session, db_engine
+from ... import config
+
+
+# Bytes of a BGR frame of the camera, it's the weight of frames held by pending tasks.
+FRAME_BYTES = config.IMAGE_RESOLUTION[0] * config.IMAGE_RESOLUTION[1] * 3
 
 
 class Commander:
@@ -24,7 +48,9 @@ class Commander:
     state: State
     command_handlers: tuple[BaseModule, ...]
     message_queue: queue.Queue
-    task_queue: BaseTaskQueue
+    task_queue: SQLTaskQueue
+    task_metrics: TaskMetrics
+    task_profiles: TaskProfiles
     task_worker: BaseWorker
     zig_bee: ZigBee
     _receivers: tuple[BaseReceiver, ...]
@@ -38,10 +64,29 @@ class Commander:
         smart_devices: tuple[BaseSmartDevice, ...],
     ) -> None:
         self.message_queue = queue.Queue()
-        self.task_queue = MemTaskQueue()
-        self.task_worker = ThreadWorker(
+        self.task_metrics = TaskMetrics()
+        self.task_profiles = TaskProfiles()
+        self.task_queue = SQLTaskQueue(
+            engine=db_engine,
+            capacities={
+                # Photos and videos sent by the messenger.
+                TaskPriorities.HIGH: Capacity(max_bytes=FRAME_BYTES * config.FPS * 3),
+                # Recorded videos.
+                TaskPriorities.MEDIUM: Capacity(max_bytes=FRAME_BYTES * config.FPS * 2),
+                # Photos and videos uploaded to the file storage, they are shed first.
+                TaskPriorities.LOW: Capacity(max_bytes=FRAME_BYTES * config.FPS * 5),
+            },
+            aging={
+                TaskPriorities.MEDIUM: datetime.timedelta(minutes=1),
+                TaskPriorities.LOW: datetime.timedelta(minutes=2),
+            },
+            task_metrics=self.task_metrics,
+        )
+        self.task_worker = ProcessPoolWorker(
             task_queue=self.task_queue,
             middlewares=(
+                CollectingMetrics(metrics=self.task_metrics),
+                Profiling(profiles=self.task_profiles),
                 ExceptionLogging(),
                 ConcreteRetries(
                     exceptions=(
@@ -50,8 +95,32 @@ class Commander:
                     )
                 ),
                 SupportOfRetries(),
+                RateLimit(
+                    rates={
+                        RateLimitKeys.MESSENGER: Rate(per_second=1, burst=3),
+                        RateLimitKeys.FILE_STORAGE: Rate(per_second=2, burst=4),
+                    },
+                ),
+            ),
+            lanes=(
+                Lane(
+                    priorities=(TaskPriorities.HIGH,),
+                    max_count=2,
+                ),
+                Lane(
+                    priorities=(
+                        TaskPriorities.MEDIUM,
+                        TaskPriorities.LOW,
+                    ),
+                    borrowed_priorities=(TaskPriorities.HIGH,),
+                    count=1,
+                    max_count=4,
+                ),
             ),
-            count=2,
+            processes=1,
+            default_deadline=datetime.timedelta(minutes=1),
+            replaces_stuck_threads=True,
+            task_metrics=self.task_metrics,
             on_close=close_db_session,
         )
         self.messenger = messenger
@@ -70,6 +139,8 @@ class Commander:
             messenger=self.messenger,
             state=self.state,
             task_queue=self.task_queue,
+            task_metrics=self.task_metrics,
+            task_profiles=self.task_profiles,
             zig_bee=self.zig_bee,
             smart_devices_map=smart_devices_map,
         )
@@ -80,6 +151,7 @@ class Commander:
 
     def run(self) -> None:
         self.zig_bee.open()
+        self.task_queue.restore()
         self.task_worker.run()
 
         logging.info('Commander is started.')
@@ -123,6 +195,7 @@ class Commander:
 
         logging.info('[shutdown] Closing task queue...')
         self.task_worker.stop()
+        self.task_queue.close()
 
         logging.info('[shutdown] Sending "shutdown" signal...')
         core_events.shutdown.send()
@@ -43,6 +43,8 @@ class BotCommands:
     HELP = '/help'
     WIFI_DEVICES = '/wifi_devices'
     COMPRESS_DB = '/compress_db'
+    TASKS_STATS = '/tasks_stats'
+    TASKS_PROFILES = '/tasks_profiles'
     DB_STATS = '/db_stats'
     RETURN = '/return'
     TIMER = '/timer'
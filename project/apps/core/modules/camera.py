@@ -14,7 +14,7 @@ from libs.task_queue import IntervalTask
 from ..base import BaseModule
 from ..constants import BotCommands, MotionTypeSources
 from ...common import interface
-from ...common.constants import OFF, ON
+from ...common.constants import OFF, ON, RateLimitKeys
 from ...common.exceptions import Shutdown
 from ...common.storage import file_storage
 from ...common.utils import (
@@ -67,6 +67,8 @@ class Camera(BaseModule):
                 priority=task_queue.TaskPriorities.MEDIUM,
                 interval=datetime.timedelta(seconds=10),
                 run_immediately=False,
+                fixed_rate=True,
+                jitter=datetime.timedelta(seconds=10),
             ),
             IntervalTask(
                 target=self._check_video_stream,
@@ -82,6 +84,8 @@ class Camera(BaseModule):
                 target=self.check,
                 priority=task_queue.TaskPriorities.MEDIUM,
                 interval=datetime.timedelta(seconds=10),
+                fixed_rate=True,
+                jitter=datetime.timedelta(seconds=10),
             ),
         )
 
@@ -234,12 +238,10 @@ class Camera(BaseModule):
             caption=f'Captured at {now.strftime("%d.%m.%Y, %H:%M:%S")}',
         )
         self.task_queue.put(
-            file_storage.upload_frame,
-            kwargs={
-                'file_name': f'saved_photos/{now.strftime("%Y-%m-%d %H:%M:%S.png")}',
-                'frame': frame,
-            },
-            priority=task_queue.TaskPriorities.MEDIUM,
+            file_storage.upload_frames,
+            args=((f'saved_photos/{now.strftime("%Y-%m-%d %H:%M:%S.png")}', frame),),
+            priority=task_queue.TaskPriorities.LOW,
+            options={task_queue.TaskOptions.RATE_LIMIT_KEY: RateLimitKeys.FILE_STORAGE},
         )
 
     @interface.command(BotCommands.CAMERA, 'record', ON)
@@ -277,6 +279,7 @@ class Camera(BaseModule):
                 caption='Recorded video',
             ),
             priority=task_queue.TaskPriorities.MEDIUM,
+            options={task_queue.TaskOptions.RATE_LIMIT_KEY: RateLimitKeys.MESSENGER},
         )
 
     def _can_use_camera(self) -> bool:
@@ -352,4 +355,5 @@ class Camera(BaseModule):
             self.task_queue.put(
                 self._take_photo,
                 priority=task_queue.TaskPriorities.HIGH,
+                dedup_key='camera:take_photo',
             )
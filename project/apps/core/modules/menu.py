@@ -176,6 +176,8 @@ class AllFuncsPage(BasePage):
             [
                 KeyboardButton(constants.BotCommands.STATS),
                 KeyboardButton(constants.BotCommands.DB_STATS),
+                KeyboardButton(constants.BotCommands.TASKS_STATS),
+                KeyboardButton(constants.BotCommands.TASKS_PROFILES),
                 KeyboardButton(constants.BotCommands.COMPRESS_DB),
             ],
             [
@@ -5,7 +5,7 @@ import typing
 from crontab import CronTab
 
 from libs.casual_utils.time import get_current_time
-from libs.messengers.utils import ProgressBar
+from libs.messengers.utils import ProgressBar, split_code_block
 from libs.task_queue import IntervalTask, ScheduledTask, TaskPriorities
 from .. import constants, events
 from ..base import BaseModule
@@ -25,6 +25,8 @@ __all__ = ('Signals',)
 )
 class Signals(BaseModule):
     _timedelta_for_ping: datetime.timedelta = datetime.timedelta(seconds=30)
+    _limit_for_tasks_stats: int = 15
+    _limit_for_tasks_profiles: int = 3
     _supreme_signal_handler: SupremeSignalHandler
 
     def __init__(self, *args, **kwargs) -> None:
@@ -46,6 +48,12 @@ class Signals(BaseModule):
 
     def init_repeatable_tasks(self) -> tuple:
         return (
+            IntervalTask(
+                target=Signal.flush_expired,
+                priority=TaskPriorities.LOW,
+                interval=datetime.timedelta(seconds=10),
+                run_immediately=False,
+            ),
             IntervalTask(
                 target=lambda: tuple(self._compress_db()),
                 priority=TaskPriorities.LOW,
@@ -68,6 +76,11 @@ class Signals(BaseModule):
                 priority=TaskPriorities.LOW,
                 crontab=CronTab('0 5 * * *'),
             ),
+            ScheduledTask(
+                target=Signal.create_partitions,
+                priority=TaskPriorities.LOW,
+                crontab=CronTab('0 3 * * *'),
+            ),
             *self._supreme_signal_handler.get_tasks(),
         )
 
@@ -75,6 +88,7 @@ class Signals(BaseModule):
         return (
             *super().subscribe_to_events(),
             events.request_for_statistics.connect(self._create_task_queue_stats),
+            events.shutdown.connect(Signal.flush),
             *self._supreme_signal_handler.get_signals(),
         )
 
@@ -86,6 +100,31 @@ class Signals(BaseModule):
 
             self.messenger.send_message('Compressing of DB is finished')
 
+    @interface.command(constants.BotCommands.TASKS_STATS)
+    def _send_tasks_stats(self) -> None:
+        tasks_stats = self.context.task_metrics.to_str(
+            limit=self._limit_for_tasks_stats,
+            owner_depths=self.task_queue.get_owner_depths(),
+        )
+
+        if not tasks_stats:
+            self.messenger.send_message('There is still little data')
+            return
+
+        for message in split_code_block(tasks_stats, title='*Tasks stats*'):
+            self.messenger.send_message(message, use_markdown=True)
+
+    @interface.command(constants.BotCommands.TASKS_PROFILES)
+    def _send_tasks_profiles(self) -> None:
+        tasks_profiles = self.context.task_profiles.to_str(limit=self._limit_for_tasks_profiles)
+
+        if not tasks_profiles:
+            self.messenger.send_message('There are no slow tasks yet')
+            return
+
+        for message in split_code_block(tasks_profiles, title='*Tasks profiles*'):
+            self.messenger.send_message(message, use_markdown=True)
+
     def _ping_task_queue(self, *, sent_at: datetime.datetime) -> None:
         now = datetime.datetime.now()
         diff = datetime.datetime.now() - sent_at - self._timedelta_for_ping
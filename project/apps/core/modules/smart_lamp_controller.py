@@ -6,7 +6,7 @@ from functools import partial
 
 from libs.casual_utils.parallel_computing import synchronized_method
 from libs.casual_utils.time import get_current_time
-from libs.task_queue import ScheduledTask, TaskPriorities
+from libs.task_queue import ScheduledTask, TaskOptions, TaskPriorities
 from libs.zigbee.exceptions import ZigBeeTimeoutError
 from libs.zigbee.lamps.life_control import LCSmartLamp
 from project import config
@@ -46,6 +46,7 @@ class LampControllerInBedroom(BaseModule):
     _last_manual_action: typing.Optional[datetime.datetime] = None
     _last_artificial_sunrise_time: typing.Optional[datetime.datetime] = None
     _default_transition: float = 0.5
+    _set_lamp_status_key: str = 'lamp:set_lamp_status'
 
     def __init__(self, *args, **kwargs) -> None:
         super().__init__(*args, **kwargs)
@@ -57,6 +58,7 @@ class LampControllerInBedroom(BaseModule):
             self._set_lamp_status,
             run_after=datetime.datetime.now() + datetime.timedelta(seconds=5),
             priority=TaskPriorities.LOW,
+            dedup_key=self._set_lamp_status_key,
         )
 
     @property
@@ -142,6 +144,7 @@ class LampControllerInBedroom(BaseModule):
                     partial(self._set_lamp_status, attempt=attempt + 1),
                     run_after=datetime.datetime.now() + datetime.timedelta(seconds=10),
                     priority=TaskPriorities.LOW,
+                    dedup_key=self._set_lamp_status_key,
                 )
 
             return
@@ -154,6 +157,7 @@ class LampControllerInBedroom(BaseModule):
                     partial(self._set_lamp_status),
                     run_after=datetime.datetime.now() + datetime.timedelta(seconds=3),
                     priority=TaskPriorities.LOW,
+                    dedup_key=self._set_lamp_status_key,
                 )
 
                 return
@@ -163,7 +167,12 @@ class LampControllerInBedroom(BaseModule):
             pass
 
     @synchronized_method
-    def _run_artificial_sunrise(self, *, step: int = 1) -> None:
+    def _run_artificial_sunrise(self, *, step: int = 1, started_at: typing.Optional[datetime.datetime] = None) -> None:
+        """
+        Steps are durable tasks, so the sunrise goes on after a restart.
+        They get `started_at` of the sunrise, because the module doesn't remember it after a restart.
+        """
+
         delay_between_steps = datetime.timedelta(seconds=10)
         sunrise_time = datetime.timedelta(hours=1)
         total_steps = int(sunrise_time.total_seconds() / delay_between_steps.total_seconds())
@@ -172,9 +181,10 @@ class LampControllerInBedroom(BaseModule):
         def _run_next_step() -> None:
             self.task_queue.put(
                 self._run_artificial_sunrise,
-                kwargs={'step': step + 1},
+                kwargs={'step': step + 1, 'started_at': started_at},
                 run_after=datetime.datetime.now() + delay_between_steps,
                 priority=TaskPriorities.LOW,
+                options={TaskOptions.DURABLE: True},
             )
 
         brightness = self._calculate_brightness(step=step, max_brightness=max_brightness, total_steps=total_steps)
@@ -194,13 +204,15 @@ class LampControllerInBedroom(BaseModule):
             self.smart_lamp.set_color_temp('warm')
             self.state[constants.MAIN_LAMP_IS_ON] = True
 
-            self._last_artificial_sunrise_time = get_current_time()
+            started_at = self._last_artificial_sunrise_time = get_current_time()
             _run_next_step()
             return
 
-        if not self._can_continue_artificial_sunrise():
+        if not self._can_continue_artificial_sunrise(started_at):
             return
 
+        assert started_at is not None
+
         prev_brightness = self._calculate_brightness(
             step=step - 1,
             max_brightness=max_brightness,
@@ -211,11 +223,9 @@ class LampControllerInBedroom(BaseModule):
             self.smart_lamp.set_brightness(brightness, transition=1)
 
         if step >= total_steps:
-            assert self._last_artificial_sunrise_time is not None
-
             delta_to_wait_sunrise = get_sunrise_time() - get_current_time()
             delta_to_wait_one_hour_after_finishing = (
-                self._last_artificial_sunrise_time
+                started_at
                 + sunrise_time
                 + datetime.timedelta(hours=1)
                 - get_current_time()
@@ -227,8 +237,10 @@ class LampControllerInBedroom(BaseModule):
 
             self.task_queue.put(
                 self._turn_down_lamp_artificial_sunrise,
+                kwargs={'started_at': started_at},
                 run_after=datetime.datetime.now() + diff,
                 priority=TaskPriorities.LOW,
+                options={TaskOptions.DURABLE: True},
             )
         else:
             _run_next_step()
@@ -250,15 +262,23 @@ class LampControllerInBedroom(BaseModule):
         return max(0, min(int(brightness), max_brightness))
 
     @synchronized_method
-    def _turn_down_lamp_artificial_sunrise(self) -> None:
-        if not self._can_continue_artificial_sunrise():
+    def _turn_down_lamp_artificial_sunrise(self, *, started_at: datetime.datetime) -> None:
+        if not self._can_continue_artificial_sunrise(started_at):
             return
 
         self.smart_lamp.turn_off(transition=1)
         self.state[constants.MAIN_LAMP_IS_ON] = False
 
     @synchronized_method
-    def _can_continue_artificial_sunrise(self) -> bool:
-        return self._last_artificial_sunrise_time is not None and (
-            self._last_manual_action is None or self._last_manual_action < self._last_artificial_sunrise_time
-        )
+    def _can_continue_artificial_sunrise(self, started_at: typing.Optional[datetime.datetime]) -> bool:
+        """
+        A sunrise is stopped by a manual action or by a newer sunrise.
+        """
+
+        if started_at is None:
+            return False
+
+        if self._last_artificial_sunrise_time is not None and self._last_artificial_sunrise_time > started_at:
+            return False
+
+        return self._last_manual_action is None or self._last_manual_action < started_at
@@ -1,7 +1,8 @@
 import datetime
+from functools import partial
 
 from libs.messengers.utils import escape_markdown
-from libs.task_queue import TaskPriorities
+from libs.task_queue import TaskOptions, TaskPriorities
 from ..base import BaseModule, Command
 from ..constants import (
     BotCommands,
@@ -34,18 +35,20 @@ class Utils(BaseModule):
         run_after = datetime.datetime.now() + delta
 
         self.task_queue.put(
-            lambda: (
-                self.messenger.send_message(
-                    f'Run scheduled command `{escape_markdown(str(command_for_run))}`',
-                    use_markdown=True,
-                ),
-                self._run_command(command_for_run.name, *command_for_run.args),
-            ),
+            partial(self._run_scheduled_command, command_for_run),
             run_after=run_after,
             priority=TaskPriorities.LOW,
+            options={TaskOptions.DURABLE: True},
         )
 
         self.messenger.send_message(
             f'`{escape_markdown(str(command_for_run))}` is sent\\.\nIt will be run at `{run_after}`\\.',
             use_markdown=True,
         )
+
+    def _run_scheduled_command(self, command: Command) -> None:
+        self.messenger.send_message(
+            f'Run scheduled command `{escape_markdown(str(command))}`',
+            use_markdown=True,
+        )
+        self._run_command(command.name, *command.args)
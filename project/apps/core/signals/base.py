@@ -38,6 +38,8 @@ class BaseSignalHandler(abc.ABC):
                 priority=self.priority,
                 interval=self.task_interval,
                 run_after=datetime.datetime.now() + datetime.timedelta(seconds=10),
+                fixed_rate=True,
+                jitter=self.task_interval,
             ),
         )
 
@@ -0,0 +1,68 @@
+from unittest.mock import Mock
+
+from sqlalchemy import create_engine
+from sqlalchemy.pool import StaticPool
+
+from libs.task_queue import SQLTaskQueue, TaskMetrics, TaskProfiles, TaskStatuses
+from ..base import ModuleContext
+from ..modules import constants
+from ..modules.smart_lamp_controller import LampControllerInBedroom
+from ...common.state import State
+from .... import config
+
+
+def _create_module(task_queue: SQLTaskQueue) -> tuple[LampControllerInBedroom, Mock]:
+    smart_lamp = Mock(MAX_BRIGHTNESS=255)
+    smart_lamp.is_on.return_value = False
+    state = State({constants.USER_IS_CONNECTED_TO_ROUTER: True})
+    module = LampControllerInBedroom(
+        context=ModuleContext(
+            messenger=Mock(),
+            state=state,
+            task_queue=task_queue,
+            task_metrics=TaskMetrics(),
+            task_profiles=TaskProfiles(),
+            zig_bee=Mock(),
+            smart_devices_map={config.SMART_DEVICE_NAMES.MAIN_SMART_LAMP: smart_lamp},
+        ),
+    )
+
+    return module, smart_lamp
+
+
+def _get_sunrise_steps(task_queue: SQLTaskQueue) -> list:
+    return [
+        task
+        for task in task_queue._tasks.entry_map
+        if 'step' in task.kwargs and task.status == TaskStatuses.PENDING
+    ]
+
+
+def test_artificial_sunrise_is_resumed_after_restart():
+    engine = create_engine('sqlite://', poolclass=StaticPool, connect_args={'check_same_thread': False})
+    task_queue = SQLTaskQueue(engine=engine)
+    module, smart_lamp = _create_module(task_queue)
+
+    module._run_artificial_sunrise()
+    task_queue.close()
+
+    assert smart_lamp.turn_on.called
+
+    task_queue = SQLTaskQueue(engine=engine)
+    module, smart_lamp = _create_module(task_queue)
+
+    assert task_queue.restore() == 1
+
+    (step,) = _get_sunrise_steps(task_queue)
+    step.run()
+
+    (next_step,) = _get_sunrise_steps(task_queue)
+
+    assert next_step.kwargs == {'step': 3, 'started_at': step.kwargs['started_at']}
+
+    # A manual action stops the sunrise.
+    module._last_manual_action = step.kwargs['started_at'].replace(year=2100)
+    next_step.run()
+
+    assert not _get_sunrise_steps(task_queue)
+    task_queue.close()
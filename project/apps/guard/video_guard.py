@@ -1,12 +1,15 @@
 import datetime
 import typing
+from concurrent.futures import Future
+from functools import partial
 
 import numpy as np
 
 from libs import task_queue as tq
 from libs.image_processing.motion_detector import MotionDetector
 from libs.messengers.base import BaseMessenger
-from ..common.storage import file_storage
+from ..common.constants import RateLimitKeys
+from ..common.storage import encode_frames_as_video, file_storage
 from ... import config
 
 
@@ -120,40 +123,80 @@ class VideoGuard:
             args=(frame,),
             kwargs={'caption': caption},
             priority=tq.TaskPriorities.HIGH,
+            options={tq.TaskOptions.RATE_LIMIT_KEY: RateLimitKeys.MESSENGER},
         )
 
     def _send_video_to_messenger(self, frames: typing.List[np.ndarray], caption: str) -> None:
         self.task_queue.put(
             self.messenger.send_frames_as_video,
-            args=(frames,),
             kwargs={
+                'frames': frames,
                 'fps': config.FPS,
                 'caption': caption,
             },
             priority=tq.TaskPriorities.HIGH,
+            options={
+                tq.TaskOptions.DEGRADE: reduce_frames,
+                tq.TaskOptions.RATE_LIMIT_KEY: RateLimitKeys.MESSENGER,
+            },
         )
 
     def _save_image(self, frame: np.ndarray) -> None:
         now = datetime.datetime.now()
 
         self.task_queue.put(
-            file_storage.upload_frame,
-            kwargs={
-                'file_name': f'marked_images/{now.strftime("%Y-%m-%d %H:%M:%S.png")}',
-                'frame': frame,
-            },
-            priority=tq.TaskPriorities.MEDIUM,
+            file_storage.upload_frames,
+            args=((f'marked_images/{now.strftime("%Y-%m-%d %H:%M:%S.png")}', frame),),
+            priority=tq.TaskPriorities.LOW,
+            options={tq.TaskOptions.RATE_LIMIT_KEY: RateLimitKeys.FILE_STORAGE},
         )
 
     def _save_video(self, frames: list[np.ndarray]) -> None:
+        if not frames:
+            return
+
         now = datetime.datetime.now()
 
-        self.task_queue.put(
-            file_storage.upload_frames_as_video,
+        # The video is encoded in the process pool and uploaded by a thread, so the upload doesn't hold a process.
+        encoding_task = self.task_queue.put(
+            encode_frames_as_video,
             kwargs={
-                'file_name': f'videos/{now.strftime("%Y-%m-%d %H:%M:%S.avi")}',
                 'frames': frames,
                 'fps': config.FPS,
             },
-            priority=tq.TaskPriorities.MEDIUM,
+            priority=tq.TaskPriorities.LOW,
+            options={
+                tq.TaskOptions.USE_PROCESS_POOL: True,
+                tq.TaskOptions.DEGRADE: reduce_frames,
+                tq.TaskOptions.DEADLINE: datetime.timedelta(minutes=10),
+            },
+        )
+        encoding_task.future.add_done_callback(
+            partial(self._upload_video, file_name=f'videos/{now.strftime("%Y-%m-%d %H:%M:%S.avi")}'),
+        )
+
+    def _upload_video(self, future: Future, *, file_name: str) -> None:
+        if future.cancelled() or future.exception() is not None:
+            return
+
+        self.task_queue.put(
+            file_storage.upload,
+            kwargs={
+                'file_name': file_name,
+                'content': future.result(),
+            },
+            priority=tq.TaskPriorities.LOW,
+            options={
+                tq.TaskOptions.RATE_LIMIT_KEY: RateLimitKeys.FILE_STORAGE,
+                tq.TaskOptions.DEADLINE: datetime.timedelta(minutes=10),
+            },
         )
+
+
+def reduce_frames(task: tq.Task) -> None:
+    """
+    Halves frames of a video task when the task queue is full. FPS is halved too to keep the duration of the video.
+    """
+
+    task.kwargs['frames'] = task.kwargs['frames'][::2]
+    task.kwargs['fps'] = max(task.kwargs['fps'] // 2, 1)
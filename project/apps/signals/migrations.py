@@ -0,0 +1,56 @@
+import logging
+
+from sqlalchemy import text
+
+from . import partitions
+from .rollups import ROLLUPS
+from .. import db
+
+
+__all__ = ('migrate',)
+
+
+# Statements are idempotent, so they are run on every start after creating tables.
+MIGRATIONS = (
+    # Signals are read by a type in a range of time.
+    'CREATE INDEX IF NOT EXISTS ix_signals_type_received_at ON signals (type, received_at)',
+    # It's a prefix of the composite index.
+    'DROP INDEX IF EXISTS ix_signals_type',
+)
+
+
+# Buckets of rollups are aligned by UTC like `floor_time`.
+ROLLUP_BUCKETS = {
+    'signal_rollups_1m': 'date_trunc(\'minute\', received_at)',
+    'signal_rollups_1h': 'date_trunc(\'hour\', received_at AT TIME ZONE \'UTC\') AT TIME ZONE \'UTC\'',
+}
+
+
+def migrate() -> None:
+    with db.db_engine.begin() as connection:
+        for migration in MIGRATIONS:
+            logging.debug('Migration: %s', migration)
+            connection.execute(text(migration))
+
+        # Old data is dropped by partitions (see `Signal.clear`).
+        if connection.dialect.name == 'postgresql':
+            if not partitions.is_partitioned(connection):
+                partitions.partition_table(connection)
+
+            partitions.create_partitions(connection)
+
+            # Rollups are filled from signals that were added before them.
+            for rollup in ROLLUPS:
+                table_name = rollup.__tablename__  # type: ignore
+
+                if connection.execute(text(f'SELECT 1 FROM {table_name} LIMIT 1')).first():
+                    continue
+
+                logging.info('Filling of %s...', table_name)
+                connection.execute(
+                    text(
+                        f'INSERT INTO {table_name} (type, bucket, sum, count, min, max) '
+                        f'SELECT type, {ROLLUP_BUCKETS[table_name]}, sum(value), count(*), min(value), max(value) '
+                        f'FROM signals GROUP BY 1, 2'
+                    )
+                )
@@ -1,19 +1,154 @@
+import contextlib
 import datetime
+import logging
+import threading
 import typing
+from time import monotonic
 
+import numpy as np
 import sqlalchemy
 from pandas import DataFrame
 from sqlalchemy import ColumnElement, func as sa_func
+from sqlalchemy.dialects import postgresql
 
 from libs.casual_utils.time import get_current_time
+from . import partitions
+from .rollups import ROLLUPS, MinuteSignalRollup, get_aggregate, merge_aggregates, rebuild_rollups, select_parts
 from .. import db
 from ..common.storage import file_storage
 from ..db import get_db_session
 from ... import config
 
 
+# Signals are removed by chunks of IDs to keep statements bounded.
+COMPRESSING_CHUNK_SIZE = 10_000
+# Shorter ranges are aggregated by seconds instead of minutes.
+SECOND_AGGREGATION_RANGE = datetime.timedelta(minutes=2)
+
+
+class SignalBuffer:
+    """
+    Collects new signals to insert them by one statement
+    when there are `max_size` signals or the oldest one has waited for `max_delay`.
+    The delay is also checked by `flush_expired` that is run periodically, so signals don't wait for new ones.
+    Reads don't flush signals that they don't need (see `flush_range` and `pending_rows`), so batches are kept.
+    Signals that are not inserted because of errors are kept for the next try, but not more than `max_kept_size`.
+    """
+
+    max_size: int
+    max_delay: datetime.timedelta
+    max_kept_size: int
+    _rows: list[dict[str, typing.Any]]
+    _first_added_at: typing.Optional[float]
+    _lock: threading.Lock
+
+    def __init__(self, *, max_size: int, max_delay: datetime.timedelta, max_kept_size: int) -> None:
+        self.max_size = max_size
+        self.max_delay = max_delay
+        self.max_kept_size = max_kept_size
+        self._rows = []
+        self._first_added_at = None
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def add(self, rows: typing.Iterable[dict[str, typing.Any]]) -> None:
+        """
+        Errors of inserting are logged, because they don't concern producers of signals.
+        """
+
+        with self._lock:
+            self._rows.extend(rows)
+
+            if self._first_added_at is None:
+                self._first_added_at = monotonic()
+
+            if len(self._rows) >= self.max_size or self._is_expired():
+                try:
+                    self._flush()
+                except Exception as e:
+                    logging.exception(e)
+
+    def flush(self) -> None:
+        with self._lock:
+            self._flush()
+
+    def flush_expired(self) -> None:
+        with self._lock:
+            if self._is_expired():
+                self._flush()
+
+    def flush_range(self, signal_type: str, *, datetime_range: tuple[datetime.datetime, datetime.datetime]) -> None:
+        """
+        Inserts signals only if some of them are of the type and in the range.
+        """
+
+        with self._lock:
+            if self._select(signal_type, datetime_range=datetime_range):
+                self._flush()
+
+    @contextlib.contextmanager
+    def pending_rows(
+        self,
+        signal_type: str,
+        *,
+        datetime_range: tuple[datetime.datetime, datetime.datetime],
+    ) -> typing.Generator[list[dict[str, typing.Any]], None, None]:
+        """
+        Yields signals of the type in the range that are not inserted yet.
+        They aren't inserted till the end of the block, so the database can be read in the block
+        without missing or repeating them.
+        """
+
+        with self._lock:
+            yield self._select(signal_type, datetime_range=datetime_range)
+
+    def _select(
+        self,
+        signal_type: str,
+        *,
+        datetime_range: tuple[datetime.datetime, datetime.datetime],
+    ) -> list[dict[str, typing.Any]]:
+        return [
+            row
+            for row in self._rows
+            if row['type'] == signal_type and datetime_range[0] <= row['received_at'] <= datetime_range[1]
+        ]
+
+    def _is_expired(self) -> bool:
+        return self._first_added_at is not None and monotonic() - self._first_added_at >= self.max_delay.total_seconds()
+
+    def _flush(self) -> None:
+        if not self._rows:
+            return
+
+        rows = self._rows
+        self._rows = []
+        self._first_added_at = None
+
+        try:
+            with db.session_transaction() as session:
+                session.execute(sqlalchemy.insert(Signal), rows)
+
+                for rollup in ROLLUPS:
+                    rollup.add(session, rows)
+        except Exception:
+            # They are kept for the next try.
+            self._rows[:0] = rows
+            self._first_added_at = monotonic()
+            dropped_count = len(self._rows) - self.max_kept_size
+
+            if dropped_count > 0:
+                logging.warning('%s oldest signals are dropped, because they are not inserted', dropped_count)
+                del self._rows[:dropped_count]
+
+            raise
+
+
 class Signal(db.Base):
     __tablename__ = 'signals'
+    __table_args__ = (sqlalchemy.Index('ix_signals_type_received_at', 'type', 'received_at'),)
 
     id = sqlalchemy.Column(
         sqlalchemy.Integer,
@@ -21,7 +156,6 @@ class Signal(db.Base):
     )
     type = sqlalchemy.Column(
         sqlalchemy.Text,
-        index=True,
         nullable=False,
     )
     value = sqlalchemy.Column(
@@ -35,38 +169,68 @@ class Signal(db.Base):
     )
 
     @classmethod
-    def add(cls, signal_type: str, value: float, *, received_at: typing.Optional[datetime.datetime] = None) -> 'Signal':
+    def add(cls, signal_type: str, value: float, *, received_at: typing.Optional[datetime.datetime] = None) -> None:
         if received_at is None:
             received_at = get_current_time()
 
-        item = cls(type=signal_type, value=value, received_at=received_at)
+        signal_buffer.add(({'type': signal_type, 'value': value, 'received_at': received_at},))
 
-        with db.session_transaction() as session:
-            session.add(item)
+    @classmethod
+    def bulk_add(cls, signals: typing.Iterable['Signal']) -> None:
+        signal_buffer.add(
+            {'type': signal.type, 'value': signal.value, 'received_at': signal.received_at} for signal in signals
+        )
 
-        return item
+    @classmethod
+    def flush(cls) -> None:
+        """
+        Inserts buffered signals. Reading methods call it, so they see all added signals.
+        """
+
+        signal_buffer.flush()
 
     @classmethod
-    def bulk_add(cls, signals: typing.Iterable['Signal']) -> None:
-        with db.session_transaction() as session:
-            session.add_all(signals)
+    def flush_expired(cls) -> None:
+        """
+        Inserts buffered signals if they have waited for long enough. It's run periodically.
+        """
+
+        signal_buffer.flush_expired()
 
     @classmethod
     def clear(cls, signal_types: typing.Iterable[str]) -> None:
+        """
+        Partitioned signals are removed by dropping whole partitions older than `STORAGE_TIME` for all types,
+        because all of them are stored for the same time. Old rows of the default partition are deleted.
+        Rollups are removed by the same time.
+        """
+
+        cls.flush()
+        signal_types = tuple(signal_types)
         timestamp = get_current_time() - config.STORAGE_TIME
 
+        with db.session_transaction() as session:
+            for rollup in ROLLUPS:
+                rollup.clear(session, signal_types=signal_types, before=timestamp)
+
+        with db.db_engine.begin() as connection:
+            if partitions.is_partitioned(connection):
+                partitions.drop_partitions(connection, before=timestamp)
+                partitions.clear_default_partition(connection, before=timestamp)
+                return
+
         with db.session_transaction() as session:
             session.query(cls).filter(cls.type.in_(signal_types), cls.received_at <= timestamp).delete()
 
     @classmethod
-    def get(cls, signal_type: str, *, datetime_range: tuple[datetime.datetime, datetime.datetime]) -> list['Signal']:
-        query_data = cls._get_query_data(
-            signal_type=signal_type,
-            datetime_range=datetime_range,
-        )
+    def create_partitions(cls) -> None:
+        with db.db_engine.begin() as connection:
+            if partitions.is_partitioned(connection):
+                partitions.create_partitions(connection)
 
-        if not query_data:
-            return []
+    @classmethod
+    def get(cls, signal_type: str, *, datetime_range: tuple[datetime.datetime, datetime.datetime]) -> list['Signal']:
+        signal_buffer.flush_range(signal_type, datetime_range=datetime_range)
 
         signals: list['Signal'] = (
             db.get_db_session()
@@ -75,9 +239,8 @@ class Signal(db.Base):
                 cls.received_at.label('received_at'),
             )
             .filter(
-                cls.received_at >= query_data['start_time'],
-                cls.received_at <= query_data['end_time'],
                 cls.type == signal_type,
+                cls.received_at.between(datetime_range[0], datetime_range[1]),
                 cls.value.isnot(None),
             )
             .order_by(
@@ -96,24 +259,50 @@ class Signal(db.Base):
         aggregate_function: typing.Callable = sa_func.avg,
         datetime_range: tuple[datetime.datetime, datetime.datetime],
     ) -> typing.List['Signal']:
-        query_data = cls._get_query_data(
-            signal_type=signal_type,
-            datetime_range=datetime_range,
-        )
-
-        if not query_data:
-            return []
+        """
+        Signals are aggregated by minutes from the minute rollup and the edges of the range,
+        or by seconds from signals if the range is shorter than `SECOND_AGGREGATION_RANGE`.
+        The resolution is chosen by the range, so every series costs one query.
+        """
+
+        signal_buffer.flush_range(signal_type, datetime_range=datetime_range)
+        date_trunc = 'second' if datetime_range[1] - datetime_range[0] < SECOND_AGGREGATION_RANGE else 'minute'
+
+        if date_trunc == 'minute':
+            parts = select_parts(
+                cls,
+                signal_type,
+                datetime_range=datetime_range,
+                rollups=(MinuteSignalRollup,),
+                bucket=lambda column: sa_func.date_trunc('minute', column),
+            )
+            aggregate = get_aggregate(parts, aggregate_function(cls.value).name)
+
+            if aggregate is not None:
+                return (
+                    db.get_db_session()
+                    .query(
+                        aggregate.label('value'),
+                        parts.c.bucket.label('aggregated_time'),
+                    )
+                    .group_by(
+                        parts.c.bucket,
+                    )
+                    .order_by(
+                        parts.c.bucket,
+                    )
+                    .all()
+                )
 
         signals = (
             db.get_db_session()
             .query(
                 aggregate_function(cls.value).label('value'),
-                sa_func.date_trunc(query_data['date_trunc'], cls.received_at).label('aggregated_time'),
+                sa_func.date_trunc(date_trunc, cls.received_at).label('aggregated_time'),
             )
             .filter(
-                cls.received_at >= query_data['start_time'],
-                cls.received_at <= query_data['end_time'],
                 cls.type == signal_type,
+                cls.received_at.between(datetime_range[0], datetime_range[1]),
                 cls.value.isnot(None),
             )
             .group_by(
@@ -136,6 +325,10 @@ class Signal(db.Base):
         datetime_range: typing.Optional[tuple[datetime.datetime, datetime.datetime]] = None,
         period: datetime.timedelta = datetime.timedelta(minutes=1),
     ) -> typing.Any:
+        """
+        The last period is read often, so signals that are not inserted yet are aggregated in memory.
+        """
+
         now = get_current_time()
 
         if datetime_range is None:
@@ -144,6 +337,25 @@ class Signal(db.Base):
                 now,
             )
 
+        parts = select_parts(cls, signal_type, datetime_range=datetime_range)
+        function_name = aggregate_function(cls.value).name
+
+        if get_aggregate(parts, function_name) is not None:
+            with signal_buffer.pending_rows(signal_type, datetime_range=datetime_range) as rows:
+                part_aggregates = (
+                    db.get_db_session()
+                    .query(
+                        sa_func.sum(parts.c.sum),
+                        sa_func.sum(parts.c.count),
+                        sa_func.min(parts.c.min),
+                        sa_func.max(parts.c.max),
+                    )
+                    .one()
+                )
+
+            return merge_aggregates(function_name, tuple(part_aggregates), [row['value'] for row in rows])
+
+        signal_buffer.flush_range(signal_type, datetime_range=datetime_range)
         result = (
             db.get_db_session()
             .query(
@@ -151,8 +363,7 @@ class Signal(db.Base):
             )
             .filter(
                 cls.type == signal_type,
-                cls.received_at >= datetime_range[0],
-                cls.received_at <= datetime_range[1],
+                cls.received_at.between(datetime_range[0], datetime_range[1]),
                 cls.value.isnot(None),
             )
             .first()[0]
@@ -168,6 +379,7 @@ class Signal(db.Base):
         datetime_range: tuple[datetime.datetime, datetime.datetime],
         aggregate_function: typing.Callable = sa_func.avg,
     ) -> None:
+        cls.flush()
         session = db.get_db_session()
 
         query_data = cls._get_query_data(
@@ -214,6 +426,12 @@ class Signal(db.Base):
             ).delete()
 
             session.add_all(new_signals)
+            rebuild_rollups(
+                session,
+                cls,
+                signal_type,
+                datetime_range=(query_data['start_time'], query_data['end_time']),
+            )
 
     @classmethod
     def compress(
@@ -224,33 +442,75 @@ class Signal(db.Base):
         approximation_value: float = 0,
         approximation_time: datetime.timedelta = datetime.timedelta(hours=1),
     ) -> None:
-        signals = cls.get(signal_type, datetime_range=datetime_range)
+        """
+        Removes signals that differ from the last kept one and from the next one by at most `approximation_value`
+        and are received within `approximation_time` after the last kept one.
+        The first and the last signals of the range are kept. Rollups of the range are rebuilt from the kept ones.
+        """
 
-        if len(signals) < 2:
-            return
+        cls.flush()
 
-        received_at_to_remove = []
-        last_saved_value = signals[0]
+        rows: typing.Sequence[typing.Any] = (
+            db.get_db_session()
+            .execute(
+                sqlalchemy.select(
+                    cls.id,
+                    cls.value,
+                    sqlalchemy.extract('epoch', cls.received_at),
+                )
+                .where(
+                    cls.type == signal_type,
+                    cls.received_at.between(datetime_range[0], datetime_range[1]),
+                    cls.value.isnot(None),
+                )
+                .order_by(
+                    cls.received_at,
+                    cls.id,
+                )
+            )
+            .all()
+        )
 
-        for i, item in enumerate(signals):
-            if not (0 < i < len(signals) - 1):
-                continue
+        if len(rows) < 3:
+            return
 
-            cond_1 = signals[i].received_at - last_saved_value.received_at <= approximation_time
-            cond_2 = abs(item.value - last_saved_value.value) <= approximation_value
-            cond_3 = abs(signals[i + 1].value - item.value) <= approximation_value
+        ids, values, epochs = np.array(rows, dtype=np.float64).T
+        is_kept = get_kept_mask(
+            values,
+            epochs,
+            approximation_value=approximation_value,
+            approximation_time=approximation_time,
+        )
+        ids_to_remove = ids[~is_kept].astype(np.int64).tolist()
 
-            if cond_1 and cond_2 and cond_3:
-                received_at_to_remove.append(item.received_at)
-            else:
-                last_saved_value = signals[i]
+        if not ids_to_remove:
+            return
 
-        if received_at_to_remove:
-            with db.session_transaction() as session:
-                session.query(cls).filter(
-                    cls.type == signal_type,
-                    cls.received_at.in_(received_at_to_remove),
-                ).delete()
+        with db.session_transaction() as session:
+            is_postgresql = session.get_bind().dialect.name == 'postgresql'
+
+            for i in range(0, len(ids_to_remove), COMPRESSING_CHUNK_SIZE):
+                chunk_end = i + COMPRESSING_CHUNK_SIZE
+                chunk = ids_to_remove[i:chunk_end]
+
+                if is_postgresql:
+                    # One array parameter instead of a parameter per ID.
+                    id_filter = cls.id == sqlalchemy.any_(
+                        sqlalchemy.bindparam('ids', chunk, type_=postgresql.ARRAY(sqlalchemy.Integer)),
+                    )
+                else:
+                    id_filter = cls.id.in_(chunk)
+
+                # The range lets Postgres skip other partitions.
+                session.execute(
+                    sqlalchemy.delete(cls).where(
+                        id_filter,
+                        cls.received_at >= datetime_range[0],
+                        cls.received_at <= datetime_range[1],
+                    )
+                )
+
+            rebuild_rollups(session, cls, signal_type, datetime_range=datetime_range)
 
     @classmethod
     def aggregated_compress(
@@ -260,6 +520,7 @@ class Signal(db.Base):
         aggregate_function: typing.Callable = sa_func.avg,
         datetime_range: tuple[datetime.datetime, datetime.datetime],
     ) -> None:
+        cls.flush()
         session = db.get_db_session()
 
         aggregated_data = cls.get_aggregated(
@@ -292,9 +553,11 @@ class Signal(db.Base):
                 )
                 for item in aggregated_data
             )
+            rebuild_rollups(session, cls, signal_type, datetime_range=datetime_range)
 
     @classmethod
     def backup(cls, datetime_range: typing.Optional[tuple[datetime.datetime, datetime.datetime]] = None) -> None:
+        cls.flush()
         filters: tuple[ColumnElement[bool], ...]
 
         if datetime_range is None:
@@ -341,6 +604,7 @@ class Signal(db.Base):
 
     @classmethod
     def get_table_stats(cls) -> dict[str, int]:
+        cls.flush()
         session = db.get_db_session()
 
         all_types = (item[0] for item in session.query(cls.type.distinct()).all())
@@ -354,27 +618,25 @@ class Signal(db.Base):
         *,
         datetime_range: tuple[datetime.datetime, datetime.datetime],
     ) -> typing.Optional[dict[str, typing.Any]]:
-        time_filter = (
+        first_time: typing.Optional[datetime.datetime]
+        last_time: typing.Optional[datetime.datetime]
+        first_time, last_time = (
             db.get_db_session()
             .query(
-                cls.received_at,
+                sa_func.min(cls.received_at),
+                sa_func.max(cls.received_at),
             )
             .filter(
-                cls.received_at >= datetime_range[0],
-                cls.received_at <= datetime_range[1],
                 cls.type == signal_type,
+                cls.received_at.between(datetime_range[0], datetime_range[1]),
                 cls.value.isnot(None),
             )
+            .one()
         )
-        first_time: datetime.datetime = time_filter.order_by(cls.received_at).first()  # type: ignore
-        last_time: datetime.datetime = time_filter.order_by(cls.received_at.desc()).first()  # type: ignore
 
-        if not first_time or not last_time:
+        if first_time is None or last_time is None:
             return None
 
-        first_time: datetime.datetime = first_time[0]  # type: ignore
-        last_time: datetime.datetime = last_time[0]  # type: ignore
-
         diff = last_time - first_time
 
         if diff < datetime.timedelta(minutes=2):
@@ -387,3 +649,56 @@ class Signal(db.Base):
             'start_time': first_time,
             'end_time': last_time,
         }
+
+
+def get_kept_mask(
+    values: np.ndarray,
+    epochs: np.ndarray,
+    *,
+    approximation_value: float,
+    approximation_time: datetime.timedelta,
+) -> np.ndarray:
+    """
+    Returns the mask of signals that are kept by `Signal.compress`. `epochs` are sorted.
+    Every kept signal depends on the previous kept one, so windows after it are checked by arrays
+    until the next kept signal is found, and windows grow to take long runs of removed signals by few steps.
+    """
+
+    size = len(values)
+    is_kept = np.zeros(size, dtype=bool)
+
+    if not size:
+        return is_kept
+
+    is_kept[0] = is_kept[-1] = True
+    is_next_far = np.zeros(size, dtype=bool)
+    is_next_far[:-1] = np.abs(np.diff(values)) > approximation_value
+    # Signals from these indexes are too late to be removed after a kept signal at the same position.
+    time_limits = np.searchsorted(epochs, epochs + approximation_time.total_seconds(), side='right')
+    last_kept = 0
+
+    while last_kept + 1 < size - 1:
+        limit = min(time_limits[last_kept], size - 1)
+        next_kept = limit
+        start = last_kept + 1
+        step = 16
+
+        while start < limit:
+            end = min(start + step, limit)
+            is_far = is_next_far[start:end] | (np.abs(values[start:end] - values[last_kept]) > approximation_value)
+            far_indexes = np.flatnonzero(is_far)
+
+            if far_indexes.size:
+                next_kept = start + int(far_indexes[0])
+                break
+
+            start = end
+            step *= 2
+
+        is_kept[next_kept] = True
+        last_kept = next_kept
+
+    return is_kept
+
+
+signal_buffer = SignalBuffer(max_size=100, max_delay=datetime.timedelta(seconds=30), max_kept_size=100_000)
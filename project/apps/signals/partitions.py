@@ -0,0 +1,194 @@
+import datetime
+import logging
+import typing
+
+from sqlalchemy import Connection, text
+
+
+__all__ = (
+    'clear_default_partition',
+    'create_partitions',
+    'drop_partitions',
+    'is_partitioned',
+    'partition_table',
+)
+
+
+# Partitions are by UTC days.
+PARTITION_PREFIX = 'signals_'
+DEFAULT_PARTITION = 'signals_default'
+DAYS_AHEAD = 7
+
+
+def is_partitioned(connection: Connection) -> bool:
+    if connection.dialect.name != 'postgresql':
+        return False
+
+    return bool(
+        connection.execute(
+            text('SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(\'signals\')'),
+        ).first()
+    )
+
+
+def partition_table(connection: Connection) -> None:
+    """
+    Replaces the plain `signals` table by the table partitioned by `received_at` and moves rows to it.
+    IDs are kept, and the primary key is extended by `received_at`, because Postgres requires it.
+    """
+
+    logging.info('Partitioning of signals...')
+
+    for statement in (
+        'ALTER TABLE signals RENAME TO signals_old',
+        'ALTER INDEX signals_pkey RENAME TO signals_old_pkey',
+        'DROP INDEX IF EXISTS ix_signals_type',
+        'DROP INDEX IF EXISTS ix_signals_received_at',
+        'DROP INDEX IF EXISTS ix_signals_type_received_at',
+        'ALTER SEQUENCE signals_id_seq OWNED BY NONE',
+        (
+            'CREATE TABLE signals ('
+            'id INTEGER NOT NULL DEFAULT nextval(\'signals_id_seq\'), '
+            'type TEXT NOT NULL, '
+            'value FLOAT NOT NULL, '
+            'received_at TIMESTAMP WITH TIME ZONE NOT NULL, '
+            'PRIMARY KEY (id, received_at)'
+            ') PARTITION BY RANGE (received_at)'
+        ),
+        'ALTER SEQUENCE signals_id_seq OWNED BY signals.id',
+        'CREATE INDEX ix_signals_received_at ON signals (received_at)',
+        'CREATE INDEX ix_signals_type_received_at ON signals (type, received_at)',
+    ):
+        connection.execute(text(statement))
+
+    first_time = connection.execute(text('SELECT min(received_at) FROM signals_old')).scalar()
+    create_partitions(connection, since=first_time)
+
+    connection.execute(
+        text('INSERT INTO signals (id, type, value, received_at) SELECT id, type, value, received_at FROM signals_old')
+    )
+    connection.execute(text('DROP TABLE signals_old'))
+
+
+def create_partitions(connection: Connection, *, since: typing.Optional[datetime.datetime] = None) -> None:
+    """
+    Creates missed partitions from the day of `since` (today by default) to `DAYS_AHEAD` days ahead
+    and the default partition for rows out of them.
+    A partition can't be created while the default partition has rows of its day
+    (after clock skew or missed daily runs), so such rows are moved to the new partition.
+    A failed partition is logged and skipped, so its rows stay in the default partition till the next run.
+    """
+
+    today = datetime.datetime.now(datetime.timezone.utc).date()
+    day = today if since is None else since.astimezone(datetime.timezone.utc).date()
+
+    while day <= today + datetime.timedelta(days=DAYS_AHEAD):
+        try:
+            with connection.begin_nested():
+                _create_partition(connection, day=day)
+        except Exception as e:
+            logging.exception(e)
+
+        day += datetime.timedelta(days=1)
+
+    connection.execute(text(f'CREATE TABLE IF NOT EXISTS {DEFAULT_PARTITION} PARTITION OF signals DEFAULT'))
+
+
+def _create_partition(connection: Connection, *, day: datetime.date) -> None:
+    partition_name = f'{PARTITION_PREFIX}{day:%Y%m%d}'
+
+    if connection.execute(text(f'SELECT to_regclass(\'{partition_name}\')')).scalar() is not None:
+        return
+
+    next_day = day + datetime.timedelta(days=1)
+    bounds = f'FOR VALUES FROM (\'{day.isoformat()} 00:00:00+00\') TO (\'{next_day.isoformat()} 00:00:00+00\')'
+    range_params = {
+        'started_at': datetime.datetime.combine(day, datetime.time(), tzinfo=datetime.timezone.utc),
+        'finished_at': datetime.datetime.combine(next_day, datetime.time(), tzinfo=datetime.timezone.utc),
+    }
+    has_default_rows = False
+
+    if connection.execute(text(f'SELECT to_regclass(\'{DEFAULT_PARTITION}\')')).scalar() is not None:
+        default_row = connection.execute(
+            text(
+                f'SELECT 1 FROM {DEFAULT_PARTITION} '
+                'WHERE received_at >= :started_at AND received_at < :finished_at LIMIT 1'
+            ),
+            range_params,
+        ).first()
+        has_default_rows = default_row is not None
+
+    if not has_default_rows:
+        connection.execute(text(f'CREATE TABLE {partition_name} PARTITION OF signals {bounds}'))
+        return
+
+    # The rows are moved to a standalone table that is attached after it,
+    # because Postgres checks that the default partition has no rows of the new one.
+    connection.execute(text(f'CREATE TABLE {partition_name} (LIKE signals INCLUDING DEFAULTS)'))
+    moved_count = connection.execute(
+        text(
+            f'WITH moved AS ('
+            f'DELETE FROM {DEFAULT_PARTITION} '
+            'WHERE received_at >= :started_at AND received_at < :finished_at '
+            'RETURNING id, type, value, received_at'
+            ') '
+            f'INSERT INTO {partition_name} (id, type, value, received_at) '
+            'SELECT id, type, value, received_at FROM moved'
+        ),
+        range_params,
+    ).rowcount
+    connection.execute(text(f'ALTER TABLE signals ATTACH PARTITION {partition_name} {bounds}'))
+    logging.info('%s signals are moved from %s to %s', moved_count, DEFAULT_PARTITION, partition_name)
+
+
+def drop_partitions(connection: Connection, *, before: datetime.datetime) -> list[str]:
+    """
+    Drops partitions that end before `before`. It doesn't touch rows of other partitions.
+    Returns names of the dropped partitions.
+    """
+
+    partition_names: typing.Sequence[str] = (
+        connection.execute(
+            text(
+                'SELECT child.relname FROM pg_inherits '
+                'JOIN pg_class AS child ON child.oid = pg_inherits.inhrelid '
+                'WHERE pg_inherits.inhparent = to_regclass(\'signals\')'
+            )
+        )
+        .scalars()
+        .all()
+    )
+    last_day = before.astimezone(datetime.timezone.utc).date() - datetime.timedelta(days=1)
+    dropped_partition_names = []
+
+    for partition_name in partition_names:
+        if partition_name == DEFAULT_PARTITION or not partition_name.startswith(PARTITION_PREFIX):
+            continue
+
+        day = datetime.datetime.strptime(partition_name.removeprefix(PARTITION_PREFIX), '%Y%m%d').date()
+
+        if day <= last_day:
+            connection.execute(text(f'DROP TABLE IF EXISTS {partition_name}'))
+            dropped_partition_names.append(partition_name)
+
+    if dropped_partition_names:
+        logging.info('Partitions %s are dropped', ', '.join(dropped_partition_names))
+
+    return dropped_partition_names
+
+
+def clear_default_partition(connection: Connection, *, before: datetime.datetime) -> int:
+    """
+    Deletes rows of the default partition received before `before`, because it's never dropped.
+    Returns the count of the deleted rows.
+    """
+
+    deleted_count = connection.execute(
+        text(f'DELETE FROM {DEFAULT_PARTITION} WHERE received_at < :before'),
+        {'before': before},
+    ).rowcount
+
+    if deleted_count:
+        logging.info('%s signals are deleted from %s', deleted_count, DEFAULT_PARTITION)
+
+    return deleted_count
@@ -0,0 +1,343 @@
+import datetime
+import typing
+
+import sqlalchemy
+from sqlalchemy import case as sa_case, func as sa_func
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+from .. import db
+
+
+__all__ = (
+    'BaseSignalRollup',
+    'HourSignalRollup',
+    'MinuteSignalRollup',
+    'ROLLUPS',
+    'floor_time',
+    'get_aggregate',
+    'merge_aggregates',
+    'rebuild_rollups',
+    'select_parts',
+    'split_range',
+)
+
+
+_EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+class BaseSignalRollup:
+    """
+    Aggregates of signals by types and buckets of `period`.
+    They are updated with every inserted batch of signals and rebuilt for ranges of compressed signals,
+    so rollups and signals give the same aggregates.
+    """
+
+    period: typing.ClassVar[datetime.timedelta]
+
+    type = sqlalchemy.Column(
+        sqlalchemy.Text,
+        primary_key=True,
+    )
+    bucket = sqlalchemy.Column(
+        sqlalchemy.DateTime(timezone=True),
+        primary_key=True,
+    )
+    sum = sqlalchemy.Column(
+        sqlalchemy.Float,
+        nullable=False,
+    )
+    count = sqlalchemy.Column(
+        sqlalchemy.Integer,
+        nullable=False,
+    )
+    min = sqlalchemy.Column(
+        sqlalchemy.Float,
+        nullable=False,
+    )
+    max = sqlalchemy.Column(
+        sqlalchemy.Float,
+        nullable=False,
+    )
+
+    @classmethod
+    def add(cls, session: Session, rows: typing.Iterable[dict[str, typing.Any]]) -> None:
+        aggregates: dict[tuple[str, datetime.datetime], dict[str, typing.Any]] = {}
+
+        for row in rows:
+            key = (row['type'], floor_time(row['received_at'], cls.period))
+            aggregate = aggregates.get(key)
+
+            if aggregate is None:
+                aggregates[key] = {
+                    'type': key[0],
+                    'bucket': key[1],
+                    'sum': row['value'],
+                    'count': 1,
+                    'min': row['value'],
+                    'max': row['value'],
+                }
+            else:
+                aggregate['sum'] += row['value']
+                aggregate['count'] += 1
+                aggregate['min'] = min(aggregate['min'], row['value'])
+                aggregate['max'] = max(aggregate['max'], row['value'])
+
+        if not aggregates:
+            return
+
+        dialect_module = postgresql if session.get_bind().dialect.name == 'postgresql' else sqlite
+        statement = dialect_module.insert(cls).values(list(aggregates.values()))
+        excluded = statement.excluded
+        table = cls.__table__  # type: ignore
+
+        session.execute(
+            statement.on_conflict_do_update(
+                index_elements=(table.c.type, table.c.bucket),
+                set_={
+                    'sum': table.c.sum + excluded.sum,
+                    'count': table.c.count + excluded.count,
+                    'min': sa_case((excluded.min < table.c.min, excluded.min), else_=table.c.min),
+                    'max': sa_case((excluded.max > table.c.max, excluded.max), else_=table.c.max),
+                },
+            )
+        )
+
+    @classmethod
+    def rebuild(
+        cls,
+        session: Session,
+        signal_model: typing.Any,
+        signal_type: str,
+        *,
+        datetime_range: tuple[datetime.datetime, datetime.datetime],
+    ) -> None:
+        """
+        Replaces buckets that overlap the range by aggregates of the current signals of these buckets.
+        """
+
+        start = floor_time(datetime_range[0], cls.period)
+        end = floor_time(datetime_range[1], cls.period) + cls.period
+        table = cls.__table__  # type: ignore
+        session.execute(
+            sqlalchemy.delete(table).where(
+                table.c.type == signal_type,
+                table.c.bucket >= start,
+                table.c.bucket < end,
+            )
+        )
+        rows = session.execute(
+            sqlalchemy.select(
+                signal_model.type,
+                signal_model.value,
+                signal_model.received_at,
+            ).where(
+                signal_model.type == signal_type,
+                signal_model.received_at >= start,
+                signal_model.received_at < end,
+                signal_model.value.isnot(None),
+            )
+        )
+        cls.add(session, (row._asdict() for row in rows))
+
+    @classmethod
+    def clear(cls, session: Session, *, signal_types: typing.Iterable[str], before: datetime.datetime) -> None:
+        table = cls.__table__  # type: ignore
+        session.execute(
+            sqlalchemy.delete(table).where(
+                table.c.type.in_(signal_types),
+                table.c.bucket < before,
+            )
+        )
+
+
+class MinuteSignalRollup(BaseSignalRollup, db.Base):
+    __tablename__ = 'signal_rollups_1m'
+
+    period = datetime.timedelta(minutes=1)
+
+
+class HourSignalRollup(BaseSignalRollup, db.Base):
+    __tablename__ = 'signal_rollups_1h'
+
+    period = datetime.timedelta(hours=1)
+
+
+# From the coarsest one.
+ROLLUPS: tuple[typing.Type[BaseSignalRollup], ...] = (
+    HourSignalRollup,
+    MinuteSignalRollup,
+)
+
+
+def floor_time(timestamp: datetime.datetime, period: datetime.timedelta) -> datetime.datetime:
+    """
+    Buckets are aligned by UTC.
+    """
+
+    epoch = _EPOCH if timestamp.tzinfo is not None else _EPOCH.replace(tzinfo=None)
+
+    return timestamp - (timestamp - epoch) % period
+
+
+def rebuild_rollups(
+    session: Session,
+    signal_model: typing.Any,
+    signal_type: str,
+    *,
+    datetime_range: tuple[datetime.datetime, datetime.datetime],
+) -> None:
+    for rollup in ROLLUPS:
+        rollup.rebuild(session, signal_model, signal_type, datetime_range=datetime_range)
+
+
+def split_range(
+    start: datetime.datetime,
+    end: datetime.datetime,
+    rollups: typing.Sequence[typing.Type[BaseSignalRollup]] = ROLLUPS,
+) -> list[tuple[typing.Optional[typing.Type[BaseSignalRollup]], datetime.datetime, datetime.datetime]]:
+    """
+    Splits the range [start, end) into parts that are covered by whole buckets of the coarsest possible rollups.
+    The rest of the range is left for signals (`None`).
+    """
+
+    if start >= end:
+        return []
+
+    if not rollups:
+        return [(None, start, end)]
+
+    rollup, *finer_rollups = rollups
+    first_bucket = floor_time(start, rollup.period)
+
+    if first_bucket < start:
+        first_bucket += rollup.period
+
+    last_bucket = floor_time(end, rollup.period)
+
+    if first_bucket >= last_bucket:
+        return split_range(start, end, finer_rollups)
+
+    return [
+        *split_range(start, first_bucket, finer_rollups),
+        (rollup, first_bucket, last_bucket),
+        *split_range(last_bucket, end, finer_rollups),
+    ]
+
+
+def select_parts(
+    signal_model: typing.Any,
+    signal_type: str,
+    *,
+    datetime_range: tuple[datetime.datetime, datetime.datetime],
+    rollups: typing.Sequence[typing.Type[BaseSignalRollup]] = ROLLUPS,
+    bucket: typing.Optional[typing.Callable] = None,
+) -> sqlalchemy.Subquery:
+    """
+    Returns a union of aggregates of the range (`sum`, `count`, `min`, `max`) from rollups and signals.
+    Parts are grouped by `bucket` (a function of a time column) if it's passed.
+    The end of the range is included like in queries of signals.
+    """
+
+    selects = []
+    filters: tuple[typing.Any, ...]
+
+    # Timestamps have microseconds, so the next microsecond excludes only the end.
+    for rollup, start, end in split_range(
+        datetime_range[0],
+        datetime_range[1] + datetime.timedelta(microseconds=1),
+        rollups,
+    ):
+        if rollup is None:
+            time_column = signal_model.received_at
+            filters = (
+                signal_model.type == signal_type,
+                signal_model.received_at >= start,
+                signal_model.received_at < end,
+                signal_model.value.isnot(None),
+            )
+            columns = (
+                sa_func.sum(signal_model.value).label('sum'),
+                sa_func.count(signal_model.value).label('count'),
+                sa_func.min(signal_model.value).label('min'),
+                sa_func.max(signal_model.value).label('max'),
+            )
+        else:
+            time_column = rollup.bucket
+            filters = (
+                rollup.type == signal_type,
+                rollup.bucket >= start,
+                rollup.bucket < end,
+            )
+            columns = (
+                sa_func.sum(rollup.sum).label('sum'),
+                sa_func.sum(rollup.count).label('count'),
+                sa_func.min(rollup.min).label('min'),
+                sa_func.max(rollup.max).label('max'),
+            )
+
+        if bucket is None:
+            selects.append(sqlalchemy.select(*columns).where(*filters))
+        else:
+            selects.append(
+                sqlalchemy.select(bucket(time_column).label('bucket'), *columns)
+                .where(*filters)
+                .group_by(bucket(time_column))
+            )
+
+    return sqlalchemy.union_all(*selects).subquery()
+
+
+def get_aggregate(parts: sqlalchemy.Subquery, function_name: str) -> typing.Optional[sqlalchemy.ColumnElement]:
+    """
+    Returns the aggregate of `parts` that is the same as `function_name` of signals or `None` if it's not supported.
+    """
+
+    if function_name == 'avg':
+        return sa_func.sum(parts.c.sum) / sa_func.nullif(sa_func.sum(parts.c.count), 0)
+
+    if function_name == 'sum':
+        return sa_func.sum(parts.c.sum)
+
+    if function_name == 'count':
+        return sa_func.coalesce(sa_func.sum(parts.c.count), 0)
+
+    if function_name == 'min':
+        return sa_func.min(parts.c.min)
+
+    if function_name == 'max':
+        return sa_func.max(parts.c.max)
+
+    return None
+
+
+def merge_aggregates(
+    function_name: str,
+    parts: tuple[typing.Any, typing.Any, typing.Any, typing.Any],
+    values: typing.Sequence[float],
+) -> typing.Any:
+    """
+    Returns `function_name` of signals from aggregates of parts (`sum`, `count`, `min`, `max`) and other `values`.
+    Only functions of `get_aggregate` are supported.
+    """
+
+    part_sum, part_count, part_min, part_max = parts
+    count = int(part_count or 0) + len(values)
+
+    if function_name == 'count':
+        return count
+
+    if not count:
+        return None
+
+    if function_name in ('avg', 'sum'):
+        total = float(part_sum or 0) + sum(values)
+        return total / count if function_name == 'avg' else total
+
+    if function_name == 'min':
+        return min(value for value in (part_min, *values) if value is not None)
+
+    if function_name == 'max':
+        return max(value for value in (part_max, *values) if value is not None)
+
+    raise ValueError(f'{function_name} is not supported')
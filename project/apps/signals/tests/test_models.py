@@ -0,0 +1,209 @@
+import datetime
+import os
+import random
+import unittest
+from unittest import mock
+
+import numpy as np
+import sqlalchemy
+from sqlalchemy import func as sa_func
+
+from .. import models
+from ..rollups import ROLLUPS
+
+
+# See `test_partitions`.
+TEST_POSTGRES_URL = os.environ.get('TEST_POSTGRES_URL')
+
+
+def get_kept_mask_by_loop(
+    values: list[float],
+    epochs: list[float],
+    *,
+    approximation_value: float,
+    approximation_time: datetime.timedelta,
+) -> list[bool]:
+    is_kept = [True] * len(values)
+    last_kept = 0
+
+    for i in range(1, len(values) - 1):
+        cond_1 = epochs[i] - epochs[last_kept] <= approximation_time.total_seconds()
+        cond_2 = abs(values[i] - values[last_kept]) <= approximation_value
+        cond_3 = abs(values[i + 1] - values[i]) <= approximation_value
+
+        if cond_1 and cond_2 and cond_3:
+            is_kept[i] = False
+        else:
+            last_kept = i
+
+    return is_kept
+
+
+class ModelsTestCase(unittest.TestCase):
+    def test_get_kept_mask(self):
+        rand = random.Random(0)
+
+        for size, approximation_value, approximation_time in (
+            (0, 0, datetime.timedelta(hours=1)),
+            (1, 0, datetime.timedelta(hours=1)),
+            (2, 0, datetime.timedelta(hours=1)),
+            (1000, 0, datetime.timedelta(hours=1)),
+            (1000, 1, datetime.timedelta(minutes=1)),
+            (1000, 2, datetime.timedelta(seconds=10)),
+            (1000, 0.5, datetime.timedelta(0)),
+        ):
+            values = [float(rand.choice((20, 20, 20, 21, 22))) for _ in range(size)]
+            epochs = sorted(rand.uniform(0, size * 2) for _ in range(size))
+
+            is_kept = models.get_kept_mask(
+                np.array(values),
+                np.array(epochs),
+                approximation_value=approximation_value,
+                approximation_time=approximation_time,
+            )
+
+            self.assertEqual(
+                is_kept.tolist(),
+                get_kept_mask_by_loop(
+                    values,
+                    epochs,
+                    approximation_value=approximation_value,
+                    approximation_time=approximation_time,
+                ),
+            )
+
+    def test_signal_buffer_keeps_limited_rows_after_errors(self):
+        signal_buffer = models.SignalBuffer(max_size=2, max_delay=datetime.timedelta(hours=1), max_kept_size=3)
+
+        with mock.patch.object(models.db, 'session_transaction', side_effect=RuntimeError('db is down')):
+            with self.assertLogs(level='ERROR'):
+                signal_buffer.add({'value': i} for i in range(2))
+
+            with self.assertLogs(level='WARNING'):
+                signal_buffer.add({'value': i} for i in range(2, 4))
+
+            with self.assertRaises(RuntimeError):
+                signal_buffer.flush()
+
+        self.assertEqual(signal_buffer._rows, [{'value': 1}, {'value': 2}, {'value': 3}])
+
+
+@unittest.skipUnless(TEST_POSTGRES_URL, 'TEST_POSTGRES_URL is not set')
+class DatabaseTestCase(unittest.TestCase):
+    signal_type = 'test'
+
+    def setUp(self):
+        self.engine = sqlalchemy.create_engine(TEST_POSTGRES_URL)
+        self.tables = [models.Signal.__table__, *(rollup.__table__ for rollup in ROLLUPS)]  # type: ignore
+        models.db.Base.metadata.drop_all(self.engine, tables=self.tables)
+        models.db.Base.metadata.create_all(self.engine, tables=self.tables)
+
+        patcher = mock.patch.object(models.db, 'db_engine', self.engine)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        models.db.base.session_factory.configure(bind=self.engine)
+        self.addCleanup(models.db.base.session_factory.configure, bind=models.db.base.db_engine)
+        self.addCleanup(models.db.close_db_session)
+
+        # Values change by steps, so most of them are removed by compressing.
+        self.started_at = datetime.datetime(2020, 1, 1, tzinfo=datetime.timezone.utc)
+        models.signal_buffer.add(
+            {
+                'type': self.signal_type,
+                'value': float(i // 100),
+                'received_at': self.started_at + datetime.timedelta(seconds=10 * i),
+            }
+            for i in range(3 * 360)
+        )
+        models.signal_buffer.flush()
+
+    def tearDown(self):
+        models.signal_buffer.flush()
+        models.db.close_db_session()
+        models.db.Base.metadata.drop_all(self.engine, tables=self.tables)
+        self.engine.dispose()
+
+    def test_rollups_follow_compressed_signals(self):
+        datetime_range = (
+            self.started_at + datetime.timedelta(minutes=5, seconds=30),
+            self.started_at + datetime.timedelta(hours=2, minutes=50, seconds=10),
+        )
+        count = self._get_count(datetime_range)
+
+        for compress in (
+            lambda: models.Signal.compress(self.signal_type, datetime_range=datetime_range),
+            lambda: models.Signal.aggregated_compress(self.signal_type, datetime_range=datetime_range),
+        ):
+            compress()
+            new_count = self._get_count(datetime_range)
+
+            self.assertLess(new_count, count)
+            self.assertEqual(
+                models.Signal.get_one_aggregated(
+                    self.signal_type,
+                    aggregate_function=sa_func.count,
+                    datetime_range=datetime_range,
+                ),
+                new_count,
+            )
+            self.assertEqual(
+                sum(
+                    item.value
+                    for item in models.Signal.get_aggregated(
+                        self.signal_type,
+                        aggregate_function=sa_func.count,
+                        datetime_range=datetime_range,
+                    )
+                ),
+                new_count,
+            )
+            count = new_count
+
+    def test_reads_dont_flush_unneeded_signals(self):
+        received_at = self.started_at + datetime.timedelta(hours=5)
+        datetime_range = (self.started_at, received_at)
+        models.signal_buffer.add(
+            (
+                {'type': self.signal_type, 'value': 100.0, 'received_at': received_at},
+                {'type': 'other', 'value': 1.0, 'received_at': received_at},
+            )
+        )
+        pending_results = [
+            models.Signal.get_one_aggregated(
+                self.signal_type,
+                aggregate_function=aggregate_function,
+                datetime_range=datetime_range,
+            )
+            for aggregate_function in (sa_func.avg, sa_func.count, sa_func.max)
+        ]
+
+        self.assertEqual(pending_results[1:], [3 * 360 + 1, 100])
+        self.assertEqual(len(models.signal_buffer), 2)
+
+        # The buffered signals are out of the range.
+        signals = models.Signal.get(
+            self.signal_type,
+            datetime_range=(self.started_at, self.started_at + datetime.timedelta(hours=1)),
+        )
+
+        self.assertEqual(len(signals), 361)
+        self.assertEqual(len(models.signal_buffer), 2)
+
+        models.signal_buffer.flush()
+
+        self.assertAlmostEqual(
+            models.Signal.get_one_aggregated(self.signal_type, datetime_range=datetime_range),
+            pending_results[0],
+        )
+
+    def _get_count(self, datetime_range: tuple[datetime.datetime, datetime.datetime]) -> int:
+        return (
+            models.db.get_db_session()
+            .query(sa_func.count(models.Signal.id))
+            .filter(
+                models.Signal.type == self.signal_type,
+                models.Signal.received_at >= datetime_range[0],
+                models.Signal.received_at <= datetime_range[1],
+            )
+            .scalar()
+        )
@@ -0,0 +1,101 @@
+import datetime
+import os
+import unittest
+
+import sqlalchemy
+from sqlalchemy import text
+
+from .. import partitions
+from ..models import Signal
+
+
+# Partitions need Postgres, so the tests run only with a database that can be dropped,
+# e.g. TEST_POSTGRES_URL=postgresql://postgres@localhost/test.
+TEST_POSTGRES_URL = os.environ.get('TEST_POSTGRES_URL')
+
+
+@unittest.skipUnless(TEST_POSTGRES_URL, 'TEST_POSTGRES_URL is not set')
+class PartitionsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.engine = sqlalchemy.create_engine(TEST_POSTGRES_URL)
+        self.now = datetime.datetime.now(datetime.timezone.utc)
+        self._drop_tables()
+        Signal.__table__.create(self.engine)  # type: ignore
+
+    def tearDown(self):
+        self._drop_tables()
+        self.engine.dispose()
+
+    def test_partitions(self):
+        old_time = self.now - datetime.timedelta(days=40)
+        future_time = self.now + datetime.timedelta(days=partitions.DAYS_AHEAD + 3)
+
+        with self.engine.begin() as connection:
+            self._insert(connection, old_time, self.now, future_time)
+
+            self.assertFalse(partitions.is_partitioned(connection))
+
+            partitions.partition_table(connection)
+
+            self.assertTrue(partitions.is_partitioned(connection))
+            self.assertEqual(self._get_times(connection, 'signals'), [old_time, self.now, future_time])
+            self.assertEqual(self._get_times(connection, partitions.DEFAULT_PARTITION), [future_time])
+
+            # New rows take IDs after the moved ones.
+            self._insert(connection, self.now)
+            ids = connection.execute(text('SELECT id FROM signals ORDER BY id')).scalars().all()
+
+            self.assertEqual(ids, [1, 2, 3, 4])
+
+        # A row of a day without the partition is kept by the default partition till the partition is created.
+        next_time = self.now + datetime.timedelta(days=2)
+        next_partition = f'{partitions.PARTITION_PREFIX}{next_time:%Y%m%d}'
+
+        with self.engine.begin() as connection:
+            connection.execute(text(f'DROP TABLE {next_partition}'))
+            self._insert(connection, next_time)
+
+            self.assertEqual(self._get_times(connection, partitions.DEFAULT_PARTITION), [next_time, future_time])
+
+            partitions.create_partitions(connection)
+
+            self.assertEqual(self._get_times(connection, partitions.DEFAULT_PARTITION), [future_time])
+            self.assertEqual(self._get_times(connection, next_partition), [next_time])
+
+        with self.engine.begin() as connection:
+            before = self.now - datetime.timedelta(days=30)
+            dropped_partition_names = partitions.drop_partitions(connection, before=before)
+
+            self.assertEqual(
+                sorted(dropped_partition_names),
+                [
+                    f'{partitions.PARTITION_PREFIX}{old_time + datetime.timedelta(days=i):%Y%m%d}'
+                    for i in range((before.date() - old_time.date()).days)
+                ],
+            )
+            self.assertEqual(self._get_times(connection, 'signals'), [self.now, self.now, next_time, future_time])
+
+            self.assertEqual(partitions.clear_default_partition(connection, before=self.now), 0)
+            self.assertEqual(
+                partitions.clear_default_partition(connection, before=future_time + datetime.timedelta(seconds=1)),
+                1,
+            )
+            self.assertEqual(self._get_times(connection, partitions.DEFAULT_PARTITION), [])
+
+    def _drop_tables(self) -> None:
+        with self.engine.begin() as connection:
+            connection.execute(text('DROP TABLE IF EXISTS signals, signals_old CASCADE'))
+            connection.execute(text('DROP SEQUENCE IF EXISTS signals_id_seq'))
+
+    @staticmethod
+    def _insert(connection: sqlalchemy.Connection, *times: datetime.datetime) -> None:
+        connection.execute(
+            sqlalchemy.insert(Signal),
+            [{'type': 'test', 'value': 1, 'received_at': received_at} for received_at in times],
+        )
+
+    @staticmethod
+    def _get_times(connection: sqlalchemy.Connection, table_name: str) -> list[datetime.datetime]:
+        return list(
+            connection.execute(text(f'SELECT received_at FROM {table_name} ORDER BY received_at')).scalars().all()
+        )
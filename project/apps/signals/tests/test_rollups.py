@@ -0,0 +1,50 @@
+import datetime
+import unittest
+
+from .. import rollups
+
+
+class RollupsTestCase(unittest.TestCase):
+    def test_floor_time(self):
+        timestamp = datetime.datetime(2020, 1, 1, 12, 34, 56, tzinfo=datetime.timezone(datetime.timedelta(hours=3)))
+
+        self.assertEqual(
+            rollups.floor_time(timestamp, datetime.timedelta(minutes=1)),
+            timestamp.replace(second=0),
+        )
+        self.assertEqual(
+            rollups.floor_time(timestamp, datetime.timedelta(hours=1)),
+            timestamp.replace(minute=0, second=0),
+        )
+
+    def test_split_range(self):
+        def get_time(hour: int, minute: int, second: int = 0) -> datetime.datetime:
+            return datetime.datetime(2020, 1, 1, hour, minute, second, tzinfo=datetime.timezone.utc)
+
+        self.assertEqual(
+            rollups.split_range(get_time(9, 45, 30), get_time(11, 15, 10)),
+            [
+                (None, get_time(9, 45, 30), get_time(9, 46)),
+                (rollups.MinuteSignalRollup, get_time(9, 46), get_time(10, 0)),
+                (rollups.HourSignalRollup, get_time(10, 0), get_time(11, 0)),
+                (rollups.MinuteSignalRollup, get_time(11, 0), get_time(11, 15)),
+                (None, get_time(11, 15), get_time(11, 15, 10)),
+            ],
+        )
+        self.assertEqual(
+            rollups.split_range(get_time(9, 45, 30), get_time(9, 45, 50)),
+            [(None, get_time(9, 45, 30), get_time(9, 45, 50))],
+        )
+        self.assertEqual(rollups.split_range(get_time(10, 0), get_time(10, 0)), [])
+
+    def test_merge_aggregates(self):
+        parts = (6.0, 3, 1.0, 3.0)
+
+        self.assertEqual(rollups.merge_aggregates('avg', parts, [10.0]), 4)
+        self.assertEqual(rollups.merge_aggregates('sum', parts, [10.0]), 16)
+        self.assertEqual(rollups.merge_aggregates('count', parts, [10.0]), 4)
+        self.assertEqual(rollups.merge_aggregates('min', parts, [0.5]), 0.5)
+        self.assertEqual(rollups.merge_aggregates('max', parts, [10.0]), 10)
+        self.assertEqual(rollups.merge_aggregates('max', (None, None, None, None), [2.0]), 2)
+        self.assertEqual(rollups.merge_aggregates('count', (None, None, None, None), []), 0)
+        self.assertIsNone(rollups.merge_aggregates('avg', (None, None, None, None), []))